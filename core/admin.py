@@ -1,6 +1,10 @@
+from django import forms
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, PatientProfile, DoctorProfile, Appointment
+from django.db.models import Q
+from .models import User, PatientProfile, DoctorProfile, Appointment, normalize_search
+from .decorator import map_availability_days
+from .pagination import EstimatedCountPaginator
 
 
 # ------------------------
@@ -26,12 +30,38 @@ class CustomUserAdmin(BaseUserAdmin):
     ordering = ("email",)
 
 
+# ------------------------
+# Indexed prefix search
+# ------------------------
+# The admin's default search is UPPER(column) LIKE '%term%' over every row;
+# these match the start of indexed columns instead: the doctor's search_text
+# (name and specialization, lower-cased) and the patient's email.
+def matching_doctors(term):
+    return DoctorProfile.objects.filter(search_text__startswith=normalize_search(term))
+
+
+def matching_patients(term):
+    return PatientProfile.objects.filter(user__email__startswith=term)
+
+
 # ------------------------
 # Patient Admin
 # ------------------------
 @admin.register(PatientProfile)
 class PatientAdmin(admin.ModelAdmin):
     list_display = ("user", "phone", "address")
+    list_select_related = ("user",)
+    search_fields = ("user__email",)
+    search_help_text = "Start of the email address."
+    # also the raw id lookup of the appointment form
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        return queryset.filter(id__in=matching_patients(term).values("id")), False
 
     # filter users so only PATIENT role appears
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
@@ -43,9 +73,42 @@ class PatientAdmin(admin.ModelAdmin):
 # ------------------------
 # Doctor Admin
 # ------------------------
+class DoctorProfileForm(forms.ModelForm):
+    # edit the availability bitmask as weekday checkboxes
+    availability = forms.TypedMultipleChoiceField(
+        choices=list(enumerate(map_availability_days(range(7)))),
+        coerce=int,
+        required=False,
+        widget=forms.CheckboxSelectMultiple,
+    )
+
+    class Meta:
+        model = DoctorProfile
+        exclude = ("availability_mask",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.initial["availability"] = self.instance.availability
+
+    def clean(self):
+        cleaned_data = super().clean()
+        self.instance.availability = cleaned_data.get("availability", [])
+        return cleaned_data
+
+
 @admin.register(DoctorProfile)
 class DoctorAdmin(admin.ModelAdmin):
-    list_display = ("user", "specialization", "availability")
+    form = DoctorProfileForm
+    list_display = ("user", "specialization", "availability_days")
+    list_select_related = ("user",)
+    search_fields = ("search_text",)
+    search_help_text = "Start of the name, or of the name and specialization."
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        return queryset.filter(id__in=matching_doctors(term).values("id")), False
 
     # filter users so only DOCTOR role appears
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
@@ -60,8 +123,31 @@ class DoctorAdmin(admin.ModelAdmin):
 @admin.register(Appointment)
 class AppointmentAdmin(admin.ModelAdmin):
     list_display = ("patient", "doctor", "date", "status")
-    list_filter = ("status", "date")
-    search_fields = ("patient__user__username", "doctor__user__username")
+    # both names come from the users, joined into the page's one query
+    list_select_related = ("patient__user", "doctor__user")
+    list_filter = ("status",)
+    # bounds and drill-down read the appt_date index
+    date_hierarchy = "date"
+    ordering = ("-date",)
+    search_fields = ("=id", "doctor__search_text", "patient__user__email")
+    search_help_text = "Appointment id, start of the doctor's name, or start of the patient's email."
+    # no COUNT(*) over the whole table, neither for the page count nor the total
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # an id box instead of a <select> listing every patient and doctor
+    raw_id_fields = ("patient", "doctor")
+
+    def get_search_results(self, request, queryset, search_term):
+        # the few matching profiles first, then their appointments through the (doctor|patient, date) indexes
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        matches = Q(doctor_id__in=matching_doctors(term).values("id")) | Q(
+            patient_id__in=matching_patients(term).values("id")
+        )
+        if term.isdigit():
+            matches |= Q(id=int(term))
+        return queryset.filter(matches), False
 
 
 # ------------------------
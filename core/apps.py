@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "core"
+
+    def ready(self):
+        from . import counters, markers, search, sharding, slots, stats  # noqa: F401  (registers signal receivers)
+        # after markers: a write is published no earlier than its marker moved
+        from . import events  # noqa: F401
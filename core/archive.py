@@ -0,0 +1,95 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.counters import invalidate_summaries
+from core.markers import touch
+from core.models import Appointment, ArchivedAppointment
+from core.sharding import shards
+from core.stats import settle_archived
+
+
+def wants_archive(request):
+    """Whether the user asked for older data (?archived=1) as well as the hot table."""
+    return request.GET.get("archived") == "1"
+
+
+def archivable(now=None):
+    """
+    Rows past the retention window: anything dated more than
+    ARCHIVE_AFTER_DAYS ago, and rejected or expired requests dated more than
+    ARCHIVE_REJECTED_AFTER_DAYS ago.
+    """
+    now = now or timezone.now()
+    return Q(date__lt=now - timedelta(days=settings.ARCHIVE_AFTER_DAYS)) | Q(
+        status__in=["REJECTED", "PENDING"],
+        date__lt=now - timedelta(days=settings.ARCHIVE_REJECTED_AFTER_DAYS),
+    )
+
+
+def archive_appointments(batch_size=1000, max_batches=None, log=None):
+    """
+    Move archivable appointments to ArchivedAppointment, `batch_size` rows
+    per transaction: copy, then delete from the hot table. Every batch is
+    committed on its own, so a run that stops half way leaves no row in
+    both tables or in neither, and the next run carries on.
+
+    Rows are visited in primary-key order, so the whole table is read once
+    per run through the primary key, without an index on date. With
+    sharding on, each shard archives into its own archive table.
+    Returns the number of appointments archived.
+    """
+    log = log or (lambda message: None)
+    archived = batches = 0
+
+    for db in shards():
+        last_id = 0
+        while max_batches is None or batches < max_batches:
+            now = timezone.now()
+            ids = list(
+                Appointment.objects.using(db).filter(archivable(now), id__gt=last_id)
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+            archived += _archive_batch(ids, now, db)
+            batches += 1
+            log(f"{archived} archived, up to id {last_id}" + (f" on {db}" if db else ""))
+
+    return archived
+
+
+def _archive_batch(ids, now, db=None):
+    with transaction.atomic(using=db):
+        # re-checked under the lock: a request approved since is no longer archivable
+        rows = list(Appointment.objects.using(db).select_for_update().filter(archivable(now), id__in=ids))
+        ArchivedAppointment.objects.using(db).bulk_create([
+            ArchivedAppointment(
+                id=appt.id,
+                patient_id=appt.patient_id,
+                doctor_id=appt.doctor_id,
+                reason=appt.reason,
+                date=appt.date,
+                status=appt.current_status,
+                doctor_message=appt.doctor_message,
+                rejection_message=appt.current_rejection_message,
+            )
+            for appt in rows
+        ])
+        # a plain DELETE: the per-row post_delete receivers would each run their
+        # own queries; the caches and markers are updated once per batch below
+        hot = Appointment.objects.using(db).filter(id__in=[appt.id for appt in rows])
+        hot._raw_delete(hot.db)
+        settle_archived(rows, db)
+
+        doctor_ids = {appt.doctor_id for appt in rows}
+        patient_ids = {appt.patient_id for appt in rows}
+        touch(doctor_ids, patient_ids)
+        if settings.DASHBOARD_COUNTER_CACHE:
+            invalidate_summaries(doctor_ids, patient_ids, db)
+    return len(rows)
@@ -0,0 +1,22 @@
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth import get_user_model
+
+
+class ProfileBackend(ModelBackend):
+    """
+    ModelBackend that loads the logged-in user together with its doctor or
+    patient profile (LEFT JOINs), so request.user.doctor_profile /
+    request.user.patient_profile cost no extra query.
+    """
+
+    def _users(self):
+        return get_user_model()._default_manager.select_related("doctor_profile", "patient_profile")
+
+    def get_user(self, user_id):
+        user = self._users().filter(pk=user_id).first()
+        return user if user and self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        # request.auser() in async views
+        user = await self._users().filter(pk=user_id).afirst()
+        return user if user and self.user_can_authenticate(user) else None
@@ -0,0 +1,149 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core.models import Appointment, appointments_bulk_updated
+from core.routers import primary_reads
+from core.sharding import across_shards, doctor_db, first_across_shards
+
+
+def _cache_key(field, owner_id):
+    return f"appointment-summary:{field}:{owner_id}"
+
+
+def _owned(field, owner_id):
+    # a doctor's appointments are on one shard, a patient's on any
+    appointments = Appointment.objects.filter(**{f"{field}_id": owner_id})
+    return appointments.using(doctor_db(owner_id)) if field == "doctor" else appointments
+
+
+def _counts(field, owner_id):
+    now = timezone.now()
+    live = Q(status="PENDING", date__gte=now)
+    upcoming = Q(status="APPROVED", date__gte=now)
+    return _owned(field, owner_id), dict(
+        PENDING=Count("id", filter=live),
+        APPROVED=Count("id", filter=Q(status="APPROVED")),
+        REJECTED=Count("id", filter=Q(status="REJECTED") | Q(status="PENDING", date__lt=now)),
+        next_expiry=Min("date", filter=live),
+        upcoming_date=Min("date", filter=upcoming),
+    )
+
+
+def _upcoming(field, owner_id, date):
+    return _owned(field, owner_id).filter(
+        status="APPROVED", date=date
+    ).select_related("patient__user", "doctor__user").order_by("id")
+
+
+def _combine(summaries):
+    """One summary from the per-shard ones: the counts add up, the dates take the earliest."""
+    summary = summaries[0]
+    for other in summaries[1:]:
+        for key, value in other.items():
+            if key in ("PENDING", "APPROVED", "REJECTED"):
+                summary[key] += value
+            elif value is not None and (summary[key] is None or value < summary[key]):
+                summary[key] = value
+    return summary
+
+
+def _valid_until(summary):
+    # the counts go stale by themselves once a pending request expires or the
+    # upcoming appointment starts, even if nothing is written
+    boundaries = [d for d in (summary["next_expiry"], summary["upcoming_date"]) if d]
+    return min(boundaries) if boundaries else None
+
+
+def _is_fresh(summary):
+    return summary is not None and not (summary["valid_until"] and summary["valid_until"] < timezone.now())
+
+
+def appointment_summary(field, owner_id):
+    """
+    Status counts and the next approved appointment of one doctor or patient
+    (`field` is "doctor" or "patient"), counted in a single aggregate query.
+    """
+    appointments, counts = _counts(field, owner_id)
+    summary = _combine([shard.aggregate(**counts) for shard in across_shards(appointments)])
+    summary["upcoming"] = None
+    if summary["upcoming_date"]:
+        summary["upcoming"] = first_across_shards(_upcoming(field, owner_id, summary["upcoming_date"]))
+    summary["valid_until"] = _valid_until(summary)
+    return summary
+
+
+async def aappointment_summary(field, owner_id):
+    """appointment_summary() with the async ORM."""
+    appointments, counts = _counts(field, owner_id)
+    summary = _combine([await shard.aaggregate(**counts) for shard in across_shards(appointments)])
+    summary["upcoming"] = None
+    if summary["upcoming_date"]:
+        for shard in across_shards(_upcoming(field, owner_id, summary["upcoming_date"])):
+            summary["upcoming"] = await shard.afirst()
+            if summary["upcoming"]:
+                break
+    summary["valid_until"] = _valid_until(summary)
+    return summary
+
+
+def dashboard_summary(field, owner_id):
+    if not settings.DASHBOARD_COUNTER_CACHE:
+        return appointment_summary(field, owner_id)
+
+    key = _cache_key(field, owner_id)
+    summary = cache.get(key)
+    if not _is_fresh(summary):
+        with primary_reads():
+            summary = appointment_summary(field, owner_id)
+        cache.set(key, summary, settings.DASHBOARD_COUNTER_CACHE_TIMEOUT)
+    return summary
+
+
+async def adashboard_summary(field, owner_id):
+    if not settings.DASHBOARD_COUNTER_CACHE:
+        return await aappointment_summary(field, owner_id)
+
+    key = _cache_key(field, owner_id)
+    summary = await cache.aget(key)
+    if not _is_fresh(summary):
+        with primary_reads():
+            summary = await aappointment_summary(field, owner_id)
+        await cache.aset(key, summary, settings.DASHBOARD_COUNTER_CACHE_TIMEOUT)
+    return summary
+
+
+def invalidate_summaries(doctor_ids=(), patient_ids=(), using=None):
+    """
+    Drop the cached summaries once the write's transaction on `using` commits
+    (right away outside one): deleted any earlier, a dashboard read before the
+    commit would cache the old counts again.
+    """
+    keys = [_cache_key("doctor", i) for i in set(doctor_ids)]
+    keys += [_cache_key("patient", i) for i in set(patient_ids)]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys), using=using)
+
+
+# ------------------------
+# Invalidation
+# ------------------------
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def appointment_saved(sender, instance, using, **kwargs):
+    if settings.DASHBOARD_COUNTER_CACHE:
+        invalidate_summaries([instance.doctor_id], [instance.patient_id], using)
+
+
+@receiver(appointments_bulk_updated, sender=Appointment)
+def appointments_updated(sender, rows, using=None, **kwargs):
+    if settings.DASHBOARD_COUNTER_CACHE:
+        invalidate_summaries(
+            [row["doctor_id"] for row in rows],
+            [row["patient_id"] for row in rows],
+            using,
+        )
@@ -1,21 +1,81 @@
-from functools import wraps
+from functools import partial, wraps
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.shortcuts import redirect
 from django.contrib.auth.decorators import login_required as django_login_required
 
-def login_required(view_func=None):
+# where to send a logged-in user who opened a page meant for the other role
+ROLE_HOME = {
+    'DOCTOR': 'patient_dashboard',
+    'PATIENT': 'doctor_dashboard',
+}
+
+
+def login_required(view_func=None, role=None):
+    """
+    @login_required, or @login_required(role='DOCTOR'/'PATIENT') to also
+    turn away users of the other role. The role comes from request.user,
+    which is loaded with its profile in one query, so the check is free.
+    Async views are wrapped in an async check that loads the user with
+    request.auser() and stores it as request.user, so request.profile and
+    the templates read it without another query.
+    """
+    if view_func is None:
+        return partial(login_required, role=role)
+
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _wrapped_async_view(request, *args, **kwargs):
+            request.user = await request.auser()
+            refused = _refuse(request, request.user, role)
+            if refused:
+                return refused
+            return await view_func(request, *args, **kwargs)
+        _wrapped_async_view.role = role
+        return markcoroutinefunction(_wrapped_async_view)
+
     @wraps(view_func)
     def _wrapped_view(request, *args, **kwargs):
-        if not request.user.is_authenticated:
-            if request.path.startswith('/patient/'):
-                return redirect(f'/patient/login/?next={request.path}')
-            elif request.path.startswith('/doctor/'):
-                return redirect(f'/doctor/login/?next={request.path}')
-            else:
-                return redirect('/')
+        refused = _refuse(request, request.user, role)
+        if refused:
+            return refused
         return view_func(request, *args, **kwargs)
+    _wrapped_view.role = role
     return _wrapped_view
 
+
+def _refuse(request, user, role):
+    """The redirect for a user who may not open the page, or None."""
+    if not user.is_authenticated:
+        if request.path.startswith('/patient/'):
+            return redirect(f'/patient/login/?next={request.path}')
+        elif request.path.startswith('/doctor/'):
+            return redirect(f'/doctor/login/?next={request.path}')
+        else:
+            return redirect('/')
+    if role and user.role != role:
+        return redirect(ROLE_HOME[role])
+    return None
+
+def days_to_mask(days):
+    """[0, 2] (Monday, Wednesday) -> 0b101"""
+    mask = 0
+    for day in days:
+        mask |= 1 << int(day)
+    return mask
+
+
+def mask_to_days(mask):
+    return [day for day in range(7) if mask & (1 << day)]
+
+
+def masks_with_day(weekday):
+    """Every 7-bit availability mask that includes `weekday`."""
+    return [mask for mask in range(128) if mask & (1 << weekday)]
+
+
 def map_availability_days(availability):
+    if isinstance(availability, int):
+        availability = mask_to_days(availability)
     WEEKDAY_MAP = {
         0: "Monday",
         1: "Tuesday",
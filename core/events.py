@@ -0,0 +1,250 @@
+import asyncio
+import contextvars
+import json
+import logging
+import threading
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core.models import Appointment, DoctorProfile, PatientProfile, appointments_bulk_updated
+from core.sharding import across_shards
+
+logger = logging.getLogger("core.events")
+
+PROFILE_MODELS = {"doctor": DoctorProfile, "patient": PatientProfile}
+
+
+def channel_name(role, profile_id):
+    return f"{role.lower()}:{profile_id}"
+
+
+def appointment_event(kind, appointment):
+    """The JSON-ready event for an appointment row ({id, doctor_id, patient_id, date, status})."""
+    return {
+        "type": kind,
+        "appointment": {
+            "id": appointment["id"],
+            "doctor_id": appointment["doctor_id"],
+            "patient_id": appointment["patient_id"],
+            "date": timezone.localtime(appointment["date"]).isoformat(),
+            "status": appointment["status"],
+        },
+    }
+
+
+def format_event(event):
+    """`event` in text/event-stream framing."""
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+class Subscription:
+    """One open stream: a bounded queue filled from its event loop's thread."""
+
+    def __init__(self, channel, marker, loop):
+        self.channel = channel
+        self.marker = marker  # appointments_changed_at of the profile as last seen
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=settings.SSE_QUEUE_SIZE)
+        self.overflowed = False
+
+    def offer(self, event):
+        # a client that stopped reading is told to refetch instead of growing the queue
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def next_event(self, timeout):
+        """The next event, {"type": "changed"} after an overflow, or None after `timeout` seconds."""
+        if self.overflowed:
+            self.overflowed = False
+            return {"type": "changed"}
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Broker:
+    """
+    In-process fan-out of appointment events to open streams.
+
+    Writes made by this process are delivered as soon as their transaction
+    commits. Writes made elsewhere (other workers, the expiry worker, the
+    admin) are picked up by one poller per event loop, which every
+    SSE_POLL_INTERVAL seconds reads the change markers of all subscribed
+    profiles and the pending requests that expired since the last poll:
+    two or three indexed queries per process, however many streams are open.
+    An idle stream is only a parked coroutine and an empty queue.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}  # channel -> {Subscription}
+        self._published = {}  # channel -> when this process last delivered a write to it
+        self._pollers = {}  # event loop -> poller task
+
+    def subscribe(self, channel, marker):
+        loop = asyncio.get_running_loop()
+        subscription = Subscription(channel, marker, loop)
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+            if loop not in self._pollers:
+                # a fresh context: the poller outlives the request that started it
+                # (create_task's context argument needs Python 3.11)
+                self._pollers[loop] = contextvars.Context().run(loop.create_task, self._poll(loop))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.channel, None)
+                self._published.pop(subscription.channel, None)
+
+    def publish(self, channels, event=None):
+        """
+        Hand `event` to every stream of `channels`; safe from any thread.
+        With event=None the channels are only marked as up to date, so the
+        poller does not report this process's own write a second time.
+        """
+        now = timezone.now()
+        with self._lock:
+            targets = []
+            for channel in channels:
+                if channel in self._subscriptions:
+                    self._published[channel] = now
+                    targets.extend(self._subscriptions[channel])
+        if event is None:
+            return
+        for subscription in targets:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                pass  # its loop has shut down
+
+    async def _poll(self, loop):
+        since = timezone.now()
+        while True:
+            await asyncio.sleep(settings.SSE_POLL_INTERVAL)
+            with self._lock:
+                subscriptions = [
+                    subscription
+                    for subscriptions in self._subscriptions.values()
+                    for subscription in subscriptions
+                    if subscription.loop is loop
+                ]
+                if not subscriptions:
+                    # the next subscriber on this loop starts a new poller
+                    del self._pollers[loop]
+                    return
+
+            until = timezone.now()
+            try:
+                markers, expired = await sync_to_async(poll_changes)(
+                    {subscription.channel for subscription in subscriptions}, since, until
+                )
+            except Exception:
+                logger.exception("polling appointment changes failed")
+                continue
+            since = until
+
+            with self._lock:
+                published = dict(self._published)
+            for subscription in subscriptions:
+                for event in expired.get(subscription.channel, ()):
+                    subscription.offer(event)
+                marker = markers.get(subscription.channel)
+                if marker and marker > subscription.marker:
+                    delivered = published.get(subscription.channel)
+                    # a write made here moved the marker before this process published it
+                    if delivered is None or delivered < marker:
+                        subscription.offer({"type": "changed"})
+                    subscription.marker = marker
+
+
+def poll_changes(channels, since, until):
+    """
+    ({channel: appointments_changed_at}, {channel: [expired events]}) for
+    `channels`; expired covers pending requests whose time passed in (since, until].
+    """
+    ids = {"doctor": set(), "patient": set()}
+    for channel in channels:
+        role, profile_id = channel.split(":")
+        ids[role].add(int(profile_id))
+
+    markers = {}
+    for role, model in PROFILE_MODELS.items():
+        if ids[role]:
+            for pk, marker in model.objects.filter(pk__in=ids[role]).values_list("pk", "appointments_changed_at"):
+                markers[channel_name(role, pk)] = marker
+
+    expired = {}
+    rows = Appointment.objects.filter(
+        Q(doctor_id__in=ids["doctor"]) | Q(patient_id__in=ids["patient"]),
+        status="PENDING", date__gt=since, date__lte=until,
+    ).values("id", "doctor_id", "patient_id", "date")
+    for row in (row for shard in across_shards(rows) for row in shard):
+        event = appointment_event("expired", {**row, "status": "REJECTED"})
+        for role in ("doctor", "patient"):
+            if row[f"{role}_id"] in ids[role]:
+                expired.setdefault(channel_name(role, row[f"{role}_id"]), []).append(event)
+    return markers, expired
+
+
+broker = Broker()
+
+
+# ------------------------
+# Receivers
+# ------------------------
+def _publish(kind, row, status_changed, using):
+    """
+    Send once the transaction on `using` (the database written to) commits:
+    doctors hear about every change, patients about status changes.
+    """
+    doctor, patient = channel_name("doctor", row["doctor_id"]), channel_name("patient", row["patient_id"])
+    event = appointment_event(kind, row)
+
+    def send():
+        broker.publish([doctor], event)
+        broker.publish([patient], event if status_changed else None)
+
+    transaction.on_commit(send, using=using)
+
+
+@receiver(post_save, sender=Appointment)
+def appointment_saved(sender, instance, created, using, **kwargs):
+    loaded = getattr(instance, "_loaded", {})
+    row = {
+        "id": instance.id, "doctor_id": instance.doctor_id, "patient_id": instance.patient_id,
+        "date": instance.date, "status": instance.current_status,
+    }
+    _publish("created" if created else "updated", row, created or loaded.get("status") != instance.status, using)
+
+
+@receiver(post_delete, sender=Appointment)
+def appointment_deleted(sender, instance, using, **kwargs):
+    row = {
+        "id": instance.id, "doctor_id": instance.doctor_id, "patient_id": instance.patient_id,
+        "date": instance.date, "status": instance.current_status,
+    }
+    _publish("deleted", row, True, using)
+
+
+@receiver(appointments_bulk_updated, sender=Appointment)
+def appointments_updated(sender, rows, fields, using, **kwargs):
+    # only plain values can be reported; anything else is left as it was read
+    changes = {name: value for name, value in fields.items()
+               if name in ("date", "status") and isinstance(value, (str, datetime))}
+    for row in rows:
+        new = {**row, **changes}
+        _publish("updated", new, new["status"] != row["status"], using)
@@ -0,0 +1,32 @@
+from django.utils import timezone
+from core.models import Appointment, EXPIRED_MESSAGE
+from core.sharding import across_shards
+
+
+def expire_overdue_appointments(batch_size=1000, max_batches=None):
+    """
+    Flip overdue PENDING appointments to REJECTED, at most `batch_size` rows
+    per UPDATE so each write holds its locks only briefly. With sharding on,
+    the shards are swept one after the other.
+    Returns the number of appointments expired.
+    """
+    expired = 0
+    batches = 0
+
+    for appointments in across_shards(Appointment.objects.all()):
+        while max_batches is None or batches < max_batches:
+            ids = list(
+                appointments.overdue()
+                .order_by("date")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+
+            # status is re-checked so a row approved in the meantime is left alone
+            expired += appointments.filter(
+                id__in=ids, status="PENDING", date__lt=timezone.now()
+            ).update(status="REJECTED", rejection_message=EXPIRED_MESSAGE)
+            batches += 1
+
+    return expired
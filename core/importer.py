@@ -0,0 +1,178 @@
+import csv
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from core.decorator import map_availability_days, days_to_mask
+from core.models import User, DoctorProfile, PatientProfile, InactiveDoctor, normalize_search
+from core.search import FACETS_KEY
+from core.sharding import mirror_users
+
+# name, email, password and role are required; the rest depends on the role
+IMPORT_COLUMNS = ["role", "name", "email", "password", "specialization", "availability", "phone", "address"]
+
+# longest value each column may hold
+MAX_LENGTHS = {"name": 150, "email": 254, "specialization": 100, "phone": 20, "address": 255}
+
+# "Monday" / "mon" / "0" all mean weekday 0
+WEEKDAYS = {}
+for number, day in enumerate(map_availability_days(range(7))):
+    WEEKDAYS[day.lower()] = WEEKDAYS[day[:3].lower()] = WEEKDAYS[str(number)] = number
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = {"DOCTOR": 0, "PATIENT": 0}
+        self.skipped = 0  # email already registered, e.g. on a resumed import
+        self.errors = []  # (row number, message)
+        self.last_row = 0  # last row whose batch is committed
+
+
+def parse_availability(value):
+    days = set()
+    for part in value.replace(";", ",").replace(" ", ",").split(","):
+        part = part.strip().lower()
+        if not part:
+            continue
+        if part not in WEEKDAYS:
+            raise ValidationError(f"unknown weekday '{part}'")
+        days.add(WEEKDAYS[part])
+    return sorted(days)
+
+
+def clean_row(row):
+    """The row normalized for import, or ValidationError with what is wrong with it."""
+    row = {column: (row.get(column) or "").strip() for column in IMPORT_COLUMNS}
+    row["role"] = row["role"].upper()
+    row["email"] = row["email"].lower()
+
+    if row["role"] not in ("DOCTOR", "PATIENT"):
+        raise ValidationError("role must be doctor or patient")
+    for column in ("name", "email", "password"):
+        if not row[column]:
+            raise ValidationError(f"{column} is required")
+    for column, limit in MAX_LENGTHS.items():
+        if len(row[column]) > limit:
+            raise ValidationError(f"{column} is longer than {limit} characters")
+    validate_email(row["email"])
+    if row["role"] == "DOCTOR":
+        if not row["specialization"]:
+            raise ValidationError("specialization is required for doctors")
+        row["availability"] = parse_availability(row["availability"])
+    return row
+
+
+def registered_emails(emails):
+    """Which of the lower-cased `emails` are taken, whatever case they were registered in."""
+    taken = set()
+    for model in (User, InactiveDoctor):
+        taken.update(
+            model.objects.annotate(email_lower=Lower("email"))
+            .filter(email_lower__in=emails).values_list("email_lower", flat=True)
+        )
+    return taken
+
+
+def _init_worker():
+    # spawned workers start without Django configured
+    django.setup()
+
+
+def hash_passwords(passwords, pool, workers):
+    if pool is None:
+        return [make_password(p) for p in passwords]
+    return list(pool.map(make_password, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+
+
+def import_accounts(lines, batch_size=500, workers=None, start_row=2, log=None):
+    """
+    Create doctors and patients from CSV `lines` (an iterable of text lines
+    with a header row, see IMPORT_COLUMNS), streaming it batch by batch.
+
+    Passwords of a batch are hashed in parallel in a process pool (`workers`
+    processes, default IMPORT_HASH_WORKERS; 0 hashes in this process), then
+    the users and profiles of the batch are written with bulk_create in one
+    transaction. Invalid rows are reported with their row number and left
+    out. Rows whose email is already registered are skipped, so running the
+    same file again after a failure picks up where it stopped; `start_row`
+    skips straight to a row (1 is the header).
+    """
+    log = log or (lambda message: None)
+    workers = settings.IMPORT_HASH_WORKERS if workers is None else workers
+    result = ImportResult()
+    reader = csv.DictReader(lines)
+
+    pool = ProcessPoolExecutor(workers, initializer=_init_worker) if workers > 1 else None
+    try:
+        batch = []
+        for row in reader:
+            if reader.line_num < start_row:
+                continue
+            batch.append((reader.line_num, row))
+            if len(batch) == batch_size:
+                _import_batch(batch, pool, workers, result)
+                log(f"row {result.last_row}: {result.created['DOCTOR']} doctors, "
+                    f"{result.created['PATIENT']} patients, {len(result.errors)} errors")
+                batch = []
+        if batch:
+            _import_batch(batch, pool, workers, result)
+    finally:
+        if pool:
+            pool.shutdown()
+        if result.created["DOCTOR"]:
+            # bulk_create sends no post_save, so drop the specialization counts by hand
+            cache.delete(FACETS_KEY)
+    return result
+
+
+def _import_batch(batch, pool, workers, result):
+    rows, seen = [], set()
+    for number, raw in batch:
+        try:
+            row = clean_row(raw)
+        except ValidationError as e:
+            result.errors.append((number, "; ".join(e.messages)))
+            continue
+        if row["email"] in seen:
+            result.errors.append((number, f"{row['email']} appears twice in the file"))
+            continue
+        seen.add(row["email"])
+        rows.append(row)
+
+    taken = registered_emails(seen)
+    result.skipped += len(taken)
+    rows = [row for row in rows if row["email"] not in taken]
+
+    hashes = hash_passwords([row["password"] for row in rows], pool, workers)
+    with transaction.atomic():
+        User.objects.bulk_create([
+            User(email=row["email"], username=row["name"], role=row["role"], password=password)
+            for row, password in zip(rows, hashes)
+        ])
+        user_ids = dict(User.objects.filter(email__in=[row["email"] for row in rows]).values_list("email", "id"))
+
+        DoctorProfile.objects.bulk_create([
+            DoctorProfile(
+                user_id=user_ids[row["email"]],
+                specialization=row["specialization"],
+                availability_mask=days_to_mask(row["availability"]),
+                search_text=normalize_search(f"{row['name']} {row['specialization']}"),
+            )
+            for row in rows if row["role"] == "DOCTOR"
+        ])
+        PatientProfile.objects.bulk_create([
+            PatientProfile(user_id=user_ids[row["email"]], phone=row["phone"], address=row["address"])
+            for row in rows if row["role"] == "PATIENT"
+        ])
+        mirror_users(user_ids.values())
+
+    for row in rows:
+        result.created[row["role"]] += 1
+    result.last_row = batch[-1][0]
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, OperationalError
+from django.utils import timezone
+
+from core.models import User, PatientProfile, DoctorProfile, Appointment, CONFLICT_WINDOW
+from core.views.doctor_views import approve_appointment
+
+
+def overlapping_approvals(field):
+    """Pairs of APPROVED appointments of the same doctor/patient closer than CONFLICT_WINDOW."""
+    clashes = []
+    previous = {}
+    for appt in Appointment.objects.approved().order_by(field, "date"):
+        owner = getattr(appt, field)
+        if owner in previous and appt.date - previous[owner].date <= CONFLICT_WINDOW:
+            clashes.append((previous[owner].id, appt.id))
+        previous[owner] = appt
+    return clashes
+
+
+class Command(BaseCommand):
+    help = (
+        "Approve overlapping requests from many threads at once and check that no two "
+        "overlapping APPROVED appointments exist afterwards. Runs on a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--rounds", type=int, default=20)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        if connection.vendor == "sqlite":
+            # threads need a real file; the in-memory test database is shared-cache only
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(tempfile.mkdtemp(), "approval_race.sqlite3")
+
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = self.run(options["threads"], options["rounds"])
+            violations = overlapping_approvals("doctor_id") + overlapping_approvals("patient_id")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(
+            f"{results['APPROVED']} approved, {results['CONFLICT']} rejected as conflicts, "
+            f"{results[None]} no longer pending, {results['errors']} errors"
+        )
+        if violations:
+            raise CommandError(f"Overlapping APPROVED appointments: {violations}")
+        self.stdout.write(self.style.SUCCESS("No overlapping approvals."))
+
+    def run(self, threads, rounds):
+        results = {"APPROVED": 0, "CONFLICT": 0, None: 0, "errors": 0}
+        lock = threading.Lock()
+        start = timezone.now() + timedelta(days=1)
+
+        def approve(appt, barrier):
+            barrier.wait()
+            # a locked database (the in-memory test database of the test suite does
+            # not wait for locks) rolls the approval back; try again like a client would
+            for attempt in range(100):
+                try:
+                    key, _ = approve_appointment(appt, "race")
+                    break
+                except OperationalError:
+                    key = "errors"
+                    time.sleep(0.01)
+            connection.close()
+            with lock:
+                results[key] += 1
+
+        for n in range(rounds):
+            date = start + timedelta(days=n)
+            doctors = [self.make_profile(DoctorProfile, f"r{n}d{i}", "DOCTOR") for i in range(threads)]
+            patients = [self.make_profile(PatientProfile, f"r{n}p{i}", "PATIENT") for i in range(threads)]
+
+            # one doctor, many patients a few minutes apart, and one patient
+            # asking every doctor for the same time
+            appts = [
+                Appointment.objects.create(doctor=doctors[0], patient=p, reason="race",
+                                           date=date + timedelta(minutes=5 * i))
+                for i, p in enumerate(patients)
+            ] + [
+                Appointment.objects.create(doctor=d, patient=patients[0], reason="race",
+                                           date=date + timedelta(hours=4))
+                for d in doctors
+            ]
+
+            barrier = threading.Barrier(len(appts))
+            workers = [threading.Thread(target=approve, args=(a, barrier)) for a in appts]
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+
+        return results
+
+    def make_profile(self, model, name, role):
+        user = User.objects.create(email=f"{name}@race.local", username=name, role=role)
+        if model is DoctorProfile:
+            return model.objects.create(user=user, specialization="General", availability=list(range(7)))
+        return model.objects.create(user=user)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from core.archive import archive_appointments
+
+
+class Command(BaseCommand):
+    help = (
+        "Move appointments past the retention window (ARCHIVE_AFTER_DAYS, and "
+        "ARCHIVE_REJECTED_AFTER_DAYS for rejected/expired ones) to the archive table, "
+        "in batches. Safe to stop and run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--max-batches", type=int, default=None,
+                            help="Stop after this many batches (default: until nothing is left).")
+
+    def handle(self, *args, **options):
+        log = self.stdout.write if options["verbosity"] > 1 else None
+        archived = archive_appointments(
+            batch_size=options["batch_size"],
+            max_batches=options["max_batches"],
+            log=log,
+        )
+        self.stdout.write(f"Archived {archived} appointment(s).")
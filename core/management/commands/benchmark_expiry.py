@@ -0,0 +1,77 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import User, Appointment, EXPIRED_MESSAGE
+from core.seeding import seed
+
+
+def legacy_sweep():
+    # what every view used to run before rendering
+    Appointment.objects.filter(status="PENDING", date__lt=timezone.now()).update(
+        status="REJECTED", rejection_message=EXPIRED_MESSAGE
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare requests/second of the dashboards and histories with the old "
+        "per-request expiry sweep against the read-time expiry. Runs on a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--appointments", type=int, default=1_000_000)
+        parser.add_argument("--doctors", type=int, default=200)
+        parser.add_argument("--patients", type=int, default=5000)
+        parser.add_argument("--requests", type=int, default=200,
+                            help="Requests per URL and mode.")
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            doctor, patient = self.seed(options)
+            self.run(doctor, patient, options["requests"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self, options):
+        seed(
+            doctors=options["doctors"],
+            patients=options["patients"],
+            appointments=options["appointments"],
+            pending_doctors=0,
+            past_days=2 * 365,
+            log=self.stdout.write,
+        )
+        return (
+            User.objects.filter(role="DOCTOR").order_by("id").first(),
+            User.objects.filter(role="PATIENT").order_by("id").first(),
+        )
+
+    def run(self, doctor, patient, requests):
+        pages = [
+            (doctor, reverse("doctor_dashboard")),
+            (doctor, reverse("doctor_history")),
+            (patient, reverse("patient_dashboard")),
+            (patient, reverse("patient_history")),
+        ]
+
+        # "after" goes first so the legacy sweep has not already cleaned up the overdue rows
+        for mode, before_request in (("after", None), ("before", legacy_sweep)):
+            for user, url in pages:
+                client = Client()
+                client.force_login(user)
+
+                start = time.perf_counter()
+                for _ in range(requests):
+                    if before_request:
+                        before_request()
+                    client.get(url)
+                elapsed = time.perf_counter() - start
+
+                self.stdout.write(f"{mode:<6} {url:<24} {requests / elapsed:8.1f} req/s")
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from core.models import Appointment, DoctorProfile, PatientProfile
+
+from .benchmark_views import percentile
+
+# (mode, command line) of each server; {port} and {workers} are filled in
+SERVERS = {
+    "wsgi": [
+        sys.executable, "-m", "gunicorn", "medibook.wsgi:application", "--bind", "127.0.0.1:{port}",
+        "--workers", "{workers}", "--worker-class", "gthread", "--threads", "{threads}", "--log-level", "warning",
+    ],
+    "asgi": [
+        sys.executable, "-m", "uvicorn", "medibook.asgi:application", "--port", "{port}",
+        "--workers", "{workers}", "--log-level", "warning",
+    ],
+}
+
+# the read-heavy pages, requested as the doctor or the patient of a pending request
+PAGES = [
+    ("doctor", "/doctor/dashboard/"),
+    ("doctor", "/doctor/history/"),
+    ("patient", "/patient/dashboard/"),
+    ("patient", "/patient/history/"),
+    ("patient", "/patient/make-appointment/"),
+    ("patient", "/patient/doctor/{doctor_id}/"),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Start the app under gunicorn (WSGI, gthread workers) and under uvicorn (ASGI) "
+        "and compare throughput and latency of the read-heavy pages while many clients "
+        "send their requests slowly. Uses the configured database as it is; fill it with "
+        "`manage.py seed_data` first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=100, help="Concurrent connections.")
+        parser.add_argument("--slow-clients", type=float, default=0.5,
+                            help="Share of the connections that trickle their request headers.")
+        parser.add_argument("--slow-ms", type=int, default=100,
+                            help="Pause between the header lines a slow client sends.")
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load per server.")
+        parser.add_argument("--workers", type=int, default=2, help="Processes per server.")
+        parser.add_argument("--threads", type=int, default=4, help="Threads per gunicorn worker.")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--servers", default="wsgi,asgi", help="Comma-separated: wsgi, asgi.")
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        appt = Appointment.objects.pending().order_by("id").first()
+        if appt is None:
+            raise CommandError("Need at least one future PENDING appointment; run `manage.py seed_data` first.")
+        cookies = {
+            "doctor": self.session_cookie(DoctorProfile.objects.get(pk=appt.doctor_id).user),
+            "patient": self.session_cookie(PatientProfile.objects.get(pk=appt.patient_id).user),
+        }
+        requests = [(cookies[role], path.format(doctor_id=appt.doctor_id)) for role, path in PAGES]
+
+        results = {"options": {k: options[k] for k in ("clients", "slow_clients", "slow_ms", "duration",
+                                                       "workers", "threads")}, "servers": {}}
+        self.stdout.write(f"{'server':<6} {'req/s':>8} {'fast p50':>9} {'fast p95':>9} "
+                          f"{'slow p50':>9} {'slow p95':>9} {'errors':>7}")
+        for mode in options["servers"].split(","):
+            if mode not in SERVERS:
+                raise CommandError(f"Unknown server {mode!r}; use wsgi and/or asgi.")
+            server = self.start(mode, options)
+            try:
+                row = asyncio.run(self.load(requests, options))
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+            results["servers"][mode] = row
+            self.stdout.write(
+                f"{mode:<6} {row['requests_per_s']:>8.1f} {row['fast_p50_ms']:>9.1f} {row['fast_p95_ms']:>9.1f} "
+                f"{row['slow_p50_ms']:>9.1f} {row['slow_p95_ms']:>9.1f} {row['errors']:>7}"
+            )
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+                f.write("\n")
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def session_cookie(self, user):
+        client = Client()
+        client.force_login(user)
+        return client.cookies["sessionid"].value
+
+    def start(self, mode, options):
+        command = [part.format(port=options["port"], workers=options["workers"], threads=options["threads"])
+                   for part in SERVERS[mode]]
+        try:
+            server = subprocess.Popen(command, env=os.environ.copy())
+        except OSError as e:
+            raise CommandError(f"Could not start {mode} server: {e}")
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f"{mode} server exited; is {command[2]} installed (requirements.txt)?")
+            try:
+                socket.create_connection(("127.0.0.1", options["port"]), timeout=1).close()
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError(f"{mode} server did not start listening within 30 seconds.")
+
+    async def load(self, requests, options):
+        slow_clients = int(options["clients"] * options["slow_clients"])
+        stop = time.monotonic() + options["duration"]
+        timings = {"fast": [], "slow": []}
+        errors = []
+
+        async def client(number):
+            kind = "slow" if number < slow_clients else "fast"
+            i = number
+            while time.monotonic() < stop:
+                cookie, path = requests[i % len(requests)]
+                i += 1
+                start = time.perf_counter()
+                try:
+                    status = await self.request(options["port"], path, cookie, options["slow_ms"] if kind == "slow" else 0)
+                except (OSError, asyncio.IncompleteReadError) as e:
+                    errors.append(str(e))
+                    continue
+                if status != 200:
+                    errors.append(status)
+                    continue
+                timings[kind].append((time.perf_counter() - start) * 1000)
+
+        started = time.monotonic()
+        await asyncio.gather(*(client(n) for n in range(options["clients"])))
+        elapsed = time.monotonic() - started
+
+        done = len(timings["fast"]) + len(timings["slow"])
+        return {
+            "requests": done,
+            "requests_per_s": round(done / elapsed, 1),
+            "errors": len(errors),
+            **{
+                f"{kind}_{name}_ms": round(percentile(values, pct), 1) if values else 0.0
+                for kind, values in timings.items()
+                for name, pct in (("p50", 50), ("p95", 95))
+            },
+        }
+
+    async def request(self, port, path, cookie, pause_ms):
+        """GET `path` on a new connection, sending the header lines `pause_ms` apart; the status code."""
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            lines = [
+                f"GET {path} HTTP/1.1\r\n",
+                f"Host: 127.0.0.1:{port}\r\n",
+                f"Cookie: sessionid={cookie}\r\n",
+                "User-Agent: benchmark_servers\r\n",
+                "Connection: close\r\n",
+                "\r\n",
+            ]
+            for line in lines:
+                writer.write(line.encode())
+                await writer.drain()
+                if pause_ms:
+                    await asyncio.sleep(pause_ms / 1000)
+            response = await reader.read()
+            return int(response.split(b" ", 2)[1]) if response else 0
+        finally:
+            writer.close()
@@ -0,0 +1,157 @@
+import json
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.models import User, Appointment, DoctorProfile, PatientProfile, InactiveDoctor
+from core.seeding import seed
+from core.urls import urlpatterns
+
+# which user requests a view, by the module it lives in
+ROLE_BY_MODULE = {
+    "core.views.doctor_views": "doctor",
+    "core.views.patient_views": "patient",
+    "core.views.admin_views": "admin",
+    "core.views.api_views": "patient",
+}
+
+# views that change data or end the session on GET, or never finish
+SKIP = {"logout", "update_doctor_status", "appointment_events"}
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Request every URL of core/urls.py as a logged-in doctor, patient or admin and "
+        "report p50/p95 latency and SQL query counts. Runs on a throwaway seeded test "
+        "database unless --use-existing is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--doctors", type=int, default=50)
+        parser.add_argument("--patients", type=int, default=1000)
+        parser.add_argument("--appointments", type=int, default=10_000)
+        parser.add_argument("--requests", type=int, default=50, help="Timed requests per URL.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed of the generated data.")
+        parser.add_argument("--use-existing", action="store_true",
+                            help="Benchmark the configured database as it is instead of seeding a test one.")
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        if options["use_existing"]:
+            results = self.run(options["requests"])
+        else:
+            old_name = connection.settings_dict["NAME"]
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                seed(
+                    doctors=options["doctors"],
+                    patients=options["patients"],
+                    appointments=options["appointments"],
+                    random_seed=options["seed"],
+                    log=self.stdout.write,
+                )
+                results = self.run(options["requests"])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+                f.write("\n")
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def run(self, requests):
+        # a pending request in the future gives every URL argument a real row
+        appt = Appointment.objects.pending().order_by("id").first()
+        if appt is None:
+            raise CommandError("Need at least one future PENDING appointment.")
+        doctor_profile = DoctorProfile.objects.select_related("user").get(pk=appt.doctor_id)
+        doctor = doctor_profile.user
+        patient = PatientProfile.objects.select_related("user").get(pk=appt.patient_id).user
+        admin = User.objects.filter(is_superuser=True).first() or User.objects.create_superuser(
+            email="admin@bench.local", username="admin", password=None
+        )
+
+        # a view that fails is reported with its status code instead of stopping the run
+        clients = {"anonymous": Client(raise_request_exception=False)}
+        for role, user in (("doctor", doctor), ("patient", patient), ("admin", admin)):
+            clients[role] = Client(raise_request_exception=False)
+            clients[role].force_login(user)
+
+        url_kwargs = {
+            "doctor_id": appt.doctor_id,
+            "appt_id": appt.id,
+            "appointment_id": appt.id,
+            "status": "approved",
+        }
+        # views that need a query string to do real work
+        url_query = {
+            "doctor_autocomplete": {"q": doctor.username[:3]},
+            "free_slots_search": {"specialization": doctor_profile.specialization},
+        }
+
+        results = {
+            "database": {
+                "vendor": connection.vendor,
+                "doctors": DoctorProfile.objects.count(),
+                "patients": PatientProfile.objects.count(),
+                "appointments": Appointment.objects.count(),
+                "inactive_doctors": InactiveDoctor.objects.count(),
+            },
+            "requests": requests,
+            "urls": {},
+        }
+
+        self.stdout.write(f"{'url':<40} {'as':<9} {'status':>6} {'p50 ms':>8} {'p95 ms':>8} {'queries':>8} {'cold':>5}")
+        seen = set()
+        for pattern in urlpatterns:
+            name = pattern.name
+            if name in SKIP or name in seen:
+                continue
+            seen.add(name)
+
+            url = reverse(name, kwargs={key: url_kwargs[key] for key in pattern.pattern.converters})
+            # views limited to one role say so (core.decorator.login_required)
+            role = getattr(pattern.callback, "role", None)
+            role = role.lower() if role else ROLE_BY_MODULE.get(pattern.callback.__module__, "anonymous")
+            results["urls"][name] = row = self.measure(clients[role], url, url_query.get(name), requests)
+            row["as"] = role
+            row["url"] = url
+            self.stdout.write(
+                f"{url:<40} {role:<9} {row['status']:>6} {row['p50_ms']:>8.2f} "
+                f"{row['p95_ms']:>8.2f} {row['queries']:>8} {row['queries_cold']:>5}"
+            )
+        return results
+
+    def measure(self, client, url, query, requests):
+        """Query count with empty caches, then latency and query count over `requests` warm requests."""
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url, query)
+        cold = len(ctx)
+
+        timings, queries = [], []
+        for _ in range(requests):
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                client.get(url, query)
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(ctx))
+
+        return {
+            "status": response.status_code,
+            "p50_ms": round(percentile(timings, 50), 2),
+            "p95_ms": round(percentile(timings, 95), 2),
+            "queries": max(queries),
+            "queries_cold": cold,
+        }
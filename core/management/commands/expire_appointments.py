@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from core.expiry import expire_overdue_appointments
+
+
+class Command(BaseCommand):
+    help = "Auto-reject PENDING appointments whose date has passed, in bounded batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--max-batches", type=int, default=None,
+                            help="Stop after this many batches per run (default: until nothing is overdue).")
+        parser.add_argument("--loop", action="store_true",
+                            help="Keep running as a worker, sweeping every --interval seconds.")
+        parser.add_argument("--interval", type=float, default=60)
+
+    def handle(self, *args, **options):
+        while True:
+            expired = expire_overdue_appointments(
+                batch_size=options["batch_size"],
+                max_batches=options["max_batches"],
+            )
+            if expired or options["verbosity"] > 1:
+                self.stdout.write(f"Expired {expired} appointment(s).")
+
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
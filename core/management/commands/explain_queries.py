@@ -0,0 +1,104 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from core.counters import _counts, _upcoming
+from core.models import Appointment, AppointmentQuerySet, DoctorProfile, PatientProfile, CONFLICT_WINDOW
+from core.pagination import page_query
+from core.slots import DaySchedule, approved_between, local_day
+
+
+def aggregate_query(queryset, aggregates):
+    """A queryset whose SQL is that of queryset.aggregate(**aggregates), for explain()."""
+    query = queryset.order_by().query.chain()
+    query.clear_select_clause()
+    for alias, aggregate in aggregates.items():
+        query.add_annotation(aggregate, alias, select=True)
+    queryset = queryset._chain()
+    queryset.query = query
+    return queryset
+
+
+def summary_queries(view, field, owner_id):
+    """The dashboard's queries (core.counters): the status aggregate, then the upcoming appointment."""
+    appointments, counts = _counts(field, owner_id)
+    return [
+        (f"{view}: summary", aggregate_query(appointments, counts)),
+        (f"{view}: upcoming", _upcoming(field, owner_id, timezone.now())[:1]),
+    ]
+
+
+def view_queries(doctor, patient):
+    """
+    The hot Appointment queries issued by the views, keyed by view name:
+    the history pages are planned as their first keyset page and as a
+    deeper one (after a cursor), the way core.pagination runs them.
+    """
+    now = timezone.now()
+    deep = (now, 2 ** 31)
+    by_doctor = Appointment.objects.filter(doctor=doctor)
+    by_patient = Appointment.objects.filter(patient=patient)
+    doctor_rows = by_doctor.select_related("patient__user")
+    patient_rows = by_patient.select_related("doctor__user")
+
+    return [
+        *summary_queries("doctor_dashboard", "doctor", doctor.id),
+        ("doctor_requests", by_doctor.pending().select_related("patient__user").order_by("-date")),
+        ("doctor_history: pending", page_query(doctor_rows.pending())),
+        ("doctor_history: approved", page_query(doctor_rows.approved())),
+        ("doctor_history: rejected", page_query(doctor_rows.rejected())),
+        ("doctor_history_status: all", page_query(doctor_rows)),
+        ("doctor_history_status: all, next page", page_query(doctor_rows, deep)),
+        *summary_queries("patient_dashboard", "patient", patient.id),
+        ("patient_history: pending", page_query(patient_rows.pending())),
+        ("patient_history: approved", page_query(patient_rows.approved())),
+        ("patient_history: rejected", page_query(patient_rows.rejected())),
+        ("patient_history: rejected, next page", page_query(patient_rows.rejected(), deep)),
+        ("doctor_detail", by_doctor.filter(status="APPROVED").select_related("patient__user").order_by("-date")),
+        ("has_conflict: day schedule", DaySchedule.query(doctor.id, local_day(now))),
+        ("next_free_slots", approved_between([doctor.id], now, now + timedelta(days=settings.SLOT_SEARCH_DAYS))),
+        ("approve_appointment: clash check", Appointment.objects.approved().filter(
+            Q(doctor=doctor) | Q(patient=patient), date__range=(now - CONFLICT_WINDOW, now + CONFLICT_WINDOW),
+        )[:1]),
+        ("reject_conflicting_appointments", Appointment.objects.filter(
+            status="PENDING",
+            date__gte=now - CONFLICT_WINDOW,
+            date__lte=now + CONFLICT_WINDOW,
+        ).filter(Q(doctor=doctor) | Q(patient=patient)).values(*AppointmentQuerySet.SNAPSHOT_FIELDS)),
+        ("expire_appointments", Appointment.objects.overdue().order_by("date").values_list("id", flat=True)[:1000]),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Print the query plan of every hot Appointment query used by the views."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default")
+        parser.add_argument("--doctor", type=int, help="DoctorProfile id to plan for (default: first).")
+        parser.add_argument("--patient", type=int, help="PatientProfile id to plan for (default: first).")
+        parser.add_argument("--analyze", action="store_true",
+                            help="Run EXPLAIN ANALYZE (PostgreSQL only; executes the queries).")
+
+    def handle(self, *args, **options):
+        db = options["database"]
+        vendor = connections[db].vendor
+
+        doctors = DoctorProfile.objects.using(db)
+        patients = PatientProfile.objects.using(db)
+        doctor = doctors.filter(pk=options["doctor"]).first() if options["doctor"] else doctors.first()
+        patient = patients.filter(pk=options["patient"]).first() if options["patient"] else patients.first()
+        if doctor is None or patient is None:
+            raise CommandError("Need at least one doctor and one patient in the database.")
+
+        explain_options = {}
+        if vendor == "postgresql":
+            explain_options = {"analyze": options["analyze"], "buffers": options["analyze"]}
+
+        for name, queryset in view_queries(doctor, patient):
+            self.stdout.write(self.style.MIGRATE_HEADING(f"-- {name}"))
+            self.stdout.write(queryset.using(db).explain(**explain_options))
+            self.stdout.write("")
@@ -0,0 +1,48 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importer import import_accounts, IMPORT_COLUMNS
+
+
+class Command(BaseCommand):
+    help = (
+        "Create doctors and patients from a CSV file with the columns "
+        f"{', '.join(IMPORT_COLUMNS)}. Already registered emails are skipped, "
+        "so an interrupted import can simply be run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV file, or - for standard input.")
+        parser.add_argument("--batch-size", type=int, default=settings.IMPORT_BATCH_SIZE)
+        parser.add_argument("--workers", type=int, help="Password hashing processes (default: IMPORT_HASH_WORKERS).")
+        parser.add_argument("--start-row", type=int, default=2,
+                            help="Skip the rows before this one (row 1 is the header).")
+
+    def handle(self, *args, **options):
+        try:
+            f = sys.stdin if options["path"] == "-" else open(options["path"], encoding="utf-8-sig", newline="")
+        except OSError as e:
+            raise CommandError(str(e))
+
+        with f:
+            try:
+                result = import_accounts(
+                    f,
+                    batch_size=options["batch_size"],
+                    workers=options["workers"],
+                    start_row=options["start_row"],
+                    log=self.stdout.write,
+                )
+            except Exception as e:
+                raise CommandError(
+                    f"Import stopped: {e}. Run it again to continue; rows already imported are skipped."
+                )
+
+        for row, message in result.errors:
+            self.stderr.write(f"row {row}: {message}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{result.created['DOCTOR']} doctors and {result.created['PATIENT']} patients created, "
+            f"{result.skipped} already registered, {len(result.errors)} rows with errors."
+        ))
@@ -0,0 +1,92 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.functions import Mod
+
+from core.models import Appointment, ArchivedAppointment, DoctorDailyStats, IdSequence
+from core.sharding import is_sharded, mirror_reference_data, shard_for
+from core.stats import rebuild as rebuild_daily_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Bring the appointment shards (DB_SHARDS) in line with the current list: copy users and "
+        "profiles to every shard, move each doctor's appointments, archived appointments and "
+        "daily stats to the doctor's shard, emptying the retired shards (DB_RETIRED_SHARDS), and "
+        "move the shared id sequence past every id in use. Run it after adding or removing a "
+        "shard (migrate a new database first). Rows are copied, then deleted from where they "
+        "were, one batch at a time, so the command can be stopped and re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="Only count the appointments to move.")
+
+    def handle(self, *args, **options):
+        if not is_sharded() and not settings.RETIRED_SHARDS:
+            raise CommandError("No shards; set DB_SHARDS (or DB_RETIRED_SHARDS) to one or more databases.")
+
+        if not options["dry_run"]:
+            mirror_reference_data(options["batch_size"], log=self.stdout.write)
+
+        top = 0
+        for model in (Appointment, ArchivedAppointment):
+            for source in settings.APPOINTMENT_SHARDS + settings.RETIRED_SHARDS:
+                rows = self.misplaced(model, source)
+                if options["dry_run"]:
+                    self.stdout.write(f"{model.__name__} on {source}: {rows.count()} to move")
+                    continue
+                moved = self.move(model, source, rows, options["batch_size"])
+                self.stdout.write(f"{model.__name__} on {source}: {moved} moved")
+            for alias in settings.APPOINTMENT_SHARDS:
+                top = max(top, model._base_manager.using(alias).aggregate(top=Max("id"))["top"] or 0)
+
+        # daily stats ids are per database: the moved doctors' rows are dropped and counted again
+        moved_doctors = set()
+        for source in settings.APPOINTMENT_SHARDS + settings.RETIRED_SHARDS:
+            doctor_ids = set(self.misplaced(DoctorDailyStats, source).values_list("doctor_id", flat=True))
+            if options["dry_run"]:
+                self.stdout.write(f"Daily stats on {source}: {len(doctor_ids)} doctor(s) to count again")
+                continue
+            DoctorDailyStats.objects.using(source).filter(doctor_id__in=doctor_ids).delete()
+            moved_doctors |= doctor_ids
+        if moved_doctors:
+            written = rebuild_daily_stats(moved_doctors, options["batch_size"])
+            self.stdout.write(f"Daily stats of {len(moved_doctors)} doctor(s) counted again: {written} row(s)")
+
+        if not options["dry_run"]:
+            # ids handed out while sharding was off, or on a retired shard, are not reused
+            with transaction.atomic():
+                sequence, _ = IdSequence.objects.select_for_update().get_or_create(
+                    name="appointment", defaults={"next_id": top + 1}
+                )
+                if sequence.next_id <= top:
+                    IdSequence.objects.filter(name="appointment").update(next_id=top + 1)
+
+    def misplaced(self, model, source):
+        """Rows of `model` on `source` whose doctor belongs on another shard."""
+        rows = model._base_manager.using(source).order_by("id")
+        if source not in settings.APPOINTMENT_SHARDS:
+            return rows
+        shards = settings.APPOINTMENT_SHARDS
+        return rows.annotate(home=Mod("doctor_id", len(shards))).exclude(home=shards.index(source))
+
+    def move(self, model, source, rows, batch_size):
+        moved = 0
+        while True:
+            # each batch is deleted once copied, so the next one starts again at the top
+            batch = list(rows[:batch_size])
+            if not batch:
+                return moved
+            by_shard = {}
+            for row in batch:
+                by_shard.setdefault(shard_for(row.doctor_id), []).append(row)
+            for alias, shard_rows in by_shard.items():
+                with transaction.atomic(using=alias):
+                    # already there when an earlier run stopped between copy and delete
+                    model._base_manager.using(alias).bulk_create(shard_rows, ignore_conflicts=True)
+            with transaction.atomic(using=source):
+                copied = model._base_manager.using(source).filter(id__in=[row.id for row in batch])
+                copied._raw_delete(source)
+            moved += len(batch)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from core.stats import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Count the per-doctor daily stats behind the admin reports again from the appointment "
+        "and archive tables, a batch of doctors per transaction. Run it after bulk loads, which "
+        "skip the incremental updates; the counts are right again once it finishes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200, help="Doctors per transaction.")
+
+    def handle(self, *args, **options):
+        log = self.stdout.write if options["verbosity"] > 1 else None
+        written = rebuild(batch_size=options["batch_size"], log=log)
+        self.stdout.write(f"Wrote {written} daily stats row(s).")
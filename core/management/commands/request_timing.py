@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from core.timing import route_stats, reset_route_stats
+
+
+class Command(BaseCommand):
+    help = "Show the per-route request timing collected by RequestTimingMiddleware (REQUEST_TIMING=1)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--json", action="store_true", help="Print the stats as JSON.")
+        parser.add_argument("--reset", action="store_true", help="Clear the stats after printing them.")
+
+    def handle(self, *args, **options):
+        stats = route_stats()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(stats, indent=2, sort_keys=True))
+        elif not stats:
+            self.stdout.write("No requests recorded. Is REQUEST_TIMING=1 set and the cache shared?")
+        else:
+            self.stdout.write(
+                f"{'view':<28} {'requests':>8} {'avg ms':>8} {'p50 ms':>8} {'p95 ms':>8} "
+                f"{'db ms':>7} {'tpl ms':>7} {'queries':>7} {'max q':>5} {'n+1':>4}"
+            )
+            # most total time first
+            for view, s in sorted(stats.items(), key=lambda item: -item[1]["avg_ms"] * item[1]["requests"]):
+                self.stdout.write(
+                    f"{view:<28} {s['requests']:>8} {s['avg_ms']:>8.1f} {s['p50_ms']:>8.1f} {s['p95_ms']:>8.1f} "
+                    f"{s['avg_db_ms']:>7.1f} {s['avg_template_ms']:>7.1f} {s['avg_queries']:>7.1f} "
+                    f"{s['max_queries']:>5} {s['nplusone_requests']:>4}"
+                )
+                if s["slowest_sql"]:
+                    self.stdout.write(f"    slowest ({s['slowest_ms']:.1f} ms): {s['slowest_sql'][:200]}")
+
+        if options["reset"]:
+            reset_route_stats()
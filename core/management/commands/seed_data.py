@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from core.seeding import seed, SEED_PASSWORD
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with generated doctors, patients, doctor registrations and "
+        "appointments across statuses and dates, using bulk_create."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--doctors", type=int, default=50)
+        parser.add_argument("--patients", type=int, default=1000)
+        parser.add_argument("--appointments", type=int, default=10_000)
+        parser.add_argument("--pending-doctors", type=int, default=10,
+                            help="Doctor registrations waiting for admin approval.")
+        parser.add_argument("--past-days", type=int, default=365)
+        parser.add_argument("--future-days", type=int, default=30)
+        parser.add_argument("--domain", default="seed.local",
+                            help="Email domain of the generated accounts; use a new one to seed again.")
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--seed", type=int, help="Random seed, for repeatable datasets.")
+
+    def handle(self, *args, **options):
+        try:
+            created = seed(
+                doctors=options["doctors"],
+                patients=options["patients"],
+                appointments=options["appointments"],
+                pending_doctors=options["pending_doctors"],
+                past_days=options["past_days"],
+                future_days=options["future_days"],
+                domain=options["domain"],
+                batch_size=options["batch_size"],
+                random_seed=options["seed"],
+                log=self.stdout.write,
+            )
+        except IntegrityError:
+            raise CommandError(f"Accounts @{options['domain']} already exist; pass another --domain.")
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for model, count in created.items():
+            self.stdout.write(f"{count:>10} {model}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. Every generated account logs in with the password '{SEED_PASSWORD}'."
+        ))
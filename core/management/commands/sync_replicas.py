@@ -0,0 +1,47 @@
+import os
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Refresh SQLite read replicas (DB_REPLICAS) with a copy of the default database, "
+        "to try the replica routing locally. With --loop it keeps copying every --interval "
+        "seconds, so the replicas lag behind the primary by up to that long."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="Keep copying every --interval seconds.")
+        parser.add_argument("--interval", type=float, default=2)
+
+    def handle(self, *args, **options):
+        primary = connections["default"].settings_dict
+        if primary["ENGINE"] != "django.db.backends.sqlite3":
+            raise CommandError("Only SQLite replicas are copied here; other databases replicate themselves.")
+        if not settings.READ_REPLICAS:
+            raise CommandError("No replicas configured; set DB_REPLICAS to one or more database files.")
+
+        while True:
+            for alias in settings.READ_REPLICAS:
+                self.copy(primary["NAME"], connections[alias].settings_dict["NAME"])
+            if options["verbosity"] > 1:
+                self.stdout.write(f"Copied the primary to {', '.join(settings.READ_REPLICAS)}.")
+
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+
+    def copy(self, source, target):
+        # write next to the replica and swap it in, so readers never see half a copy
+        partial = f"{target}.partial"
+        src, dst = sqlite3.connect(source), sqlite3.connect(partial)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+        os.replace(partial, target)
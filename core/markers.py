@@ -0,0 +1,41 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core.models import Appointment, DoctorProfile, PatientProfile, appointments_bulk_updated
+
+
+def touch(doctor_ids=(), patient_ids=()):
+    """Move the appointments_changed_at marker of these doctors and patients to now."""
+    now = timezone.now()
+    doctor_ids, patient_ids = set(doctor_ids) - {None}, set(patient_ids) - {None}
+    if doctor_ids:
+        DoctorProfile.objects.filter(pk__in=doctor_ids).update(appointments_changed_at=now)
+    if patient_ids:
+        PatientProfile.objects.filter(pk__in=patient_ids).update(appointments_changed_at=now)
+
+
+# ------------------------
+# Receivers
+# ------------------------
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def appointment_saved(sender, instance, **kwargs):
+    # a moved appointment changes the lists of its old owner too
+    loaded = getattr(instance, "_loaded", {})
+    touch(
+        [instance.doctor_id, loaded.get("doctor_id")],
+        [instance.patient_id, loaded.get("patient_id")],
+    )
+
+
+@receiver(appointments_bulk_updated, sender=Appointment)
+def appointments_updated(sender, rows, fields, **kwargs):
+    doctor_ids = {row["doctor_id"] for row in rows}
+    patient_ids = {row["patient_id"] for row in rows}
+    for field, ids in (("doctor", doctor_ids), ("patient", patient_ids)):
+        for name in (field, f"{field}_id"):
+            if name in fields:
+                value = fields[name]
+                ids.add(getattr(value, "pk", value))
+    touch(doctor_ids, patient_ids)
@@ -0,0 +1,162 @@
+import time
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed, ObjectDoesNotExist
+from django.db import connections
+from django.utils.functional import SimpleLazyObject
+
+from core.routers import PIN_COOKIE, ReadState, current_reads
+from core.timing import RequestTiming, time_templates, current_timing
+
+PROFILE_ATTRS = {
+    "DOCTOR": "doctor_profile",
+    "PATIENT": "patient_profile",
+}
+
+
+def get_profile(user):
+    """The DoctorProfile or PatientProfile matching the user's role, or None."""
+    attr = PROFILE_ATTRS.get(getattr(user, "role", None))
+    if not user.is_authenticated or attr is None:
+        return None
+    try:
+        return getattr(user, attr)
+    except ObjectDoesNotExist:
+        return None
+
+
+class ProfileMiddleware:
+    """
+    Sets request.profile lazily. With core.backends.ProfileBackend the
+    profile arrives in the same query as request.user, so views stop
+    looking it up again. It is falsy for anonymous users and users
+    without a profile.
+
+    Works in both sync and async chains. Async views must load the user
+    first (core.decorator.login_required does) before touching it.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        request.profile = SimpleLazyObject(lambda: get_profile(request.user))
+        # in an async chain this hands back the coroutine for the caller to await
+        return self.get_response(request)
+
+
+class ReplicaMiddleware:
+    """
+    Gives each request the ReadState core.routers.ReplicaRouter routes by.
+    A response to a request that wrote sets a short-lived cookie, and while
+    the browser sends it back its requests read from the primary, so a
+    redirect after a POST shows the write even before the replicas have it.
+
+    Removes itself from the chain when no replicas are configured.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.READ_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = ReadState(pinned=PIN_COOKIE in request.COOKIES)
+        token = current_reads.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_reads.reset(token)
+        return self.pin(request, response, state)
+
+    async def __acall__(self, request):
+        state = ReadState(pinned=PIN_COOKIE in request.COOKIES)
+        token = current_reads.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_reads.reset(token)
+        return self.pin(request, response, state)
+
+    def pin(self, request, response, state):
+        if state.wrote:
+            response.set_cookie(PIN_COOKIE, "1", max_age=state.pin_seconds(), httponly=True,
+                                samesite="Lax", secure=request.is_secure())
+        return response
+
+
+class RequestTimingMiddleware:
+    """
+    Opt-in (REQUEST_TIMING=1) per-request instrumentation: SQL count and
+    time, template time, slowest statement and repeated statements, sent
+    back as a Server-Timing header, logged to "core.timing" and added to
+    the per-route stats shown by `manage.py request_timing`.
+
+    When disabled it removes itself from the middleware chain at startup
+    and the template hook is never installed, so it costs nothing. It runs
+    in sync and async chains alike, so async views stay async under ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING:
+            raise MiddlewareNotUsed
+        time_templates()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timing = RequestTiming()
+        with self.timed(timing), self.wrapped_connections(timing):
+            response = self.get_response(request)
+        timing.finish(request, response)
+        return response
+
+    async def __acall__(self, request):
+        timing = RequestTiming()
+        with self.timed(timing), ExitStack() as stack:
+            # the async ORM runs queries in a worker thread, which has
+            # connections of its own: wrap those, from that thread
+            await sync_to_async(stack.enter_context)(self.wrapped_connections(timing))
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(stack.close)()
+        # the route stats are read and written through the (maybe remote) cache
+        await sync_to_async(timing.finish)(request, response)
+        return response
+
+    @contextmanager
+    def timed(self, timing):
+        token = current_timing.set(timing)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            current_timing.reset(token)
+            timing.total_ms = (time.perf_counter() - start) * 1000
+
+    @staticmethod
+    @contextmanager
+    def wrapped_connections(timing):
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(timing))
+            yield
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-18 03:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        # add the composite indexes before dropping the FK indexes they replace
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'status', 'date'], name='appt_doctor_status_date'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['patient', 'status', 'date'], name='appt_patient_status_date'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(condition=models.Q(('status', 'PENDING')), fields=['date'], name='appt_pending_date'),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='doctor',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='core.doctorprofile'),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='patient',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='core.patientprofile'),
+        ),
+    ]
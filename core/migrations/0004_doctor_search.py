@@ -0,0 +1,48 @@
+# Generated by Django 5.2.5 on 2026-10-18 03:40
+
+from django.db import migrations, models
+
+
+def fill_search_text(apps, schema_editor):
+    DoctorProfile = apps.get_model("core", "DoctorProfile")
+    doctors = DoctorProfile.objects.using(schema_editor.connection.alias).select_related("user")
+    for doctor in doctors.iterator(chunk_size=1000):
+        doctor.search_text = " ".join(f"{doctor.user.username} {doctor.specialization}".lower().split())
+        doctor.save(update_fields=["search_text"])
+
+
+# LIKE '%word%' can only use an index through pg_trgm; other backends keep the plain b-tree index
+def create_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS doctor_search_trgm "
+            "ON core_doctorprofile USING gin (search_text gin_trgm_ops)"
+        )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS doctor_search_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_appointment_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctorprofile',
+            name='search_text',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=300),
+        ),
+        migrations.AlterField(
+            model_name='doctorprofile',
+            name='specialization',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.RunPython(fill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.5 on 2026-10-18 03:41
+
+from django.db import migrations, models
+
+
+def lists_to_masks(apps, schema_editor):
+    for name in ("DoctorProfile", "InactiveDoctor"):
+        model = apps.get_model("core", name)
+        rows = model.objects.using(schema_editor.connection.alias)
+        for row in rows.only("id", "availability").iterator(chunk_size=1000):
+            mask = 0
+            for day in row.availability or []:
+                mask |= 1 << int(day)
+            rows.filter(pk=row.pk).update(availability_mask=mask)
+
+
+def masks_to_lists(apps, schema_editor):
+    for name in ("DoctorProfile", "InactiveDoctor"):
+        model = apps.get_model("core", name)
+        rows = model.objects.using(schema_editor.connection.alias)
+        for row in rows.only("id", "availability_mask").iterator(chunk_size=1000):
+            days = [day for day in range(7) if row.availability_mask & (1 << day)]
+            rows.filter(pk=row.pk).update(availability=days)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_doctor_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctorprofile',
+            name='availability_mask',
+            field=models.PositiveSmallIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='inactivedoctor',
+            name='availability_mask',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RunPython(lists_to_masks, masks_to_lists),
+        migrations.RemoveField(
+            model_name='doctorprofile',
+            name='availability',
+        ),
+        migrations.RemoveField(
+            model_name='inactivedoctor',
+            name='availability',
+        ),
+    ]
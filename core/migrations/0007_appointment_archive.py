@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-18 04:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_change_markers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedAppointment',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('reason', models.TextField()),
+                ('date', models.DateTimeField()),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('APPROVED', 'Approved'), ('REJECTED', 'Rejected')], max_length=10)),
+                ('doctor_message', models.TextField(blank=True)),
+                ('rejection_message', models.TextField(blank=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('doctor', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_appointments', to='core.doctorprofile')),
+                ('patient', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_appointments', to='core.patientprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['doctor', 'date'], name='archive_doctor_date'), models.Index(fields=['patient', 'date'], name='archive_patient_date')],
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.5 on 2026-10-18 04:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
+
+EXPIRED_MESSAGE = "Time passed, auto-rejected."
+CONFLICT_MESSAGE = "Rejected due to conflict with another approved appointment."
+
+
+def count_existing(apps, schema_editor):
+    # the same split as core.stats, over this database's appointments and archive
+    db = schema_editor.connection.alias
+    outcomes = {
+        "pending": Q(status="PENDING"),
+        "approved": Q(status="APPROVED"),
+        "rejected": Q(status="REJECTED") & ~Q(rejection_message__in=[CONFLICT_MESSAGE, EXPIRED_MESSAGE]),
+        "conflicts": Q(status="REJECTED", rejection_message=CONFLICT_MESSAGE),
+        "expired": Q(status="REJECTED", rejection_message=EXPIRED_MESSAGE),
+    }
+    counts = {}
+    for name in ("Appointment", "ArchivedAppointment"):
+        rows = apps.get_model("core", name).objects.using(db).annotate(day=TruncDate("date"))
+        rows = rows.values("doctor_id", "day").annotate(
+            **{f"n_{outcome}": Count("id", filter=condition) for outcome, condition in outcomes.items()}
+        ).order_by()
+        for row in rows.iterator(chunk_size=1000):
+            counted = counts.setdefault((row["doctor_id"], row["day"]), dict.fromkeys(outcomes, 0))
+            for outcome in outcomes:
+                counted[outcome] += row[f"n_{outcome}"]
+    DoctorDailyStats = apps.get_model("core", "DoctorDailyStats")
+    DoctorDailyStats.objects.using(db).bulk_create(
+        [DoctorDailyStats(doctor_id=doctor_id, day=day, **counted) for (doctor_id, day), counted in counts.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_id_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('pending', models.IntegerField(default=0)),
+                ('approved', models.IntegerField(default=0)),
+                ('rejected', models.IntegerField(default=0)),
+                ('conflicts', models.IntegerField(default=0)),
+                ('expired', models.IntegerField(default=0)),
+                ('doctor', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='core.doctorprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='daily_stats_day')],
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'day'), name='daily_stats_doctor_day')],
+            },
+        ),
+        migrations.RunPython(count_existing, migrations.RunPython.noop),
+    ]
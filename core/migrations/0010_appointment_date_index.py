@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-18 04:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_doctor_daily_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['date'], name='appt_date'),
+        ),
+    ]
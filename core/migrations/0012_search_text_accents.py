@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-18 05:20
+
+import unicodedata
+
+from django.db import migrations
+
+
+def refill_search_text(apps, schema_editor):
+    # normalize_search() now drops accents, so "jose" finds "José"
+    DoctorProfile = apps.get_model("core", "DoctorProfile")
+    doctors = DoctorProfile.objects.using(schema_editor.connection.alias).select_related("user")
+    for doctor in doctors.iterator(chunk_size=1000):
+        text = unicodedata.normalize("NFKD", f"{doctor.user.username} {doctor.specialization}".lower())
+        text = " ".join("".join(c for c in text if not unicodedata.combining(c)).split())
+        if text != doctor.search_text:
+            doctor.search_text = text
+            doctor.save(update_fields=["search_text"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_user_email_lower'),
+    ]
+
+    operations = [
+        migrations.RunPython(refill_search_text, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,14 @@
+import unicodedata
+
 from django.db import models
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.dispatch import Signal
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 from datetime import datetime, timedelta
 from django.contrib.auth.hashers import make_password
-from .decorator import map_availability_days
+from .decorator import map_availability_days, days_to_mask, mask_to_days, masks_with_day
 
 class User(AbstractUser):
     username = models.CharField(max_length=150, blank=True)  
@@ -18,6 +23,12 @@ class User(AbstractUser):
     USERNAME_FIELD = "email"        
     REQUIRED_FIELDS = ["username"]  
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # the account import's case-insensitive check for registered emails
+            models.Index(Lower("email"), name="user_email_lower"),
+        ]
+
     def __str__(self):
         return f"{self.username} ({self.email} - {self.role})"
 
@@ -26,97 +37,281 @@ class PatientProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="patient_profile")
     phone = models.CharField(max_length=20, blank=True)
     address = models.CharField(max_length=255, blank=True)
+    # last write to any of the patient's appointments, kept by core.markers
+    appointments_changed_at = models.DateTimeField(default=timezone.now, editable=False)
 
     def __str__(self):
         return f"Patient: {self.user.username} ({self.user.email})"
 
 
-class InactiveDoctor(models.Model):
+class AvailabilityMixin:
+    """
+    Working weekdays are stored as a 7-bit mask in `availability_mask`
+    (bit 0 = Monday). `availability` keeps exposing them as a list of
+    weekday numbers, so existing code and templates read and assign lists.
+    """
+
+    @property
+    def availability(self):
+        return mask_to_days(self.availability_mask)
+
+    @availability.setter
+    def availability(self, days):
+        self.availability_mask = days_to_mask(days)
+
+    def is_available_on(self, date):
+        """Check if doctor is available on a given date."""
+        return bool(self.availability_mask & (1 << date.weekday()))
+
+    def availability_days(self):
+        return map_availability_days(self.availability_mask)
+
+
+class InactiveDoctor(AvailabilityMixin, models.Model):
     username = models.CharField(max_length=150, blank=True)  
     email = models.EmailField(unique=True)
     password= models.CharField(max_length=150, blank=True)  
     specialization = models.CharField(max_length=100)
-    availability = models.JSONField(default=list, blank=True)
-   
-    def availability_days(self):
-        return map_availability_days(self.availability)
+    availability_mask = models.PositiveSmallIntegerField(default=0)
 
     def set_password(self, raw_password):
         self.password = make_password(raw_password)
 
 
-class DoctorProfile(models.Model):
+def normalize_search(text):
+    """Lower case, accents dropped, whitespace collapsed: "José  Núñez" -> "jose nunez"."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return " ".join("".join(c for c in text if not unicodedata.combining(c)).split())
+
+
+class DoctorProfileQuerySet(models.QuerySet):
+
+    def search(self, q):
+        """
+        Doctors whose name or specialization contains every word of `q`.
+        Matches the normalized search_text column, which carries a trigram
+        index on PostgreSQL; elsewhere it is still a scan, but of one narrow
+        column with no join to the user table.
+        """
+        qs = self
+        for word in normalize_search(q).split():
+            qs = qs.filter(search_text__contains=word)
+        return qs
+
+    def available_on(self, weekday):
+        # an IN list over the indexed mask column instead of a bitwise
+        # expression, which no index can serve
+        return self.filter(availability_mask__in=masks_with_day(weekday))
+
+
+class DoctorProfile(AvailabilityMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="doctor_profile")
-    specialization = models.CharField(max_length=100)
-    availability = models.JSONField(default=list, blank=True)
+    specialization = models.CharField(max_length=100, db_index=True)
+    availability_mask = models.PositiveSmallIntegerField(default=0, db_index=True)
+    # lower-cased "name specialization", kept in sync by save() and the User post_save receiver
+    search_text = models.CharField(max_length=300, blank=True, editable=False, db_index=True)
+    # last write to any of the doctor's appointments, kept by core.markers
+    appointments_changed_at = models.DateTimeField(default=timezone.now, editable=False)
+    # last change to the profile itself, for the doctor directory
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
-    def is_available_on(self, date):
-        """Check if doctor is available on a given date."""
-        return date.weekday() in self.availability
+    objects = DoctorProfileQuerySet.as_manager()
 
-    def availability_days(self):
-        return map_availability_days(self.availability)
+    def build_search_text(self):
+        return normalize_search(f"{self.user.username} {self.specialization}")
+
+    def save(self, *args, **kwargs):
+        self.search_text = self.build_search_text()
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = {*kwargs["update_fields"], "search_text", "updated_at"}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Dr. {self.user.username} - {self.specialization}"
 
 
+EXPIRED_MESSAGE = "Time passed, auto-rejected."
+CONFLICT_MESSAGE = "Rejected due to conflict with another approved appointment."
+
+# two appointments of the same doctor (or patient) closer than this overlap
+CONFLICT_WINDOW = timedelta(minutes=30)
+
+# Sent after AppointmentQuerySet.update() and update_loaded() with rows=[{id, doctor_id, patient_id,
+# date, status, rejection_message}] as they were before the update,
+# fields=the updated values and using=the database written to. Bulk updates
+# skip save(), so this is the only way listeners hear about them.
+appointments_bulk_updated = Signal()
+
+
+class AppointmentQuerySet(models.QuerySet):
+    # PENDING rows whose date has passed are shown as REJECTED even before
+    # the expiry worker (manage.py expire_appointments) gets to them, so
+    # reads never depend on that write having happened.
+
+    def pending(self):
+        return self.filter(status="PENDING", date__gte=timezone.now())
+
+    def approved(self):
+        return self.filter(status="APPROVED")
+
+    def rejected(self):
+        return self.filter(Q(status="REJECTED") | Q(status="PENDING", date__lt=timezone.now()))
+
+    def overdue(self):
+        return self.filter(status="PENDING", date__lt=timezone.now())
+
+    def active(self):
+        """Appointments that still hold a slot: live PENDING or APPROVED."""
+        return self.filter(Q(status="APPROVED") | Q(status="PENDING", date__gte=timezone.now()))
+
+    def with_status(self, status):
+        return {
+            "PENDING": self.pending,
+            "APPROVED": self.approved,
+            "REJECTED": self.rejected,
+        }[status]()
+
+    # With sharding on (core.sharding) rows created without a database named
+    # go to their doctor's shard, with ids no other shard has used.
+
+    def create(self, **kwargs):
+        from .sharding import is_sharded
+        if not is_sharded() or self._db is not None:
+            return super().create(**kwargs)
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True)
+        return obj
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from .sharding import is_sharded, next_appointment_ids, shard_for
+        if not is_sharded() or self._db is not None:
+            return super().bulk_create(objs, *args, **kwargs)
+        objs = list(objs)
+        missing = [obj for obj in objs if obj.pk is None]
+        for obj, pk in zip(missing, next_appointment_ids(len(missing))):
+            obj.pk = pk
+        by_shard = {}
+        for obj in objs:
+            by_shard.setdefault(shard_for(obj.doctor_id), []).append(obj)
+        for alias, shard_objs in by_shard.items():
+            self.using(alias).bulk_create(shard_objs, *args, **kwargs)
+        return objs
+
+    SNAPSHOT_FIELDS = ("id", "doctor_id", "patient_id", "date", "status", "rejection_message")
+
+    def update(self, **kwargs):
+        if not appointments_bulk_updated.has_listeners(self.model):
+            return super().update(**kwargs)
+
+        rows = list(self.values(*self.SNAPSHOT_FIELDS))
+        if not rows:
+            # nothing matched a moment ago, in the same transaction
+            return 0
+        updated = super().update(**kwargs)
+        appointments_bulk_updated.send(sender=self.model, rows=rows, fields=kwargs, using=self.db)
+        return updated
+
+    def update_loaded(self, appointments, **kwargs):
+        """
+        update() of `appointments`, instances the caller has just read (e.g.
+        under select_for_update), without reading them again for the signal.
+        """
+        appointments = list(appointments)
+        if not appointments:
+            return 0
+        updated = models.QuerySet.update(self.filter(pk__in=[appt.pk for appt in appointments]), **kwargs)
+        if appointments_bulk_updated.has_listeners(self.model):
+            rows = [{name: getattr(appt, name) for name in self.SNAPSHOT_FIELDS} for appt in appointments]
+            appointments_bulk_updated.send(sender=self.model, rows=rows, fields=kwargs, using=self.db)
+        return updated
+
+
 class Appointment(models.Model):
     STATUS_CHOICES = (
         ("PENDING", "Pending"),
         ("APPROVED", "Approved"),
         ("REJECTED", "Rejected"),
     )
-    patient = models.ForeignKey(PatientProfile, on_delete=models.CASCADE)
-    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE)
+    # the composite indexes below lead with these columns, so the
+    # single-column FK indexes would only be extra write cost
+    patient = models.ForeignKey(PatientProfile, on_delete=models.CASCADE, db_index=False)
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, db_index=False)
     reason = models.TextField()
     date = models.DateTimeField()
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="PENDING")
     doctor_message = models.TextField(blank=True)
     rejection_message = models.TextField(blank=True)
 
+    objects = AppointmentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # dashboards, histories, has_conflict: filter by owner + status, range/order on date
+            models.Index(fields=["doctor", "status", "date"], name="appt_doctor_status_date"),
+            models.Index(fields=["patient", "status", "date"], name="appt_patient_status_date"),
+            # keyset-paginated history lists that mix statuses ("all", rejected incl. expired)
+            models.Index(fields=["doctor", "date"], name="appt_doctor_date"),
+            models.Index(fields=["patient", "date"], name="appt_patient_date"),
+            # expiry sweep and reject_conflicting_appointments only look at PENDING rows
+            models.Index(fields=["date"], condition=Q(status="PENDING"), name="appt_pending_date"),
+            # Django admin: date_hierarchy bounds and drill-down, newest-first changelist
+            models.Index(fields=["date"], name="appt_date"),
+        ]
+
+    @property
+    def is_expired(self):
+        return self.status == "PENDING" and self.date < timezone.now()
 
+    @property
+    def current_status(self):
+        return "REJECTED" if self.is_expired else self.status
+
+    @property
+    def current_rejection_message(self):
+        return EXPIRED_MESSAGE if self.is_expired else self.rejection_message
+
+    def save(self, *args, **kwargs):
+        from .sharding import is_sharded, next_appointment_ids
+        if self._state.adding and self.pk is None and is_sharded():
+            self.pk = next_appointment_ids(1)[0]
+            kwargs["force_insert"] = True
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember what was loaded so signal receivers can tell what changed
+        instance._loaded = {name: instance.__dict__.get(name) for name in field_names}
+        return instance
 
     def has_conflict(self):
-        
+        # Both checks are answered from the doctor's day schedule (core.slots),
+        # one query (or a cache hit with DAY_SCHEDULE_CACHE on).
+        from .slots import DaySchedule, doctor_booking, local_day
+
         # -------------------------
         # 1) Same-day conflict (patient + doctor)
         # -------------------------
-        start_of_day = self.date.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_of_day = start_of_day + timedelta(days=1)
-
-        patient_conflict = Appointment.objects.filter(
-            doctor=self.doctor,
-            patient=self.patient,
-            date__gte=start_of_day,
-            date__lt=end_of_day,
-            status__in=["PENDING", "APPROVED"]
-        ).exclude(id=self.id).first()
+        schedule = DaySchedule.load(self.doctor_id, local_day(self.date))
+        patient_conflict = schedule.patient_booking(self.patient_id, exclude_id=self.id)
 
         if patient_conflict:
             return {
                 "type": "PATIENT_CONFLICT",
                 "doctor_name": self.doctor.user.username,
-                "date": patient_conflict.date
+                "date": patient_conflict
             }
 
         # -------------------------
         # 2) Doctor overlapping conflict (±30 mins)
         # -------------------------
-        start_time = self.date - timedelta(minutes=30)
-        end_time = self.date + timedelta(minutes=30)
-
-        doctor_conflict = Appointment.objects.filter(
-            doctor=self.doctor,
-            date__range=(start_time, end_time),
-            status="APPROVED"
-        ).exclude(id=self.id).first()
+        doctor_conflict = doctor_booking(self.doctor_id, self.date, exclude_id=self.id, schedule=schedule)
 
         if doctor_conflict:
             return {
                 "type": "DOCTOR_CONFLICT",
                 "doctor_name": self.doctor.user.username,
-                "date": doctor_conflict.date
+                "date": doctor_conflict
             }
 
         # -------------------------
@@ -129,3 +324,87 @@ class Appointment(models.Model):
         return f"{self.patient.user.username} → Dr. {self.doctor.user.username} ({self.status})"
 
 
+class ArchivedAppointment(models.Model):
+    """
+    An appointment moved out of the hot table by core.archive (manage.py
+    archive_appointments). It keeps its id and columns, with the status it
+    ended with: a request that expired is stored as REJECTED. Read paths
+    include these rows only when asked for older data (?archived=1).
+    """
+    id = models.BigIntegerField(primary_key=True)
+    patient = models.ForeignKey(PatientProfile, on_delete=models.CASCADE, db_index=False,
+                                related_name="archived_appointments")
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, db_index=False,
+                               related_name="archived_appointments")
+    reason = models.TextField()
+    date = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=Appointment.STATUS_CHOICES)
+    doctor_message = models.TextField(blank=True)
+    rejection_message = models.TextField(blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    # same filters as the hot table, so a status tab reads both alike
+    objects = AppointmentQuerySet.as_manager()
+
+    is_expired = False
+    archived = True
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["doctor", "date"], name="archive_doctor_date"),
+            models.Index(fields=["patient", "date"], name="archive_patient_date"),
+        ]
+
+    @property
+    def current_status(self):
+        return self.status
+
+    @property
+    def current_rejection_message(self):
+        return self.rejection_message
+
+    def __str__(self):
+        return f"{self.patient.user.username} → Dr. {self.doctor.user.username} ({self.status}, archived)"
+
+
+class IdSequence(models.Model):
+    """
+    Next free id of a table whose rows are spread over several databases
+    (core.sharding), kept on the default database.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    next_id = models.BigIntegerField()
+
+    def __str__(self):
+        return f"{self.name}: {self.next_id}"
+
+
+class DoctorDailyStats(models.Model):
+    """
+    How one doctor's appointments on one (local) day ended up, kept by
+    core.stats as appointments are written, for the admin reports. Archived
+    appointments stay counted. Rebuild with `manage.py rebuild_daily_stats`.
+    """
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, db_index=False,
+                               related_name="daily_stats")
+    day = models.DateField()
+    # plain integers: a count that drifted (rows bulk-created without a
+    # rebuild) must not make the appointment write that moves it fail
+    pending = models.IntegerField(default=0)
+    approved = models.IntegerField(default=0)
+    # rejected by the doctor, auto-rejected for clashing with an approval, or left pending past their time
+    rejected = models.IntegerField(default=0)
+    conflicts = models.IntegerField(default=0)
+    expired = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["doctor", "day"], name="daily_stats_doctor_day"),
+        ]
+        indexes = [
+            # the reports read a date range for every doctor
+            models.Index(fields=["day"], name="daily_stats_day"),
+        ]
+
+    def __str__(self):
+        return f"Dr. {self.doctor_id} on {self.day}"
@@ -0,0 +1,175 @@
+import heapq
+from datetime import datetime
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from core.sharding import across_shards
+
+
+def encode_cursor(appointment):
+    return f"{appointment.date.isoformat()}~{appointment.id}"
+
+
+def decode_cursor(value):
+    try:
+        date, pk = value.rsplit("~", 1)
+        return datetime.fromisoformat(date), int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+
+class KeysetPage:
+    """One page of appointments plus the query strings that lead to the next/first page."""
+
+    def __init__(self, request, object_list, has_next, param, tab=None):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.is_first = not request.GET.get(param)
+
+        query = request.GET.copy()
+        if tab:
+            query["tab"] = tab
+
+        query.pop(param, None)
+        self.first_query = query.urlencode()
+
+        self.next_query = ""
+        if has_next:
+            query[param] = encode_cursor(object_list[-1])
+            self.next_query = query.urlencode()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def keyset_paginate(request, queryset, param="after", tab=None, page_size=None, archive=None):
+    """
+    Newest-first page of `queryset`, keyed on (date, id).
+
+    The position of the last row shown travels in request.GET[param], so a
+    deep page is an index range scan just like the first one, not an OFFSET
+    that has to walk every newer row. Several lists on one page (the history
+    tabs) page independently by using different params; `tab` is echoed back
+    in the links so the same tab stays open.
+
+    With `archive` (the matching ArchivedAppointment queryset) the page is
+    merged from both tables; archived rows keep their ids, so one cursor
+    serves both. With sharding on, a queryset not bound to one shard (the
+    patient's lists) is read from every shard and merged the same way.
+    """
+    page_size = page_size or settings.HISTORY_PAGE_SIZE
+    cursor = decode_cursor(request.GET.get(param))
+    rows = _merge([list(page_query(qs, cursor, page_size)) for qs in _sources(queryset, archive)])
+    return KeysetPage(request, rows[:page_size], len(rows) > page_size, param, tab)
+
+
+async def akeyset_paginate(request, queryset, param="after", tab=None, page_size=None, archive=None):
+    """keyset_paginate() with the async ORM."""
+    page_size = page_size or settings.HISTORY_PAGE_SIZE
+    cursor = decode_cursor(request.GET.get(param))
+    rows = _merge([[row async for row in page_query(qs, cursor, page_size)] for qs in _sources(queryset, archive)])
+    return KeysetPage(request, rows[:page_size], len(rows) > page_size, param, tab)
+
+
+def page_query(queryset, cursor=None, page_size=None):
+    """
+    The query behind one keyset page: `queryset` newest first, after the
+    decoded `cursor` ((date, id) of the last row shown, or None for the
+    first page), one row more than the page to tell whether another follows.
+    """
+    page_size = page_size or settings.HISTORY_PAGE_SIZE
+    queryset = queryset.order_by("-date", "-id")
+    if cursor:
+        date, pk = cursor
+        queryset = queryset.filter(Q(date__lt=date) | Q(date=date, id__lt=pk))
+    return queryset[:page_size + 1]
+
+
+def _sources(queryset, archive):
+    sources = across_shards(queryset)
+    if archive is not None:
+        sources += across_shards(archive)
+    return sources
+
+
+def _merge(pages):
+    if len(pages) == 1:
+        return pages[0]
+    return list(heapq.merge(*pages, key=lambda appt: (appt.date, appt.id), reverse=True))
+
+
+# ------------------------
+# Admin changelists
+# ------------------------
+def estimated_rows(model, using):
+    """The row count the database's statistics hold for `model`'s table, or None when it keeps none."""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            # -1 until the table is first analyzed
+            cursor.execute("SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)", [table])
+            row = cursor.fetchone()
+            return int(row[0]) if row and row[0] >= 0 else None
+        if connection.vendor == "mysql":
+            cursor.execute(
+                "SELECT table_rows FROM information_schema.tables "
+                "WHERE table_schema = DATABASE() AND table_name = %s", [table]
+            )
+            row = cursor.fetchone()
+            return int(row[0]) if row and row[0] is not None else None
+        if connection.vendor == "sqlite":
+            # written by ANALYZE; each index's entry starts with its row count (partial ones hold fewer)
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [table])
+            counts = [int(stat.split()[0]) for stat, in cursor.fetchall()]
+            return max(counts) if counts else None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists over big tables. A full table past
+    ADMIN_COUNT_LIMIT rows is counted from the database's statistics instead
+    of with COUNT(*) (`estimated`); any other list is counted up to
+    ADMIN_COUNT_LIMIT rows, and one matching more is `capped` there, so only
+    its first ADMIN_COUNT_LIMIT rows can be paged through. `count_display`
+    is the count as the changelist shows it: "about N" or "N+" in those cases.
+    """
+
+    estimated = False
+    capped = False
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_COUNT_LIMIT
+        queryset = self.object_list
+        if not queryset.query.has_filters():
+            estimate = estimated_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate >= limit:
+                self.estimated = True
+                return estimate
+        # one row past the limit tells a capped list from one exactly at it
+        count = queryset.order_by()[:limit + 1].count()
+        if count > limit:
+            self.capped = True
+            return limit
+        return count
+
+    @property
+    def count_display(self):
+        count = self.count
+        if self.estimated:
+            return f"about {count}"
+        if self.capped:
+            return f"{count}+"
+        return str(count)
@@ -0,0 +1,221 @@
+"""
+Read replicas (settings.READ_REPLICAS, configured with DB_REPLICAS).
+
+Only views wrapped in @read_replica read from a replica, and only the core
+tables (users, profiles, appointments); sessions, auth and admin data stay
+on the primary. Every write goes to the primary, and so does every read
+- outside a @read_replica view,
+- inside a transaction.atomic() block,
+- after a write in the same request, or
+- from a browser that wrote a moment ago (core.middleware.ReplicaMiddleware),
+so users read their own writes.
+
+Lag tolerance: a replica more than REPLICA_LAG_TOLERANCE seconds behind the
+primary, or one that cannot be reached, is skipped until a later check finds
+it caught up; with no replica left the reads go to the primary. The lag is
+measured at most every REPLICA_LAG_CHECK_INTERVAL seconds per process:
+PostgreSQL reports its replay delay, a SQLite replica (a file refreshed by
+`manage.py sync_replicas`) is as old as its last refresh, and replicas of
+other databases are trusted.
+"""
+import logging
+import math
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger("core.routers")
+
+# the ReadState of the request being served, set by ReplicaMiddleware
+current_reads = ContextVar("replica_reads", default=None)
+
+# browsers holding this cookie read from the primary
+PIN_COOKIE = "read_primary"
+
+
+class ReadState:
+    """Routing state of one request."""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned  # the browser wrote recently
+        self.wrote = False  # this request wrote
+        self.replica = False  # inside a @read_replica view
+        self.alias = None  # the replica picked for this request
+
+    def pin_seconds(self):
+        # a replica in use is at most the tolerance behind, as of a check up to an interval old
+        return settings.REPLICA_LAG_TOLERANCE + settings.REPLICA_LAG_CHECK_INTERVAL
+
+
+@contextmanager
+def replica_reads():
+    """Let the reads of the current request go to a replica while the block runs."""
+    state = current_reads.get()
+    if state is None:
+        yield
+        return
+    replica, state.replica = state.replica, True
+    try:
+        yield
+    finally:
+        state.replica = replica
+
+
+@contextmanager
+def primary_reads():
+    """
+    Read from the primary while the block runs, for results that outlive the
+    request (shared caches), which must not freeze a lagging replica's copy.
+    """
+    state = current_reads.get()
+    if state is None:
+        yield
+        return
+    replica, state.replica = state.replica, False
+    try:
+        yield
+    finally:
+        state.replica = replica
+
+
+def read_replica(view_func):
+    """Serve a read-only view from a replica (sync or async)."""
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _wrapped_async_view(request, *args, **kwargs):
+            with replica_reads():
+                return await view_func(request, *args, **kwargs)
+        return markcoroutinefunction(_wrapped_async_view)
+
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        with replica_reads():
+            return view_func(request, *args, **kwargs)
+    return _wrapped_view
+
+
+# ------------------------
+# Lag
+# ------------------------
+_lag_checks = {}  # alias -> (time.monotonic() of the check, lag in seconds or None)
+
+
+def replica_lag(alias):
+    """Seconds `alias` is behind the primary, or None when the database cannot tell."""
+    connection = connections[alias]
+    if connection.vendor == "sqlite":
+        return time.time() - os.path.getmtime(connection.settings_dict["NAME"])
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            # an idle replica that has replayed everything is not behind
+            cursor.execute(
+                "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+            )
+            lag = cursor.fetchone()[0]
+        return None if lag is None else float(lag)
+    return None
+
+
+def is_fresh(alias):
+    """Whether `alias` is within REPLICA_LAG_TOLERANCE of the primary, as of its last check."""
+    now = time.monotonic()
+    checked = _lag_checks.get(alias)
+    if checked is None or now - checked[0] >= settings.REPLICA_LAG_CHECK_INTERVAL:
+        try:
+            lag = replica_lag(alias)
+        except (DatabaseError, OSError):
+            logger.warning("replica %s is unavailable", alias, exc_info=True)
+            lag = math.inf
+        checked = _lag_checks[alias] = (now, lag)
+    return checked[1] is None or checked[1] <= settings.REPLICA_LAG_TOLERANCE
+
+
+def pick_replica():
+    """A replica within the lag tolerance, or None."""
+    fresh = [alias for alias in settings.READ_REPLICAS if is_fresh(alias)]
+    return random.choice(fresh) if fresh else None
+
+
+# ------------------------
+# Routers
+# ------------------------
+SHARDED_MODELS = {"core.appointment", "core.archivedappointment", "core.doctordailystats"}
+
+
+class ShardRouter:
+    """
+    settings.DATABASE_ROUTERS entry (before ReplicaRouter): with sharding on,
+    an appointment or daily stats row, or those of a doctor, are read and
+    written on the doctor's shard (core.sharding). Querysets with no instance to go by
+    pick their shard with .using().
+    """
+
+    def _shard(self, model, instance):
+        if len(settings.APPOINTMENT_SHARDS) < 2 or model._meta.label_lower not in SHARDED_MODELS:
+            return None
+        from core.sharding import shard_for
+
+        label = instance._meta.label_lower if instance is not None else None
+        # a deferred doctor_id would be loaded through this router; such a row stays where it was read
+        if label in SHARDED_MODELS and instance.__dict__.get("doctor_id") is not None:
+            return shard_for(instance.doctor_id)
+        if label == "core.doctorprofile" and instance.pk is not None:
+            return shard_for(instance.pk)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._shard(model, hints.get("instance"))
+
+    def db_for_write(self, model, **hints):
+        return self._shard(model, hints.get("instance"))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # users and profiles are copied to every shard
+        shards = set(settings.APPOINTMENT_SHARDS)
+        if obj1._state.db in shards and obj2._state.db in shards:
+            return True
+        return None
+
+
+class ReplicaRouter:
+    """settings.DATABASE_ROUTERS entry; does nothing until READ_REPLICAS is set."""
+
+    def db_for_read(self, model, **hints):
+        state = current_reads.get()
+        if state is None or not settings.READ_REPLICAS:
+            return None
+        if (not state.replica or state.pinned or state.wrote or model._meta.app_label != "core"
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        if state.alias is None:
+            # one replica per request, so its pages read one consistent copy
+            state.alias = pick_replica() or DEFAULT_DB_ALIAS
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        if not settings.READ_REPLICAS:
+            return None
+        state = current_reads.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        copies = {DEFAULT_DB_ALIAS, *settings.READ_REPLICAS}
+        if obj1._state.db in copies and obj2._state.db in copies:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get their schema from the primary
+        if db in settings.READ_REPLICAS:
+            return False
+        return None
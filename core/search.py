@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from core.models import User, DoctorProfile
+from core.routers import primary_reads
+
+FACETS_KEY = "doctor-specialization-facets"
+
+
+def specialization_facets():
+    """[(specialization, number of doctors)], cached until a doctor profile changes."""
+    facets = cache.get(FACETS_KEY)
+    if facets is None:
+        with primary_reads():
+            facets = list(
+                DoctorProfile.objects.values_list("specialization")
+                .annotate(doctors=Count("id"))
+                .order_by("specialization")
+            )
+        cache.set(FACETS_KEY, facets, settings.DOCTOR_FACETS_TIMEOUT)
+    return facets
+
+
+@receiver(post_save, sender=DoctorProfile)
+@receiver(post_delete, sender=DoctorProfile)
+def doctor_changed(sender, **kwargs):
+    cache.delete(FACETS_KEY)
+
+
+@receiver(post_save, sender=User)
+def user_renamed(sender, instance, created, update_fields=None, **kwargs):
+    # the doctor's name is part of DoctorProfile.search_text
+    if created or instance.role != "DOCTOR":
+        return
+    if update_fields is not None and "username" not in update_fields:
+        return  # e.g. last_login on every login
+    profile = DoctorProfile.objects.filter(user=instance).first()
+    if profile is None:
+        return
+    profile.user = instance
+    if profile.search_text != profile.build_search_text():
+        profile.save(update_fields=["search_text"])
@@ -0,0 +1,158 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import (
+    User, PatientProfile, DoctorProfile, InactiveDoctor, Appointment,
+    CONFLICT_MESSAGE, EXPIRED_MESSAGE, normalize_search,
+)
+from core.sharding import is_sharded, mirror_reference_data
+from core.slots import local_day, day_slots
+from core.stats import rebuild as rebuild_daily_stats
+
+SEED_PASSWORD = "password"
+
+SPECIALIZATIONS = [
+    "General", "Cardiology", "Dermatology", "Neurology", "Orthopedics",
+    "Pediatrics", "Psychiatry", "Ophthalmology", "ENT", "Gynecology",
+]
+
+REASONS = ["Checkup", "Follow-up", "Fever", "Back pain", "Headache", "Skin rash", "Prescription refill"]
+
+DOCTOR_REJECTIONS = ["Not available at this time.", "Please book with a specialist.", "Clinic closed."]
+
+# share of appointments per status, for past and for future dates
+PAST_STATUSES = (["APPROVED"] * 6 + ["REJECTED"] * 3 + ["PENDING"])
+FUTURE_STATUSES = (["PENDING"] * 5 + ["APPROVED"] * 4 + ["REJECTED"])
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _bulk_create(model, rows, batch_size):
+    """bulk_create `rows` (any iterable) one committed batch at a time; returns how many."""
+    total = 0
+    for batch in _batches(rows, batch_size):
+        with transaction.atomic():
+            model.objects.bulk_create(batch)
+        total += len(batch)
+    return total
+
+
+def _random_mask(rng):
+    # most doctors work on weekdays, some on weekends too
+    mask = 0
+    for day in range(7):
+        if rng.random() < (0.8 if day < 5 else 0.2):
+            mask |= 1 << day
+    return mask or 1
+
+
+def _appointment(rng, slots, doctor_id, mask, patient_id, now, today, past_days, future_days):
+    while True:
+        day = today + timedelta(days=rng.randint(-past_days, future_days))
+        if mask & (1 << day.weekday()):
+            break
+    if day not in slots:
+        slots[day] = list(day_slots(day))
+    date = rng.choice(slots[day])
+    status = rng.choice(PAST_STATUSES if date < now else FUTURE_STATUSES)
+
+    appt = Appointment(
+        doctor_id=doctor_id, patient_id=patient_id, date=date, status=status,
+        reason=rng.choice(REASONS),
+    )
+    if status == "APPROVED":
+        appt.doctor_message = "See you then."
+    elif status == "REJECTED":
+        appt.rejection_message = rng.choice(DOCTOR_REJECTIONS + [CONFLICT_MESSAGE, EXPIRED_MESSAGE])
+    return appt
+
+
+def seed(doctors=50, patients=1000, appointments=10_000, pending_doctors=10,
+         past_days=365, future_days=30, domain="seed.local", batch_size=10_000,
+         random_seed=None, log=None):
+    """
+    Fill the database with a realistic clinic: doctors with specializations
+    and working weekdays, patients, pending doctor registrations, and
+    appointments on bookable slots over the past `past_days` and the next
+    `future_days` days (mostly settled in the past, mostly pending ahead,
+    including overdue PENDING rows).
+
+    Everything goes through bulk_create, so no save() or post_save runs:
+    search_text and availability_mask are filled in here, and the daily
+    stats are counted once at the end. Accounts use
+    @`domain` emails and SEED_PASSWORD. Returns the number of rows created
+    per model.
+    """
+    rng = random.Random(random_seed)
+    log = log or (lambda message: None)
+    password = make_password(SEED_PASSWORD)
+    now = timezone.now()
+    created = {}
+
+    log(f"Seeding {doctors} doctors and {patients} patients...")
+    created["users"] = _bulk_create(User, (
+        User(email=f"{role.lower()}{i}@{domain}", username=f"{role.title()} {i}", role=role, password=password)
+        for role, count in (("DOCTOR", doctors), ("PATIENT", patients))
+        for i in range(count)
+    ), batch_size)
+
+    seeded = User.objects.filter(email__endswith=f"@{domain}")
+    doctor_profiles = []
+    for user in seeded.filter(role="DOCTOR", doctor_profile__isnull=True).iterator(chunk_size=batch_size):
+        specialization = rng.choice(SPECIALIZATIONS)
+        doctor_profiles.append(DoctorProfile(
+            user=user,
+            specialization=specialization,
+            availability_mask=_random_mask(rng),
+            search_text=normalize_search(f"{user.username} {specialization}"),
+        ))
+    created["doctor_profiles"] = _bulk_create(DoctorProfile, doctor_profiles, batch_size)
+    patient_user_ids = list(seeded.filter(role="PATIENT", patient_profile__isnull=True).values_list("id", flat=True))
+    created["patient_profiles"] = _bulk_create(PatientProfile, (
+        PatientProfile(user_id=user_id, phone=f"+91{rng.randint(7_000_000_000, 9_999_999_999)}")
+        for user_id in patient_user_ids
+    ), batch_size)
+
+    created["inactive_doctors"] = _bulk_create(InactiveDoctor, (
+        InactiveDoctor(
+            email=f"applicant{i}@{domain}", username=f"Applicant {i}", password=password,
+            specialization=rng.choice(SPECIALIZATIONS), availability_mask=_random_mask(rng),
+        )
+        for i in range(pending_doctors)
+    ), batch_size)
+
+    if is_sharded():
+        log("Copying users and profiles to the shards...")
+        mirror_reference_data(batch_size)
+
+    doctor_rows = list(DoctorProfile.objects.filter(user__email__endswith=f"@{domain}")
+                       .values_list("id", "availability_mask"))
+    patient_ids = list(PatientProfile.objects.filter(user__email__endswith=f"@{domain}")
+                       .values_list("id", flat=True))
+    if appointments and not (doctor_rows and patient_ids):
+        raise ValueError("Appointments need at least one doctor and one patient.")
+
+    log(f"Seeding {appointments} appointments...")
+    slots, today = {}, local_day(now)
+    created["appointments"] = _bulk_create(Appointment, (
+        _appointment(rng, slots, *rng.choice(doctor_rows), rng.choice(patient_ids),
+                     now, today, past_days, future_days)
+        for _ in range(appointments)
+    ), batch_size)
+
+    log("Counting daily stats...")
+    rebuild_daily_stats()
+    return created
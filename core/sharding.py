@@ -0,0 +1,200 @@
+"""
+Optional sharding of appointments by doctor (settings.APPOINTMENT_SHARDS,
+configured with DB_SHARDS; off while the default database is the only one).
+
+Every appointment of a doctor, archived ones included, lives on
+shard_for(doctor_id), so the doctor pages, approvals and has_conflict read
+and lock a single database. Patient pages, exports and background jobs
+visit every shard and merge the results (across_shards).
+
+Users and profiles are reference data: they are written to the default
+database and copied to every shard once the save or delete commits, so
+appointment rows keep their foreign keys and select_related() still joins
+on one database. Bulk writes skip the copy (mirror_users() copies the
+users they name); `manage.py rebalance_shards` brings
+the copies up to date and moves appointments whose doctor now belongs on
+another shard after the list of shards changed.
+
+Appointment ids are unique across shards: they are reserved from an
+IdSequence row on the default database, SHARD_ID_BLOCK at a time.
+
+Not covered: a patient's conflicts with approvals on other shards are
+checked and rejected outside the approving transaction, and the admin
+only sees the default database's appointments.
+"""
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Max
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from core.models import User, DoctorProfile, PatientProfile, Appointment, ArchivedAppointment, IdSequence
+
+# copied to every shard, in foreign-key order
+REFERENCE_MODELS = [User, DoctorProfile, PatientProfile]
+
+
+def is_sharded():
+    return len(settings.APPOINTMENT_SHARDS) > 1
+
+
+def shard_for(doctor_id):
+    """The database holding `doctor_id`'s appointments."""
+    shards = settings.APPOINTMENT_SHARDS
+    return shards[doctor_id % len(shards)]
+
+
+def doctor_db(doctor_id):
+    """For .using(): `doctor_id`'s shard, or None (the routers' choice) when not sharded."""
+    return shard_for(doctor_id) if is_sharded() else None
+
+
+def shards():
+    """For .using(): every shard, or just None when not sharded."""
+    return settings.APPOINTMENT_SHARDS if is_sharded() else [None]
+
+
+def across_shards(queryset):
+    """
+    `queryset` on every shard. A queryset already bound to a database
+    (e.g. .using(doctor_db(...))) stays on it.
+    """
+    if not is_sharded() or queryset._db is not None:
+        return [queryset]
+    return [queryset.using(alias) for alias in settings.APPOINTMENT_SHARDS]
+
+
+def first_across_shards(queryset):
+    """The first row of `queryset` found on any shard, or None."""
+    for shard in across_shards(queryset):
+        row = shard.first()
+        if row is not None:
+            return row
+    return None
+
+
+# ------------------------
+# Ids
+# ------------------------
+_ids_lock = threading.Lock()
+_ids = {"next": 0, "end": 0}  # this process's reserved, unused block
+
+
+def highest_appointment_id():
+    return max(
+        (queryset.aggregate(top=Max("id"))["top"] or 0
+         for model in (Appointment, ArchivedAppointment)
+         for queryset in across_shards(model.objects.all())),
+        default=0,
+    )
+
+
+def reserve_ids(count):
+    """Move the shared sequence past `count` ids; the first of them."""
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        sequence = IdSequence.objects.select_for_update().filter(name="appointment").first()
+        if sequence is None:
+            sequence = IdSequence.objects.create(name="appointment", next_id=highest_appointment_id() + 1)
+        first = sequence.next_id
+        IdSequence.objects.filter(name="appointment").update(next_id=first + count)
+    return first
+
+
+def next_appointment_ids(count):
+    """`count` appointment ids no shard has used."""
+    ids = []
+    with _ids_lock:
+        while len(ids) < count:
+            if _ids["next"] == _ids["end"]:
+                size = max(settings.SHARD_ID_BLOCK, count - len(ids))
+                _ids["next"] = reserve_ids(size)
+                _ids["end"] = _ids["next"] + size
+            take = min(count - len(ids), _ids["end"] - _ids["next"])
+            ids.extend(range(_ids["next"], _ids["next"] + take))
+            _ids["next"] += take
+    return ids
+
+
+# ------------------------
+# Reference data
+# ------------------------
+def copy_rows(model, rows, alias):
+    """Insert or overwrite `rows` of `model` on `alias`, keeping their ids."""
+    fields = [f.name for f in model._meta.concrete_fields if not f.primary_key]
+    model._base_manager.using(alias).bulk_create(
+        rows, update_conflicts=True, unique_fields=[model._meta.pk.name], update_fields=fields,
+    )
+
+
+def mirror_users(user_ids):
+    """
+    Copy these users and their profiles to the other shards once the default
+    database's transaction commits, after bulk writes (which send no post_save).
+    """
+    if not is_sharded():
+        return
+    user_ids = list(user_ids)
+
+    def copy():
+        for model in REFERENCE_MODELS:
+            lookup = "pk__in" if model is User else "user_id__in"
+            rows = list(model._base_manager.using(DEFAULT_DB_ALIAS).filter(**{lookup: user_ids}))
+            for alias in settings.APPOINTMENT_SHARDS[1:]:
+                copy_rows(model, rows, alias)
+    transaction.on_commit(copy, using=DEFAULT_DB_ALIAS)
+
+
+def mirror_reference_data(batch_size=1000, log=None):
+    """Copy every user and profile of the default database to the other shards."""
+    log = log or (lambda message: None)
+    for model in REFERENCE_MODELS:
+        copied = 0
+        rows = model._base_manager.using(DEFAULT_DB_ALIAS).order_by("pk")
+        last_pk = 0
+        while True:
+            batch = list(rows.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            for alias in settings.APPOINTMENT_SHARDS[1:]:
+                copy_rows(model, batch, alias)
+            copied += len(batch)
+        log(f"{model.__name__}: {copied} copied to {len(settings.APPOINTMENT_SHARDS) - 1} shard(s)")
+
+
+# The copies are written once the default database's transaction commits,
+# so a rolled back write leaves nothing behind on the shards.
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=DoctorProfile)
+@receiver(post_save, sender=PatientProfile)
+def reference_saved(sender, instance, using, raw=False, update_fields=None, **kwargs):
+    if raw or using != DEFAULT_DB_ALIAS or not is_sharded():
+        return
+    # written on every login, and never read from a shard
+    if update_fields is not None and set(update_fields) <= {"last_login"}:
+        return
+    pk = instance.pk
+
+    def copy():
+        # as committed, whatever the instance holds by now
+        rows = list(sender._base_manager.using(DEFAULT_DB_ALIAS).filter(pk=pk))
+        for alias in settings.APPOINTMENT_SHARDS[1:]:
+            copy_rows(sender, rows, alias)
+    transaction.on_commit(copy, using=DEFAULT_DB_ALIAS)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=DoctorProfile)
+@receiver(post_delete, sender=PatientProfile)
+def reference_deleted(sender, instance, using, **kwargs):
+    # the copies cascade to the appointments on their shard
+    if using != DEFAULT_DB_ALIAS or not is_sharded():
+        return
+    pk = instance.pk
+
+    def delete():
+        for alias in settings.APPOINTMENT_SHARDS[1:]:
+            sender._base_manager.using(alias).filter(pk=pk).delete()
+    transaction.on_commit(delete, using=DEFAULT_DB_ALIAS)
@@ -0,0 +1,204 @@
+import heapq
+from bisect import bisect_left, bisect_right
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core.models import Appointment, CONFLICT_WINDOW, appointments_bulk_updated
+from core.routers import primary_reads
+from core.sharding import across_shards, doctor_db
+
+
+def local_day(date):
+    return timezone.localtime(date).date()
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _cache_key(doctor_id, day):
+    return f"day-schedule:{doctor_id}:{day.isoformat()}"
+
+
+class DaySchedule:
+    """
+    Which times of one doctor's day are taken, built from a single query.
+    With DAY_SCHEDULE_CACHE on it is kept in the cache until an appointment
+    of that doctor and day changes.
+
+    Only APPROVED and PENDING rows are kept; PENDING rows whose time has
+    passed are skipped at lookup time, like everywhere else.
+    """
+
+    def __init__(self, doctor_id, day, rows):
+        self.doctor_id = doctor_id
+        self.day = day
+        self.by_patient = {}
+        approved = []
+        for appt_id, patient_id, date, status in rows:
+            self.by_patient.setdefault(patient_id, []).append((date, appt_id, status))
+            if status == "APPROVED":
+                approved.append((date, appt_id))
+        approved.sort()
+        self.approved_dates = [date for date, _ in approved]
+        self.approved_ids = [appt_id for _, appt_id in approved]
+
+    @classmethod
+    def load(cls, doctor_id, day):
+        if not settings.DAY_SCHEDULE_CACHE:
+            return cls(doctor_id, day, cls._rows(doctor_id, day))
+
+        key = _cache_key(doctor_id, day)
+        rows = cache.get(key)
+        if rows is None:
+            rows = cls._rows(doctor_id, day)
+            cache.set(key, rows, settings.SLOT_INDEX_TIMEOUT)
+        return cls(doctor_id, day, rows)
+
+    @staticmethod
+    def query(doctor_id, day):
+        start = day_start(day)
+        return Appointment.objects.using(doctor_db(doctor_id)).filter(
+            doctor_id=doctor_id,
+            status__in=["PENDING", "APPROVED"],
+            date__gte=start,
+            date__lt=start + timedelta(days=1),
+        ).values_list("id", "patient_id", "date", "status")
+
+    @classmethod
+    def _rows(cls, doctor_id, day):
+        # conflict checks trust this copy: never take it from a replica
+        with primary_reads():
+            return list(cls.query(doctor_id, day))
+
+    def patient_booking(self, patient_id, exclude_id=None):
+        """Date of the patient's live booking with this doctor on this day, if any."""
+        now = timezone.now()
+        for date, appt_id, status in sorted(self.by_patient.get(patient_id, [])):
+            if appt_id != exclude_id and (status == "APPROVED" or date >= now):
+                return date
+        return None
+
+    def approved_near(self, date, exclude_id=None):
+        """Date of an approved appointment within CONFLICT_WINDOW of `date`, if any."""
+        lo = bisect_left(self.approved_dates, date - CONFLICT_WINDOW)
+        hi = bisect_right(self.approved_dates, date + CONFLICT_WINDOW)
+        for i in range(lo, hi):
+            if self.approved_ids[i] != exclude_id:
+                return self.approved_dates[i]
+        return None
+
+
+def doctor_booking(doctor_id, date, exclude_id=None, schedule=None):
+    """
+    Approved appointment of the doctor overlapping `date`, looking across
+    midnight if needed. `schedule` is the DaySchedule of `date`'s day, if
+    the caller has it already.
+    """
+    days = {local_day(date - CONFLICT_WINDOW), local_day(date), local_day(date + CONFLICT_WINDOW)}
+    for day in sorted(days):
+        if schedule is None or schedule.day != day:
+            schedule = DaySchedule.load(doctor_id, day)
+        clash = schedule.approved_near(date, exclude_id)
+        if clash:
+            return clash
+    return None
+
+
+def day_slots(day):
+    """Start times of the bookable slots of a clinic day."""
+    start = day_start(day) + timedelta(hours=settings.CLINIC_OPEN_HOUR)
+    end = day_start(day) + timedelta(hours=settings.CLINIC_CLOSE_HOUR)
+    step = timedelta(minutes=settings.SLOT_MINUTES)
+    slot = start
+    while slot < end:
+        yield slot
+        slot += step
+
+
+def approved_between(doctor_ids, start, end):
+    """(doctor_id, date) of the doctors' approved appointments that overlap [start, end), by date."""
+    return Appointment.objects.approved().filter(
+        doctor_id__in=doctor_ids,
+        date__gte=start - CONFLICT_WINDOW,
+        date__lt=end + CONFLICT_WINDOW,
+    ).order_by("date").values_list("doctor_id", "date")
+
+
+def next_free_slots(doctors, count=5, days=None):
+    """
+    The next `count` bookable slots of `doctors`, earliest first, as
+    (slot, doctor) pairs, looking `days` days ahead.
+
+    The approved appointments of every doctor over the whole horizon come
+    from one range query, so searching a whole specialization costs the
+    same number of queries as searching one doctor.
+    """
+    days = min(days or settings.SLOT_SEARCH_DAYS, settings.SLOT_SEARCH_MAX_DAYS)
+    doctors = list(doctors)
+    now = timezone.now()
+    today = local_day(now)
+    horizon_end = day_start(today + timedelta(days=days))
+
+    taken = {}
+    approved = approved_between([d.id for d in doctors], now, horizon_end)
+    # each doctor is on one shard, so its dates stay in order
+    for shard in across_shards(approved):
+        for doctor_id, date in shard:
+            taken.setdefault(doctor_id, []).append(date)
+
+    def slots_of(doctor):
+        booked = taken.get(doctor.id, [])
+        for offset in range(days):
+            day = today + timedelta(days=offset)
+            if not doctor.is_available_on(day):
+                continue
+            for slot in day_slots(day):
+                i = bisect_left(booked, slot - CONFLICT_WINDOW)
+                if slot > now and (i == len(booked) or booked[i] > slot + CONFLICT_WINDOW):
+                    yield slot, doctor
+
+    merged = heapq.merge(*(slots_of(d) for d in doctors), key=lambda pair: pair[0])
+    return list(islice(merged, count))
+
+
+# ------------------------
+# Invalidation
+# ------------------------
+def invalidate_days(pairs, using=None):
+    """
+    Drop the cached schedules of these (doctor_id, date) pairs once the
+    write's transaction on `using` commits: dropped any earlier, a check
+    running before the commit would cache the old schedule again.
+    """
+    if not settings.DAY_SCHEDULE_CACHE:
+        return
+    keys = list({_cache_key(doctor_id, local_day(date)) for doctor_id, date in pairs})
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys), using=using)
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def appointment_saved(sender, instance, using, **kwargs):
+    pairs = [(instance.doctor_id, instance.date)]
+    loaded = getattr(instance, "_loaded", {})
+    if loaded.get("date") and loaded.get("doctor_id"):
+        # an edit may have moved the appointment off its old day
+        pairs.append((loaded["doctor_id"], loaded["date"]))
+    invalidate_days(pairs, using)
+
+
+@receiver(appointments_bulk_updated, sender=Appointment)
+def appointments_updated(sender, rows, fields, using=None, **kwargs):
+    pairs = [(row["doctor_id"], row["date"]) for row in rows]
+    if isinstance(fields.get("date"), datetime):
+        pairs += [(row["doctor_id"], fields["date"]) for row in rows]
+    invalidate_days(pairs, using)
@@ -0,0 +1,286 @@
+"""
+Per-doctor daily appointment counts (DoctorDailyStats) behind the admin
+reports, which read nothing else.
+
+Every write to an appointment moves one count from the doctor, day and
+outcome the appointment had to the ones it has now, inside the same
+transaction: save() and delete() through post_save/post_delete (what the
+row was comes from the snapshot taken when it was loaded), queryset
+updates through appointments_bulk_updated, and the archiver when it
+settles expired requests. bulk_create() sends no signal: after bulk loads,
+`manage.py rebuild_daily_stats` counts everything again from the
+appointment and archive tables.
+
+With sharding on, a doctor's counts live on the doctor's shard, next to
+the appointments they count.
+"""
+from collections import Counter
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from core.models import (
+    Appointment, ArchivedAppointment, DoctorDailyStats, DoctorProfile,
+    CONFLICT_MESSAGE, EXPIRED_MESSAGE, appointments_bulk_updated,
+)
+from core.sharding import across_shards, doctor_db, shards
+from core.slots import day_slots, day_start, local_day
+
+OUTCOMES = ("pending", "approved", "rejected", "conflicts", "expired")
+
+# outcome() in SQL, for counting
+OUTCOME_FILTERS = {
+    "pending": Q(status="PENDING"),
+    "approved": Q(status="APPROVED"),
+    "rejected": Q(status="REJECTED") & ~Q(rejection_message__in=[CONFLICT_MESSAGE, EXPIRED_MESSAGE]),
+    "conflicts": Q(status="REJECTED", rejection_message=CONFLICT_MESSAGE),
+    "expired": Q(status="REJECTED", rejection_message=EXPIRED_MESSAGE),
+}
+
+
+def outcome(status, rejection_message):
+    """The DoctorDailyStats column an appointment in this state counts in."""
+    if status != "REJECTED":
+        return status.lower()
+    return {CONFLICT_MESSAGE: "conflicts", EXPIRED_MESSAGE: "expired"}.get(rejection_message, "rejected")
+
+
+def stats_key(doctor_id, date, status, rejection_message):
+    return doctor_id, local_day(date), outcome(status, rejection_message)
+
+
+# ------------------------
+# Incremental updates
+# ------------------------
+def apply(deltas, using=None):
+    """
+    Add `deltas` ({(doctor_id, day, outcome): change}) to the stored counts,
+    with two statements per database however many rows and days they cover.
+    """
+    by_db = {}
+    for (doctor_id, day, name), change in deltas.items():
+        if change:
+            days = by_db.setdefault(doctor_db(doctor_id) or using, {})
+            days.setdefault((doctor_id, day), Counter())[name] += change
+
+    for db, days in by_db.items():
+        stats = DoctorDailyStats.objects.using(db)
+        # removals only touch rows that exist; a doctor being deleted takes its rows along
+        if any(change > 0 for counts in days.values() for change in counts.values()):
+            stats.bulk_create([DoctorDailyStats(doctor_id=d, day=day) for d, day in days], ignore_conflicts=True)
+        changes = {}
+        for name in OUTCOMES:
+            whens = [
+                When(doctor_id=doctor_id, day=day, then=Value(counts[name]))
+                for (doctor_id, day), counts in days.items() if counts[name]
+            ]
+            if whens:
+                changes[name] = F(name) + Case(*whens, default=Value(0))
+        stats.filter(reduce(or_, (Q(doctor_id=d, day=day) for d, day in days))).update(**changes)
+
+
+def _counted_as(instance):
+    """Where `instance` was counted before this write, or None when it was not loaded whole."""
+    if hasattr(instance, "_counted"):
+        return instance._counted
+    loaded = getattr(instance, "_loaded", {})
+    if all(name in loaded for name in ("doctor_id", "date", "status", "rejection_message")):
+        return stats_key(loaded["doctor_id"], loaded["date"], loaded["status"], loaded["rejection_message"])
+    return None
+
+
+def settle_archived(appointments, using=None):
+    """Expired requests are archived as expired rejections (core.archive): count them as such."""
+    deltas = Counter()
+    for appt in appointments:
+        if appt.is_expired:
+            deltas[stats_key(appt.doctor_id, appt.date, "PENDING", "")] -= 1
+            deltas[stats_key(appt.doctor_id, appt.date, "REJECTED", EXPIRED_MESSAGE)] += 1
+    apply(deltas, using)
+
+
+@receiver(post_save, sender=Appointment)
+def appointment_saved(sender, instance, created, using, raw=False, **kwargs):
+    if raw:
+        return
+    now = stats_key(instance.doctor_id, instance.date, instance.status, instance.rejection_message)
+    before = None if created else _counted_as(instance)
+    if created or before is not None:
+        deltas = Counter({now: 1})
+        if before is not None:
+            deltas[before] -= 1
+        apply(deltas, using)
+    else:
+        # saved without knowing what it was: count its days again
+        loaded = getattr(instance, "_loaded", {})
+        pairs = {(instance.doctor_id, now[1])}
+        if "date" in loaded:
+            pairs.add((loaded.get("doctor_id", instance.doctor_id), local_day(loaded["date"])))
+        recount(pairs, using)
+    # a second save() of the same instance starts from here
+    instance._counted = now
+
+
+@receiver(post_delete, sender=Appointment)
+def appointment_deleted(sender, instance, using, **kwargs):
+    before = _counted_as(instance) or stats_key(
+        instance.doctor_id, instance.date, instance.status, instance.rejection_message
+    )
+    apply(Counter({before: -1}), using)
+
+
+@receiver(appointments_bulk_updated, sender=Appointment)
+def appointments_updated(sender, rows, fields, using=None, **kwargs):
+    changes = {name: fields[name] for name in ("date", "status", "rejection_message") if name in fields}
+    for name in ("doctor", "doctor_id"):
+        if name in fields:
+            changes["doctor_id"] = getattr(fields[name], "pk", fields[name])
+    if not changes:
+        return
+    if any(hasattr(value, "resolve_expression") for value in changes.values()):
+        # computed by the database: count the days the rows were on again
+        recount({(row["doctor_id"], local_day(row["date"])) for row in rows}, using)
+        return
+
+    deltas = Counter()
+    for row in rows:
+        after = {**row, **changes}
+        deltas[stats_key(row["doctor_id"], row["date"], row["status"], row["rejection_message"])] -= 1
+        deltas[stats_key(after["doctor_id"], after["date"], after["status"], after["rejection_message"])] += 1
+    apply(deltas, using)
+
+
+# ------------------------
+# Counting from scratch
+# ------------------------
+def _count(doctor_ids, db, days=None):
+    """{(doctor_id, day): Counter of outcomes} of these doctors' appointments, archived ones included."""
+    counts = {}
+    for model in (Appointment, ArchivedAppointment):
+        rows = model._base_manager.using(db).filter(doctor_id__in=doctor_ids)
+        if days:
+            rows = rows.filter(reduce(or_, (
+                Q(date__gte=day_start(day), date__lt=day_start(day + timedelta(days=1))) for day in days
+            )))
+        rows = rows.annotate(day=TruncDate("date")).values("doctor_id", "day").annotate(
+            **{f"n_{name}": Count("id", filter=condition) for name, condition in OUTCOME_FILTERS.items()}
+        ).order_by()
+        for row in rows:
+            counted = counts.setdefault((row["doctor_id"], row["day"]), Counter())
+            counted.update({name: row[f"n_{name}"] for name in OUTCOMES})
+    return counts
+
+
+def _store(doctor_ids, db, days=None):
+    """Replace the stored counts of these doctors (on these days) with fresh ones; the number of rows written."""
+    counts = _count(doctor_ids, db, days)
+    stored = DoctorDailyStats.objects.using(db).filter(doctor_id__in=doctor_ids)
+    if days:
+        stored = stored.filter(day__in=days)
+    with transaction.atomic(using=db):
+        stored.delete()
+        DoctorDailyStats.objects.using(db).bulk_create([
+            DoctorDailyStats(doctor_id=doctor_id, day=day, **{name: counted[name] for name in OUTCOMES})
+            for (doctor_id, day), counted in counts.items()
+        ])
+    return len(counts)
+
+
+def recount(pairs, using=None):
+    """Count these (doctor_id, day) pairs again."""
+    by_db = {}
+    for doctor_id, day in pairs:
+        doctor_ids, days = by_db.setdefault(doctor_db(doctor_id) or using, (set(), set()))
+        doctor_ids.add(doctor_id)
+        days.add(day)
+    for db, (doctor_ids, days) in by_db.items():
+        _store(doctor_ids, db, days)
+
+
+def rebuild(doctor_ids=None, batch_size=200, log=None):
+    """
+    Count the days of these doctors (default: every doctor, dropping counts
+    left for doctors that no longer exist) again, `batch_size` doctors per
+    transaction. Returns the number of rows written.
+    """
+    log = log or (lambda message: None)
+    written = 0
+    everyone = doctor_ids is None
+    if everyone:
+        doctor_ids = list(DoctorProfile.objects.order_by("id").values_list("id", flat=True))
+    doctor_ids = sorted(doctor_ids)
+    for i in range(0, len(doctor_ids), batch_size):
+        by_db = {}
+        for doctor_id in doctor_ids[i:i + batch_size]:
+            by_db.setdefault(doctor_db(doctor_id), []).append(doctor_id)
+        for db, ids in by_db.items():
+            written += _store(ids, db)
+        log(f"{min(i + batch_size, len(doctor_ids))} of {len(doctor_ids)} doctors counted")
+    if everyone:
+        for db in shards():
+            DoctorDailyStats.objects.using(db).exclude(doctor_id__in=doctor_ids).delete()
+    return written
+
+
+# ------------------------
+# Reports
+# ------------------------
+def _percent(part, whole):
+    return round(100 * part / whole, 1) if whole else None
+
+
+def _rates(row):
+    decided = row["approved"] + row["rejected"] + row["conflicts"] + row["expired"]
+    row["requests"] = decided + row["pending"]
+    row["approval_rate"] = _percent(row["approved"], decided)
+    row["utilization"] = _percent(row["approved"], row["capacity"])
+    return row
+
+
+def doctor_report(start, end, today):
+    """
+    Per doctor, between the days `start` and `end` (inclusive): requests by
+    outcome, the approval rate of the settled ones, and utilization, the
+    approved appointments against the slots of the doctor's working days.
+    Requests still pending on a day before `today` count as expired, as
+    they are shown everywhere else. Returns (rows busiest first, with their
+    DoctorProfile, and the totals).
+    """
+    stats = DoctorDailyStats.objects.filter(day__gte=start, day__lte=end).values("doctor_id").annotate(
+        overdue=Sum("pending", filter=Q(day__lt=today)), **{f"n_{name}": Sum(name) for name in OUTCOMES}
+    ).order_by()
+    rows = {}
+    for shard in across_shards(stats):
+        for row in shard:
+            # each doctor is on one shard
+            counted = {name: row[f"n_{name}"] or 0 for name in OUTCOMES}
+            counted["pending"] -= row["overdue"] or 0
+            counted["expired"] += row["overdue"] or 0
+            rows[row["doctor_id"]] = {"doctor_id": row["doctor_id"], **counted}
+
+    # slots per weekday over the range, by the working-day mask
+    weekdays = Counter((start + timedelta(days=i)).weekday() for i in range((end - start).days + 1))
+    slots = len(list(day_slots(start)))
+    doctors = DoctorProfile.objects.select_related("user").in_bulk(list(rows))
+    for doctor_id, row in rows.items():
+        row["doctor"] = doctors.get(doctor_id)
+        mask = row["doctor"].availability_mask if row["doctor"] else 0
+        row["capacity"] = slots * sum(n for weekday, n in weekdays.items() if mask & (1 << weekday))
+        _rates(row)
+
+    total = {name: sum(row[name] for row in rows.values()) for name in (*OUTCOMES, "capacity")}
+    _rates(total)
+    refused = total["rejected"] + total["conflicts"] + total["expired"]
+    total["causes"] = [
+        (label, total[name], _percent(total[name], refused))
+        for name, label in (("rejected", "Rejected by the doctor"),
+                            ("conflicts", "Clashed with an approved appointment"),
+                            ("expired", "Not answered in time"))
+    ]
+    return sorted(rows.values(), key=lambda row: (-row["requests"], row["doctor_id"])), total
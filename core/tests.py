@@ -1,3 +1,1546 @@
-from django.test import TestCase
+import csv
+import json
+import math
+import re
+from datetime import timedelta
+from importlib import reload
+from io import StringIO
+from unittest import TestSuite, mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, Client, AsyncClient, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse, resolve, clear_url_caches
+from django.utils import timezone
+
+import core.urls
+import medibook.urls
+from core.archive import archive_appointments
+from core.counters import dashboard_summary
+from core.expiry import expire_overdue_appointments
+from core.importer import import_accounts
+from core.middleware import RequestTimingMiddleware
+from core.management.commands.approval_race import Command as ApprovalRace, overlapping_approvals
+from core.management.commands.explain_queries import view_queries
+from core.models import (
+    AppointmentQuerySet, User, DoctorProfile, PatientProfile, InactiveDoctor, Appointment, ArchivedAppointment, DoctorDailyStats,
+    IdSequence, CONFLICT_MESSAGE, EXPIRED_MESSAGE, appointments_bulk_updated,
+)
+from core.pagination import EstimatedCountPaginator
+from core.routers import PIN_COOKIE, ReadState, ReplicaRouter, ShardRouter, current_reads, replica_reads, _lag_checks
+from core.sharding import next_appointment_ids, shard_for
+from core.slots import DaySchedule, day_start, local_day, next_free_slots
+from core.stats import OUTCOMES, rebuild as rebuild_daily_stats
+from core.timing import RequestTiming, route_stats
+from core.views.export_views import EXPORT_FIELDS
+from core.views.doctor_views import approve_appointment
+
+
+# ------------------------
+# Fixture factory
+# ------------------------
+def make_user(name, role):
+    return User.objects.create_user(email=f"{name}@test.local", username=name, password="pw", role=role)
+
+
+def make_doctor(name, specialization="Cardiology", availability=range(7)):
+    return DoctorProfile.objects.create(
+        user=make_user(name, "DOCTOR"), specialization=specialization, availability=list(availability)
+    )
+
+
+def make_patient(name):
+    return PatientProfile.objects.create(user=make_user(name, "PATIENT"))
+
+
+def make_appointments(doctor, patient, days):
+    """One appointment per status `days` days ahead of now, and one per status `days` days ago."""
+    now = timezone.now()
+    return Appointment.objects.bulk_create([
+        Appointment(doctor=doctor, patient=patient, reason="Checkup", status=status,
+                    date=now + timedelta(days=sign * days, hours=hour))
+        for sign in (1, -1)
+        for hour, status in enumerate(["PENDING", "APPROVED", "REJECTED"])
+    ])
+
+
+# ------------------------
+# Query budgets
+# ------------------------
+# Every page must run the same number of queries whatever the number of rows
+# behind it. Each count includes the session and user lookups (2 queries).
+DOCTOR_PAGES = [
+    ("doctor_dashboard", {}, 4),
+    ("doctor_requests", {}, 3),
+    ("doctor_history", {}, 5),
+    ("doctor_history_status", {"status": "pending"}, 3),
+    ("doctor_history_status", {"status": "approved"}, 3),
+    ("doctor_history_status", {"status": "rejected"}, 3),
+    ("doctor_history_status", {"status": "all"}, 3),
+    ("doctor_history_status", {"status": "all"}, 4, {"archived": "1"}),
+    ("doctor_profile", {}, 2),
+    ("doctor_profile_edit", {}, 2),
+]
+
+PATIENT_PAGES = [
+    ("patient_dashboard", {}, 4),
+    ("make_appointment", {}, 5),
+    ("patient_history", {}, 7),
+    ("patient_history_status", {"status": "pending"}, 3),
+    ("patient_history_status", {"status": "approved"}, 3),
+    ("patient_history_status", {"status": "rejected"}, 3),
+    ("patient_history_status", {"status": "rejected"}, 4, {"archived": "1"}),
+    ("patient_profile", {}, 2),
+    ("patient_profile_edit", {}, 2),
+]
+
+API_PAGES = [
+    ("api_dashboard", {}, 4),
+    ("api_appointments", {}, 3),
+    ("api_appointments", {}, 3, {"status": "rejected"}),
+    ("api_doctors", {}, 5),
+]
+
+ADMIN_PAGES = [
+    ("admin_dashboard", {}, 4),
+    ("admin_import", {}, 2),
+    ("admin_reports", {}, 4),
+]
+
+PUBLIC_PAGES = [
+    ("home", {}, 0),
+    ("patient_login", {}, 0),
+    ("patient_register", {}, 0),
+    ("doctor_login", {}, 0),
+    ("doctor_register", {}, 0),
+    ("admin_login", {}, 0),
+]
+
+# rows per doctor/patient: small enough to build quickly, larger than a page
+SIZES = (1, 5, 15)
+
+
+@override_settings(
+    HISTORY_PAGE_SIZE=10, DOCTORS_PAGE_SIZE=10, DASHBOARD_COUNTER_CACHE=False,
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+)
+class QueryBudgetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = make_doctor("doctor")
+        self.patient = make_patient("patient")
+        self.admin = User.objects.create_superuser(email="admin@test.local", username="admin", password="pw")
+        self.size = 0
+
+        self.clients = {}
+        for role, user in (("doctor", self.doctor.user), ("patient", self.patient.user), ("admin", self.admin)):
+            self.clients[role] = Client()
+            self.clients[role].force_login(user)
+        self.clients["public"] = Client()
+
+    def grow(self, size):
+        """Give the doctor, the patient and the admin `size` rows of everything."""
+        for i in range(self.size, size):
+            other_doctor = make_doctor(f"doctor{i}")
+            other_patient = make_patient(f"patient{i}")
+            make_appointments(self.doctor, other_patient, days=i + 1)
+            make_appointments(other_doctor, self.patient, days=i + 1)
+            InactiveDoctor.objects.create(username=f"applicant{i}", email=f"applicant{i}@test.local",
+                                          specialization="Cardiology", availability=[0, 1])
+        # bulk_create skips the daily stats, like in seeding
+        rebuild_daily_stats()
+        self.size = max(self.size, size)
+        cache.clear()
+
+    def assertPageQueries(self, role, pages):
+        """Request every (url name, kwargs, budget[, query]) of `pages` at every size in SIZES."""
+        for size in SIZES:
+            self.grow(size)
+            for name, kwargs, budget, *query in pages:
+                url = reverse(name, kwargs=kwargs)
+                cache.clear()
+                with self.subTest(page=url, query=query, size=size), self.assertNumQueries(budget):
+                    response = self.clients[role].get(url, *query)
+                    self.assertEqual(response.status_code, 200)
+
+    def test_public_pages(self):
+        self.assertPageQueries("public", PUBLIC_PAGES)
+
+    def test_doctor_pages(self):
+        self.assertPageQueries("doctor", DOCTOR_PAGES)
+
+    def test_patient_pages(self):
+        self.assertPageQueries("patient", PATIENT_PAGES)
+
+    def test_api(self):
+        self.assertPageQueries("doctor", API_PAGES)
+        self.assertPageQueries("patient", API_PAGES)
+
+    def test_admin_pages(self):
+        self.assertPageQueries("admin", ADMIN_PAGES)
+
+    def test_doctor_detail(self):
+        # lists every approved appointment of the doctor with the patient's name
+        self.assertPageQueries("patient", [("doctor_detail", {"doctor_id": self.doctor.id}, 4)])
+
+    def test_history_pages_after_the_first(self):
+        # a deep page costs what the first one does
+        self.grow(SIZES[-1])
+        for role, name, kwargs, page_key, budget in (
+            ("doctor", "doctor_history", {}, "approved", 5),
+            ("patient", "patient_history", {}, "approved", 7),
+            ("doctor", "doctor_history_status", {"status": "all"}, "appointments", 3),
+        ):
+            url = reverse(name, kwargs=kwargs)
+            page = self.clients[role].get(url).context[page_key]
+            self.assertTrue(page.has_next)
+            with self.subTest(page=url), self.assertNumQueries(budget):
+                self.clients[role].get(f"{url}?{page.next_query}")
+
+    def test_doctor_search(self):
+        self.assertPageQueries("patient", [
+            ("make_appointment", {}, 5, {"q": "doc", "specialization": "Cardiology"}),
+            ("make_appointment", {}, 5, {"day": "2", "page": "2"}),
+            ("doctor_autocomplete", {}, 3, {"q": "doc"}),
+        ])
+
+    def test_free_slots(self):
+        self.assertPageQueries("patient", [
+            ("doctor_free_slots", {"doctor_id": self.doctor.id}, 4),
+            ("free_slots_search", {}, 4, {"specialization": "Cardiology"}),
+        ])
+
+    def test_edit_appointment(self):
+        appt = Appointment.objects.create(doctor=self.doctor, patient=self.patient, reason="Checkup",
+                                          date=timezone.now() + timedelta(days=30))
+        self.assertPageQueries("patient", [("edit_appointment", {"appointment_id": appt.id}, 3)])
+
+    def test_approve_request(self):
+        for size in SIZES:
+            self.grow(size)
+            appt = Appointment.objects.create(doctor=self.doctor, patient=self.patient, reason="Checkup",
+                                              date=timezone.now() + timedelta(days=100 + size))
+            url = reverse("approve_request", kwargs={"appt_id": appt.id})
+            # locks, re-read, clash check, approve and the set-based conflict reject
+            # (which snapshots its rows first and skips its UPDATE when none
+            # match; the approval reuses the locked row), the change markers and
+            # daily stats moved by the approval, inside a savepoint here
+            with self.subTest(size=size), self.assertNumQueries(15):
+                self.clients["doctor"].post(url, {"doctor_message": "ok"})
+            appt.refresh_from_db()
+            self.assertEqual(appt.status, "APPROVED")
+
+    def test_export(self):
+        # rows are streamed, so the queries run while the body is read
+        for size in SIZES:
+            self.grow(size)
+            for role in ("doctor", "patient", "admin"):
+                for query, budget in (({"format": "json"}, 3), ({"format": "json", "archived": "1"}, 4)):
+                    with self.subTest(role=role, size=size, query=query), self.assertNumQueries(budget):
+                        response = self.clients[role].get(reverse("export_appointments"), query)
+                        b"".join(response.streaming_content)
+
+    def test_django_admin(self):
+        # names joined into the list query, no COUNT(*) of the table
+        appt = make_appointments(self.doctor, self.patient, days=50)[0]
+        self.assertPageQueries("admin", [
+            ("admin:core_appointment_changelist", {}, 7),
+            ("admin:core_appointment_changelist", {}, 6, {"q": "doc"}),
+            ("admin:core_appointment_changelist", {}, 6, {"status__exact": "APPROVED"}),
+            ("admin:core_appointment_changelist", {}, 5, {"date__year": str(appt.date.year)}),
+            ("admin:core_patientprofile_changelist", {}, 5),
+            ("admin:core_doctorprofile_changelist", {}, 5, {"q": "doc"}),
+        ])
+
+    def test_batch_approve_requests(self):
+        # however many requests are selected, the batch is resolved with a fixed set of statements
+        start = timezone.now() + timedelta(days=200)
+        for size in SIZES:
+            self.grow(size)
+            # one more request than rows, so every batch has a clash to reject
+            patients = [make_patient(f"batch{size}-{i}") for i in range(size + 1)]
+            appts = Appointment.objects.bulk_create([
+                Appointment(doctor=self.doctor, patient=patient, reason="Checkup",
+                            date=start + timedelta(days=size, minutes=20 * i))
+                for i, patient in enumerate(patients)
+            ])
+            with self.subTest(size=size), self.assertNumQueries(20):
+                self.clients["doctor"].post(reverse("batch_update_requests"),
+                                            {"ids": [a.id for a in appts], "action": "approve"})
+            statuses = [a.status for a in Appointment.objects.filter(pk__in=[a.id for a in appts]).order_by("date")]
+            # 20 minutes apart: every other request clashes with the one before it
+            expected = ["APPROVED", "REJECTED"] * (len(appts) // 2) + ["APPROVED"] * (len(appts) % 2)
+            self.assertEqual(statuses, expected)
+
+
+class AsyncQueryBudgetTests(QueryBudgetTests):
+    """The same budgets with the async read views of ASGI mode."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with override_settings(ASYNC_VIEWS=True):
+            cls.load_urls()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.load_urls()
+        super().tearDownClass()
+
+    @staticmethod
+    def load_urls():
+        # core.urls picks its views on import; the project urls hold on to that module
+        reload(core.urls)
+        reload(medibook.urls)
+        clear_url_caches()
+
+    def test_async_views_are_served(self):
+        for name in ("doctor_dashboard", "patient_history", "make_appointment"):
+            self.assertEqual(resolve(reverse(name)).func.__module__, "core.views.async_views")
+
+
+# ------------------------
+# Query plans
+# ------------------------
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class ExplainQueriesTests(TestCase):
+
+    def setUp(self):
+        self.doctor = make_doctor("doctor")
+        self.patient = make_patient("patient")
+        make_appointments(self.doctor, self.patient, days=2)
+
+    def test_plans_the_queries_the_views_run(self):
+        planned = dict(view_queries(self.doctor, self.patient))
+        for name, user, url in (
+            ("doctor_history_status: all", self.doctor.user, reverse("doctor_history_status", args=["all"])),
+            ("doctor_detail", self.patient.user, reverse("doctor_detail", args=[self.doctor.id])),
+        ):
+            self.client.force_login(user)
+            with CaptureQueriesContext(connection) as ran:
+                self.client.get(url)
+            with CaptureQueriesContext(connection) as plan:
+                list(planned[name])
+            with self.subTest(name=name):
+                self.assertIn(plan[0]["sql"], [query["sql"] for query in ran])
+
+    def test_prints_a_plan_per_query(self):
+        out = StringIO()
+        call_command("explain_queries", stdout=out)
+        for name in ("doctor_dashboard: summary", "doctor_history_status: all, next page", "next_free_slots"):
+            self.assertIn(f"-- {name}\n", out.getvalue())
+
+
+# ------------------------
+# Request timing
+# ------------------------
+@override_settings(REQUEST_TIMING=True, REQUEST_TIMING_REPEAT_THRESHOLD=3,
+                   PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class RequestTimingTests(TestCase):
+    HEADER = r'^db;dur=[\d.]+;desc="(\d+) queries", tpl;dur=[\d.]+, total;dur=[\d.]+'
+
+    def setUp(self):
+        cache.clear()
+        self.patient = make_patient("patient")
+        self.client = Client()  # builds its middleware chain with REQUEST_TIMING on
+        self.client.force_login(self.patient.user)
+
+    def test_header_log_and_route_stats(self):
+        with self.assertLogs("core.timing", "INFO") as logs, CaptureQueriesContext(connection) as ran:
+            response = self.client.get(reverse("patient_dashboard"))
+        queries = int(re.match(self.HEADER + "$", response["Server-Timing"]).group(1))
+        self.assertEqual(queries, len(ran))
+
+        (log,) = logs.records
+        record = json.loads(log.getMessage())
+        self.assertEqual(log.levelname, "INFO")
+        self.assertEqual((record["view"], record["status"], record["queries"], record["repeated"]),
+                         ("patient_dashboard", 200, queries, []))
+        self.assertTrue(record["slowest_sql"].startswith("SELECT"))
+        stats = route_stats()["patient_dashboard"]
+        self.assertEqual((stats["requests"], stats["max_queries"], stats["nplusone_requests"]), (1, queries, 0))
+
+    def test_repeated_queries_are_flagged(self):
+        timing = RequestTiming()
+        with connection.execute_wrapper(timing):
+            for pk in range(4):
+                list(User.objects.filter(pk=pk))  # one statement, four times
+            list(User.objects.filter(pk__in=[1, 2]))
+            list(User.objects.filter(pk__in=[1, 2, 3]))
+        (shape, count), = timing.repeated(3)
+        self.assertEqual(count, 4)
+        self.assertIn('"core_user"."id" = %s', shape)
+        self.assertEqual(timing.repeated(1)[1][1], 2)  # IN lists of any length compare equal
+
+        with override_settings(REQUEST_TIMING_REPEAT_THRESHOLD=0), self.assertLogs("core.timing") as logs:
+            response = self.client.get(reverse("patient_dashboard"))
+        self.assertIn('nplusone;desc="', response["Server-Timing"])
+        self.assertEqual(logs.records[0].levelname, "WARNING")
+        self.assertTrue(json.loads(logs.records[0].getMessage())["repeated"])
+        self.assertEqual(route_stats()["patient_dashboard"]["nplusone_requests"], 1)
+
+    async def test_async_chain_stays_async(self):
+        async def view(request):
+            await User.objects.filter(pk=0).afirst()
+            await User.objects.filter(pk=1).afirst()
+            return HttpResponse()
+
+        middleware = RequestTimingMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        with self.assertLogs("core.timing"):
+            response = await middleware(RequestFactory().get("/"))
+        self.assertEqual(re.match(self.HEADER, response["Server-Timing"]).group(1), "2")
+
+
+# ------------------------
+# Approvals
+# ------------------------
+class ApprovalTests(TestCase):
+
+    def setUp(self):
+        self.doctor = make_doctor("doctor")
+        self.patients = [make_patient(f"patient{i}") for i in range(3)]
+        self.start = timezone.now() + timedelta(days=3)
+
+    def request(self, patient, minutes, doctor=None):
+        return Appointment.objects.create(doctor=doctor or self.doctor, patient=patient, reason="Checkup",
+                                          date=self.start + timedelta(minutes=minutes))
+
+    def test_approval_rejects_the_overlapping_requests(self):
+        appt = self.request(self.patients[0], 0)
+        clash = self.request(self.patients[1], 10)
+        other_doctor = self.request(self.patients[0], 20, doctor=make_doctor("other"))
+        apart = self.request(self.patients[2], 120)
+
+        self.assertEqual(approve_appointment(appt, "ok"), ("APPROVED", 2))
+        statuses = dict(Appointment.objects.values_list("id", "status"))
+        self.assertEqual([statuses[a.id] for a in (appt, clash, other_doctor, apart)],
+                         ["APPROVED", "REJECTED", "REJECTED", "PENDING"])
+        self.assertEqual(Appointment.objects.get(pk=clash.pk).rejection_message, CONFLICT_MESSAGE)
+        self.assertEqual(Appointment.objects.get(pk=appt.pk).doctor_message, "ok")
+
+    def test_request_overlapping_an_approval_is_rejected_as_a_conflict(self):
+        first, second = self.request(self.patients[0], 0), self.request(self.patients[1], 10)
+        # approved behind the conflict reject's back, as another process would
+        Appointment.objects.filter(pk=first.pk).update(status="APPROVED")
+
+        self.assertEqual(approve_appointment(second, "ok"), ("CONFLICT", 0))
+        second.refresh_from_db()
+        self.assertEqual((second.status, second.rejection_message, second.doctor_message),
+                         ("REJECTED", CONFLICT_MESSAGE, ""))
+
+    def test_approval_does_not_read_the_request_again(self):
+        appt = self.request(self.patients[0], 0)
+        heard = []
+        receiver = lambda sender, rows, fields, **kwargs: heard.append((rows, fields))
+        appointments_bulk_updated.connect(receiver, sender=Appointment)
+        self.addCleanup(appointments_bulk_updated.disconnect, receiver, sender=Appointment)
+        # savepoint and release, locks, re-read and clash check (6), the
+        # approval and its listeners' writes (5), and the snapshot finding
+        # nothing else to reject, with no UPDATE after it
+        with self.assertNumQueries(12):
+            self.assertEqual(approve_appointment(appt), ("APPROVED", 0))
+        (rows, fields), = heard
+        self.assertEqual([(row["id"], row["status"]) for row in rows], [(appt.id, "PENDING")])
+        self.assertEqual(fields["status"], "APPROVED")
+
+    def test_only_pending_requests_are_approved(self):
+        appt = self.request(self.patients[0], 0)
+        approve_appointment(appt)
+        self.assertEqual(approve_appointment(appt), (None, 0))
+
+        overdue = Appointment.objects.create(doctor=self.doctor, patient=self.patients[1], reason="Checkup",
+                                             date=timezone.now() - timedelta(hours=1))
+        self.assertEqual(approve_appointment(overdue), (None, 0))
+        self.assertEqual(Appointment.objects.get(pk=overdue.pk).status, "PENDING")
+
+
+@skipUnless(settings.DATABASES["default"]["ENGINE"] == "django.db.backends.sqlite3", "runs against SQLite")
+class ApprovalRaceTests(TransactionTestCase):
+    """Overlapping approvals from many threads at once (the approval_race harness)."""
+
+    def test_no_overlapping_approvals(self):
+        results = ApprovalRace().run(threads=6, rounds=3)
+        self.assertEqual(results["errors"], 0)
+        # per round, one of the doctor's requests and one of the patient's win
+        self.assertEqual(results["APPROVED"], 2 * 3)
+        self.assertEqual(overlapping_approvals("doctor_id") + overlapping_approvals("patient_id"), [])
+
+
+# ------------------------
+# Conflict checks and free slots
+# ------------------------
+@override_settings(DAY_SCHEDULE_CACHE=False, PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class ScheduleTests(TestCase):
+    """Every write shows up in the next conflict check and free-slot list."""
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = make_doctor("doctor")
+        self.patients = [make_patient(f"patient{i}") for i in range(3)]
+        self.day = timezone.localdate() + timedelta(days=3)
+        self.ten = day_start(self.day) + timedelta(hours=10)
+
+    def written(self):
+        # the cache is dropped when the write commits
+        return self.captureOnCommitCallbacks(execute=True)
+
+    def conflict(self, patient, date):
+        conflict = Appointment(doctor=self.doctor, patient=patient, reason="Checkup", date=date).has_conflict()
+        return conflict and conflict["type"]
+
+    def free_slots(self):
+        return [slot for slot, _ in next_free_slots([self.doctor], count=100, days=4) if local_day(slot) == self.day]
+
+    def test_book_approve_edit_expire(self):
+        first, second, third = self.patients
+        with self.written():
+            booked = Appointment.objects.create(doctor=self.doctor, patient=first, reason="Checkup", date=self.ten)
+        # one request per patient and doctor a day; a request does not hold the doctor's time
+        self.assertEqual(self.conflict(first, self.ten + timedelta(hours=3)), "PATIENT_CONFLICT")
+        self.assertIsNone(self.conflict(second, self.ten + timedelta(minutes=10)))
+        self.assertIn(self.ten, self.free_slots())
+
+        self.client.force_login(self.doctor.user)
+        with self.written():
+            self.client.post(reverse("approve_request", args=[booked.id]), {"doctor_message": "ok"})
+        self.assertEqual(self.conflict(second, self.ten + timedelta(minutes=10)), "DOCTOR_CONFLICT")
+        slots = self.free_slots()
+        self.assertNotIn(self.ten, slots)
+        self.assertIn(self.ten + timedelta(hours=1), slots)
+
+        # moved to another day: the old day is free for the patient, the new one taken
+        with self.written():
+            moved = Appointment.objects.create(doctor=self.doctor, patient=second, reason="Checkup",
+                                               date=self.ten + timedelta(days=1))
+        self.assertEqual(self.conflict(second, self.ten + timedelta(days=1, hours=2)), "PATIENT_CONFLICT")
+        moved = Appointment.objects.get(pk=moved.pk)
+        with self.written():
+            moved.date = self.ten + timedelta(hours=4)
+            moved.save()
+        self.assertIsNone(self.conflict(second, self.ten + timedelta(days=1, hours=2)))
+        self.assertEqual(self.conflict(second, self.ten + timedelta(hours=6)), "PATIENT_CONFLICT")
+
+        # an overdue request holds nothing, before and after the worker rejects it
+        with self.written():
+            overdue = Appointment.objects.create(doctor=self.doctor, patient=third, reason="Checkup",
+                                                 date=timezone.now() - timedelta(minutes=1))
+        later = timezone.now() + timedelta(minutes=5)
+        self.assertIsNone(self.conflict(third, later))
+        self.assertIn(third.id, DaySchedule.load(self.doctor.id, local_day(overdue.date)).by_patient)
+        with self.written():
+            self.assertEqual(expire_overdue_appointments(), 1)
+        self.assertIsNone(self.conflict(third, later))
+        self.assertNotIn(third.id, DaySchedule.load(self.doctor.id, local_day(overdue.date)).by_patient)
+
+    def test_checks_run_one_query_per_day(self):
+        Appointment.objects.create(doctor=self.doctor, patient=self.patients[0], reason="Checkup", date=self.ten)
+        with self.assertNumQueries(1):
+            self.conflict(self.patients[1], self.ten + timedelta(hours=2))
+
+
+@override_settings(DAY_SCHEDULE_CACHE=True)
+class CachedScheduleTests(ScheduleTests):
+    """The same checks answered from the cached day schedules."""
+
+    def test_checks_run_one_query_per_day(self):
+        Appointment.objects.create(doctor=self.doctor, patient=self.patients[0], reason="Checkup", date=self.ten)
+        self.conflict(self.patients[1], self.ten + timedelta(hours=2))
+        with self.assertNumQueries(0):
+            self.conflict(self.patients[1], self.ten + timedelta(hours=2))
+
+    def test_cache_is_dropped_when_the_approval_commits(self):
+        booked = Appointment.objects.create(doctor=self.doctor, patient=self.patients[0], reason="Checkup",
+                                            date=self.ten)
+        stale = DaySchedule._rows(self.doctor.id, self.day)
+        self.client.force_login(self.doctor.user)
+        with self.written():
+            with transaction.atomic():
+                self.client.post(reverse("approve_request", args=[booked.id]), {"doctor_message": "ok"})
+            # a check on another connection before the commit caches the old schedule
+            cache.set(f"day-schedule:{self.doctor.id}:{self.day.isoformat()}", stale)
+            self.assertIsNone(self.conflict(self.patients[1], self.ten + timedelta(minutes=10)))
+        self.assertEqual(self.conflict(self.patients[1], self.ten + timedelta(minutes=10)), "DOCTOR_CONFLICT")
+
+
+@override_settings(CLINIC_OPEN_HOUR=9, CLINIC_CLOSE_HOUR=12, SLOT_MINUTES=60,
+                   PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class SlotSearchTests(TestCase):
+    """next_free_slots() and the slot endpoints, with the clock on a Monday at 8:00."""
+
+    def setUp(self):
+        today = timezone.localdate()
+        self.monday = today + timedelta(days=7 - today.weekday())
+        self.now = day_start(self.monday) + timedelta(hours=8)
+        self.patient = make_patient("patient")
+
+    def at(self, days, hour, minute=0):
+        return day_start(self.monday + timedelta(days=days)) + timedelta(hours=hour, minutes=minute)
+
+    def approve(self, doctor, date):
+        Appointment.objects.create(doctor=doctor, patient=self.patient, reason="Checkup", date=date,
+                                   status="APPROVED")
+
+    def search(self, doctors, count=20, days=7):
+        with mock.patch("core.slots.timezone.now", return_value=self.now):
+            return [(slot, doctor.user.username) for slot, doctor in next_free_slots(doctors, count, days)]
+
+    def test_working_days_only(self):
+        doctor = make_doctor("doctor", availability=[0, 2])  # Monday and Wednesday
+        self.assertEqual(self.search([doctor]), [(self.at(day, hour), "doctor") for day in (0, 2)
+                                                 for hour in (9, 10, 11)])
+
+    def test_approved_appointments_take_their_slots(self):
+        doctor = make_doctor("doctor", availability=[0])
+        self.approve(doctor, self.at(0, 10))
+        self.approve(doctor, self.at(0, 11, 25))  # within the conflict window of 11:00
+        Appointment.objects.create(doctor=doctor, patient=self.patient, reason="Checkup", date=self.at(0, 9))
+        self.approve(make_doctor("other", availability=[0]), self.at(0, 9))
+        self.assertEqual(self.search([doctor], days=1), [(self.at(0, 9), "doctor")])
+
+    def test_stops_at_the_horizon(self):
+        doctor = make_doctor("doctor", availability=[0, 2])
+        self.assertEqual(len(self.search([doctor], days=2)), 3)
+        self.assertEqual(len(self.search([doctor], days=3)), 6)
+        self.assertEqual(len(self.search([doctor], count=4, days=3)), 4)
+        # the horizon is capped
+        with override_settings(SLOT_SEARCH_MAX_DAYS=2):
+            self.assertEqual(len(self.search([doctor], days=30)), 3)
+
+    def test_doctors_are_merged_earliest_first(self):
+        anna = make_doctor("anna", availability=[0])
+        bob = make_doctor("bob", availability=[0, 1])
+        self.approve(anna, self.at(0, 9))
+        self.approve(bob, self.at(0, 11))
+        self.assertEqual(self.search([anna, bob], count=5), [
+            (self.at(0, 9), "bob"), (self.at(0, 10), "anna"), (self.at(0, 10), "bob"),
+            (self.at(0, 11), "anna"), (self.at(1, 9), "bob"),
+        ])
+
+    def test_specialization_search_is_capped(self):
+        doctors = [make_doctor(f"doctor{i}", "Dermatology") for i in range(3)]
+        make_doctor("cardiologist", "Cardiology")
+        make_doctor("off", "Dermatology", availability=[])
+        self.client.force_login(self.patient.user)
+
+        def found(**settings_):
+            with override_settings(**settings_):
+                response = self.client.get(reverse("free_slots_search"),
+                                           {"specialization": "dermatology", "n": 50, "days": 7})
+            return {slot["doctor_id"] for slot in response.json()["slots"]}
+
+        self.assertEqual(found(), {doctor.id for doctor in doctors})
+        self.assertEqual(found(SLOT_SEARCH_MAX_DOCTORS=2), {doctor.id for doctor in doctors[:2]})
+
+
+class AvailabilityMaskTests(TransactionTestCase):
+    """Migration 0005 turns the weekday lists into masks that available_on() reads."""
+
+    DAYS = {"weekdays": [0, 1, 2, 3, 4], "mon-wed": [0, 2], "weekend": ["5", 6], "never": [], "always": list(range(7))}
+
+    def migrate(self, *targets):
+        executor = MigrationExecutor(connection)
+        targets = list(targets) or executor.loader.graph.leaf_nodes()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def test_lists_become_masks(self):
+        self.addCleanup(self.migrate)
+        old = self.migrate(("core", "0004_doctor_search"))
+        OldUser, OldProfile = old.get_model("core", "User"), old.get_model("core", "DoctorProfile")
+        for name, days in self.DAYS.items():
+            user = OldUser.objects.create(username=name, email=f"{name}@test.local", role="DOCTOR")
+            OldProfile.objects.create(user=user, specialization="Cardiology", availability=days)
+        old.get_model("core", "InactiveDoctor").objects.create(
+            username="pending", email="pending@test.local", specialization="Cardiology", availability=[0, 2])
+
+        self.migrate()
+        masks = dict(DoctorProfile.objects.values_list("user__username", "availability_mask"))
+        self.assertEqual(masks, {"weekdays": 0b0011111, "mon-wed": 0b101, "weekend": 0b1100000,
+                                 "never": 0, "always": 0b1111111})
+        self.assertEqual(InactiveDoctor.objects.get().availability_mask, 0b101)
+        for weekday in range(7):
+            with self.subTest(weekday=weekday):
+                found = set(DoctorProfile.objects.available_on(weekday).values_list("user__username", flat=True))
+                self.assertEqual(found, {name for name, days in self.DAYS.items()
+                                         if weekday in {int(day) for day in days}})
+
+        # and back
+        old = self.migrate(("core", "0004_doctor_search"))
+        lists = dict(old.get_model("core", "DoctorProfile").objects.values_list("user__username", "availability"))
+        self.assertEqual(lists, {name: sorted(int(day) for day in days) for name, days in self.DAYS.items()})
+
+
+# ------------------------
+# Expiry
+# ------------------------
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class ExpiryTests(TestCase):
+
+    def setUp(self):
+        self.doctor = make_doctor("doctor")
+        self.patient = make_patient("patient")
+        now = timezone.now()
+        self.overdue = [
+            Appointment.objects.create(doctor=self.doctor, patient=self.patient, reason=f"overdue {i}",
+                                       date=now - timedelta(days=5 - i))
+            for i in range(5)
+        ]
+        self.upcoming = Appointment.objects.create(doctor=self.doctor, patient=self.patient, reason="upcoming",
+                                                   date=now + timedelta(days=1))
+        self.approved = Appointment.objects.create(doctor=self.doctor, patient=self.patient, reason="approved",
+                                                   status="APPROVED", date=now - timedelta(days=1))
+
+    def statuses(self):
+        return dict(Appointment.objects.values_list("reason", "status"))
+
+    def test_only_overdue_pending_rows_are_rejected(self):
+        self.assertEqual(expire_overdue_appointments(), 5)
+        statuses = self.statuses()
+        self.assertEqual({statuses[appt.reason] for appt in self.overdue}, {"REJECTED"})
+        self.assertEqual((statuses["upcoming"], statuses["approved"]), ("PENDING", "APPROVED"))
+        self.assertEqual(set(Appointment.objects.filter(status="REJECTED").values_list("rejection_message", flat=True)),
+                         {EXPIRED_MESSAGE})
+        self.assertEqual(expire_overdue_appointments(), 0)
+
+    def test_batches_are_bounded(self):
+        # oldest first, two per UPDATE, two UPDATEs per run
+        self.assertEqual(expire_overdue_appointments(batch_size=2, max_batches=2), 4)
+        self.assertEqual(self.statuses()["overdue 4"], "PENDING")
+        self.assertEqual(expire_overdue_appointments(batch_size=2, max_batches=2), 1)
+
+    def test_rows_approved_mid_run_are_left_alone(self):
+        overdue = AppointmentQuerySet.overdue
+        raced = self.overdue[0]
+
+        def approve_after_selecting(queryset):
+            # the doctor approves once the worker has picked its batch
+            ids = list(overdue(queryset).values_list("id", flat=True))
+            Appointment.objects.filter(pk=raced.pk).update(status="APPROVED")
+            return queryset.filter(id__in=ids)
+
+        with mock.patch.object(AppointmentQuerySet, "overdue", approve_after_selecting):
+            self.assertEqual(expire_overdue_appointments(max_batches=1), 4)
+        self.assertEqual(self.statuses()[raced.reason], "APPROVED")
+
+    def test_reads_show_overdue_requests_as_rejected_before_the_worker_runs(self):
+        overdue = self.overdue[0]
+        self.assertEqual((overdue.current_status, overdue.current_rejection_message), ("REJECTED", EXPIRED_MESSAGE))
+        self.assertNotIn(overdue, Appointment.objects.pending())
+        self.assertIn(overdue, Appointment.objects.rejected())
+        self.assertEqual(list(Appointment.objects.pending()), [self.upcoming])
+
+        self.client.force_login(self.patient.user)
+        response = self.client.get(reverse("patient_history_status", kwargs={"status": "rejected"}))
+        self.assertEqual({appt.reason for appt in response.context["appointments"]},
+                         {appt.reason for appt in self.overdue})
+        # nothing was written
+        self.assertEqual(set(self.statuses().values()), {"PENDING", "APPROVED"})
+
+
+# ------------------------
+# Dashboard counters
+# ------------------------
+@override_settings(DASHBOARD_COUNTER_CACHE=True)
+class CounterCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = make_doctor("doctor")
+        self.patient = make_patient("patient")
+        self.appt = Appointment.objects.create(doctor=self.doctor, patient=self.patient, reason="Checkup",
+                                               date=timezone.now() + timedelta(days=2))
+
+    def test_cache_is_dropped_when_the_approval_commits(self):
+        stale = dashboard_summary("doctor", self.doctor.id)
+        self.assertEqual((stale["PENDING"], stale["APPROVED"]), (1, 0))
+
+        self.client.force_login(self.doctor.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.client.post(reverse("approve_request", args=[self.appt.id]), {"doctor_message": "ok"})
+            # a dashboard read on another connection before the commit still sees the request pending
+            cache.set(f"appointment-summary:doctor:{self.doctor.id}", stale)
+            self.assertEqual(dashboard_summary("doctor", self.doctor.id)["APPROVED"], 0)
+
+        for field, owner in (("doctor", self.doctor), ("patient", self.patient)):
+            summary = dashboard_summary(field, owner.id)
+            self.assertEqual((summary["PENDING"], summary["APPROVED"]), (0, 1))
+            self.assertEqual(summary["upcoming"], self.appt)
+
+
+# ------------------------
+# Export
+# ------------------------
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.doctor = make_doctor("doctor", "Dermatology")
+        self.patient = make_patient("patient")
+        self.day = timezone.localdate() + timedelta(days=10)
+
+        def book(days, status, **fields):
+            return Appointment.objects.create(
+                doctor=fields.pop("doctor", self.doctor), patient=fields.pop("patient", self.patient),
+                reason="Checkup", status=status, date=day_start(self.day + timedelta(days=days)) + timedelta(hours=10),
+                **fields,
+            )
+
+        self.pending = book(0, "PENDING")
+        self.approved = book(1, "APPROVED", doctor_message="See you")
+        self.rejected = book(2, "REJECTED", rejection_message="Fully booked")
+        self.overdue = Appointment.objects.create(doctor=self.doctor, patient=self.patient, reason="Rash",
+                                                  date=timezone.now() - timedelta(days=1))
+        # another patient's appointment with this doctor, and theirs with another doctor
+        someone = make_patient("someone")
+        self.others = [
+            book(1, "APPROVED", patient=someone),
+            book(0, "PENDING", patient=someone, doctor=make_doctor("other")),
+        ]
+
+    def export(self, user, **query):
+        self.client.force_login(user)
+        response = self.client.get(reverse("export_appointments"), query)
+        self.assertEqual(response.status_code, 200)
+        body = b"".join(response.streaming_content).decode()
+        if query.get("format") == "json":
+            return json.loads(body)
+        lines = body.splitlines()
+        self.assertEqual(lines[0], ",".join(EXPORT_FIELDS))
+        return list(csv.DictReader(lines))
+
+    def ids(self, rows):
+        return [int(row["id"]) for row in rows]
+
+    def test_rows_follow_the_header(self):
+        rows = self.export(self.doctor.user)
+        self.assertEqual(self.ids(rows), [a.id for a in (self.overdue, self.pending, self.approved, self.others[0],
+                                                         self.rejected)])
+        self.assertEqual(rows[2], {
+            "id": str(self.approved.id),
+            "date": timezone.localtime(self.approved.date).isoformat(),
+            "status": "APPROVED",
+            "doctor": "doctor",
+            "specialization": "Dermatology",
+            "patient": "patient",
+            "patient_email": "patient@test.local",
+            "reason": "Checkup",
+            "doctor_message": "See you",
+            "rejection_message": "",
+        })
+        # an overdue request is exported the way it is shown: rejected
+        self.assertEqual((rows[0]["status"], rows[0]["rejection_message"]), ("REJECTED", EXPIRED_MESSAGE))
+        # the JSON export carries the same rows
+        as_json = self.export(self.doctor.user, format="json")
+        self.assertEqual([{key: str(value) for key, value in row.items()} for row in as_json], rows)
+
+    def test_filters(self):
+        user = self.patient.user
+        for query, expected in (
+            ({}, [self.overdue, self.pending, self.approved, self.rejected]),
+            ({"status": "approved"}, [self.approved]),
+            ({"status": "pending"}, [self.pending]),
+            ({"status": "rejected"}, [self.overdue, self.rejected]),
+            ({"from": (self.day + timedelta(days=1)).isoformat()}, [self.approved, self.rejected]),
+            ({"to": self.day.isoformat()}, [self.overdue, self.pending]),
+            ({"from": self.day.isoformat(), "to": (self.day + timedelta(days=1)).isoformat(),
+              "status": "approved", "format": "json"}, [self.approved]),
+        ):
+            with self.subTest(query=query):
+                self.assertEqual(self.ids(self.export(user, **query)), [a.id for a in expected])
+
+        self.assertEqual(self.client.get(reverse("export_appointments"), {"status": "lost"}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("export_appointments"), {"from": "10/01/2026"}).status_code, 400)
+
+
+# ------------------------
+# Archive
+# ------------------------
+@override_settings(ARCHIVE_AFTER_DAYS=180, ARCHIVE_REJECTED_AFTER_DAYS=30,
+                   PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        self.doctor = make_doctor("doctor")
+        self.patient = make_patient("patient")
+        now = timezone.now()
+        self.rows = {
+            name: Appointment.objects.create(doctor=self.doctor, patient=self.patient, reason=name,
+                                             status=status, date=now - timedelta(days=days))
+            for name, status, days in (
+                ("old approved", "APPROVED", 200),
+                ("recent approved", "APPROVED", 40),
+                ("old rejection", "REJECTED", 40),
+                ("old expiry", "PENDING", 45),
+                ("recent expiry", "PENDING", 3),
+            )
+        }
+
+    def test_moves_rows_past_the_retention_window_in_batches(self):
+        self.assertEqual(archive_appointments(batch_size=2), 3)
+        self.assertEqual(archive_appointments(batch_size=2), 0)  # nothing left: resuming is a no-op
+
+        self.assertCountEqual(Appointment.objects.values_list("reason", flat=True),
+                              ["recent approved", "recent expiry"])
+        archived = {appt.reason: appt for appt in ArchivedAppointment.objects.all()}
+        self.assertEqual(set(archived), {"old approved", "old rejection", "old expiry"})
+        self.assertEqual(archived["old expiry"].id, self.rows["old expiry"].id)
+        self.assertEqual(archived["old expiry"].status, "REJECTED")
+        self.assertEqual(archived["old expiry"].rejection_message, EXPIRED_MESSAGE)
+
+    def test_history_includes_the_archive_when_asked(self):
+        archive_appointments()
+        self.client.force_login(self.patient.user)
+        url = reverse("patient_history_status", kwargs={"status": "rejected"})
+
+        recent = [appt.reason for appt in self.client.get(url).context["appointments"]]
+        older = [appt.reason for appt in self.client.get(url, {"archived": "1"}).context["appointments"]]
+        self.assertEqual(recent, ["recent expiry"])
+        self.assertEqual(older, ["recent expiry", "old rejection", "old expiry"])
+
+
+# ------------------------
+# Doctor search
+# ------------------------
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class DoctorSearchTests(TestCase):
+
+    def setUp(self):
+        self.jose = make_doctor("José  Núñez", "Cardiology")
+        self.bob = make_doctor("Bob Jones", "Cardiology")
+        self.anna = make_doctor("Anna Smith", "Dermatology")
+        self.client.force_login(make_patient("patient").user)
+
+    def found(self, q):
+        return list(DoctorProfile.objects.search(q).order_by("search_text").values_list("user__username", flat=True))
+
+    def test_matches_every_word_of_name_or_specialization(self):
+        self.assertEqual(self.jose.search_text, "jose nunez cardiology")
+        for q, expected in (
+            ("jose", ["José  Núñez"]),
+            ("  NÚÑEZ ", ["José  Núñez"]),  # case, accents and spacing do not matter
+            ("josé cardio", ["José  Núñez"]),
+            ("cardio", ["Bob Jones", "José  Núñez"]),
+            ("derm smi", ["Anna Smith"]),
+            ("anna cardio", []),
+        ):
+            with self.subTest(q=q):
+                self.assertEqual(self.found(q), expected)
+
+    def test_renaming_the_user_updates_the_search_text(self):
+        user = self.bob.user
+        user.username = "Bóris Jones"
+        user.save()
+        self.assertEqual(self.found("boris"), ["Bóris Jones"])
+        self.assertEqual(self.found("bob"), [])
+
+    def test_directory_pages_in_name_order(self):
+        response = self.client.get(reverse("make_appointment"), {"q": "Cárdio"})
+        self.assertEqual([d.id for d in response.context["doctors"]], [self.bob.id, self.jose.id])
+        response = self.client.get(reverse("make_appointment"), {"specialization": "Dermatology"})
+        self.assertEqual([d.id for d in response.context["doctors"]], [self.anna.id])
+
+    def test_autocomplete(self):
+        url = reverse("doctor_autocomplete")
+        self.assertEqual(self.client.get(url, {"q": "cardiology"}).json(), {"results": [
+            {"id": self.bob.id, "specialization": "Cardiology", "name": "Bob Jones"},
+            {"id": self.jose.id, "specialization": "Cardiology", "name": "José  Núñez"},
+        ]})
+        self.assertEqual(self.client.get(url, {"q": "nunez"}).json()["results"][0]["id"], self.jose.id)
+        # too short to search, and capped at 10
+        self.assertEqual(self.client.get(url, {"q": "c"}).json(), {"results": []})
+        for i in range(12):
+            make_doctor(f"extra{i}", "Cardiology")
+        self.assertEqual(len(self.client.get(url, {"q": "cardio"}).json()["results"]), 10)
+
+
+# ------------------------
+# Doctor registrations
+# ------------------------
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class RegistrationTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(email="admin@test.local", username="admin", password="pw")
+        self.client.force_login(self.admin)
+        self.applicants = []
+        for name, specialization in (("ann", "Cardiology"), ("ben", "Dermatology"), ("cat", "Neurology")):
+            applicant = InactiveDoctor(username=name, email=f"{name}@test.local", specialization=specialization,
+                                       availability=[0, 4])
+            applicant.set_password("secret")
+            applicant.save()
+            self.applicants.append(applicant)
+
+    def batch(self, action, ids):
+        return self.client.post(reverse("batch_update_doctors"), {"ids": ids, "action": action}, follow=True)
+
+    def pending(self):
+        return set(InactiveDoctor.objects.values_list("username", flat=True))
+
+    def test_batch_approve_creates_doctors(self):
+        ann, ben, _ = self.applicants
+        response = self.batch("approve", [ann.id, ben.id, 9999, "abc"])
+        self.assertContains(response, "2 doctor(s) approved.")
+        self.assertEqual(self.pending(), {"cat"})
+
+        doctor = DoctorProfile.objects.select_related("user").get(user__email="ben@test.local")
+        self.assertEqual((doctor.user.role, doctor.user.username), ("DOCTOR", "ben"))
+        self.assertEqual((doctor.specialization, doctor.availability, doctor.search_text),
+                         ("Dermatology", [0, 4], "ben dermatology"))
+        # the password chosen at registration still logs in
+        self.assertTrue(doctor.user.check_password("secret"))
+        self.assertEqual(DoctorProfile.objects.count(), 2)
+
+    def test_registered_emails_stay_pending(self):
+        ann, ben, _ = self.applicants
+        make_patient("ann")
+        response = self.batch("approve", [ann.id, ben.id])
+        self.assertContains(response, "1 doctor(s) approved.")
+        self.assertContains(response, "1 registration(s) use an email that is already registered.")
+        self.assertEqual(self.pending(), {"ann", "cat"})
+        self.assertFalse(DoctorProfile.objects.filter(user__email="ann@test.local").exists())
+
+    def test_emails_are_compared_whatever_their_case(self):
+        ann, ben, cat = self.applicants
+        make_patient("ann")
+        User.objects.filter(email="ann@test.local").update(email="Ann@Test.local")
+        ben.email = "BEN@test.local"
+        ben.save()
+        twin = InactiveDoctor.objects.create(username="ben again", email="ben@TEST.local", specialization="Neurology")
+        response = self.batch("approve", [ann.id, ben.id, twin.id, cat.id])
+        self.assertContains(response, "2 doctor(s) approved.")
+        self.assertContains(response, "2 registration(s) use an email that is already registered.")
+        self.assertEqual(self.pending(), {"ann", "ben again"})
+        self.assertEqual(sorted(User.objects.filter(role="DOCTOR").values_list("email", flat=True)),
+                         ["BEN@test.local", "cat@test.local"])
+
+    def test_batch_reject_removes_registrations(self):
+        ann, _, cat = self.applicants
+        response = self.batch("reject", [ann.id, cat.id, 9999])
+        self.assertContains(response, "2 registration(s) rejected.")
+        self.assertEqual(self.pending(), {"ben"})
+        self.assertFalse(User.objects.filter(role="DOCTOR").exists())
+
+    def test_nothing_changes_without_a_selection_or_action(self):
+        self.assertContains(self.batch("approve", ["abc"]), "Select at least one doctor.")
+        self.assertContains(self.batch("promote", [self.applicants[0].id]), "Unknown action.")
+        self.assertEqual(self.pending(), {"ann", "ben", "cat"})
+        self.assertFalse(DoctorProfile.objects.exists())
+
+
+# ------------------------
+# Account import
+# ------------------------
+CSV_HEADER = "role,name,email,password,specialization,availability,phone,address"
+
+
+def csv_lines(*rows):
+    return StringIO("\n".join([CSV_HEADER, *rows]) + "\n")
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class ImportTests(TestCase):
+
+    def test_creates_accounts_and_reports_bad_rows(self):
+        result = import_accounts(csv_lines(
+            "doctor,Dana,dana@test.local,pw,Cardiology,Mon;Wed,,",
+            "patient,Pat,pat@test.local,pw,,,555,Main St",
+            "nurse,Nina,nina@test.local,pw,,,,",
+            "doctor,Dave,dave@test.local,pw,,Mon,,",
+            "doctor,Dora,dora@test.local,pw,Dermatology,Funday,,",
+            "patient,Paul,not-an-email,pw,,,,",
+            "patient,,anon@test.local,pw,,,,",
+        ), workers=0)
+
+        self.assertEqual(result.created, {"DOCTOR": 1, "PATIENT": 1})
+        self.assertEqual([row for row, _ in result.errors], [4, 5, 6, 7, 8])
+        self.assertIn("specialization is required", dict(result.errors)[5])
+        doctor = DoctorProfile.objects.get(user__email="dana@test.local")
+        self.assertEqual((doctor.availability, doctor.search_text), ([0, 2], "dana cardiology"))
+        self.assertTrue(doctor.user.check_password("pw"))
+        self.assertEqual(PatientProfile.objects.get(user__email="pat@test.local").address, "Main St")
+
+    def test_skips_registered_and_repeated_emails(self):
+        make_patient("known")
+        InactiveDoctor.objects.create(username="applicant", email="applicant@test.local", specialization="Cardiology")
+        result = import_accounts(csv_lines(
+            "patient,Known,KNOWN@test.local,pw,,,,",
+            "doctor,Applicant,Applicant@Test.local,pw,Cardiology,Mon,,",
+            "patient,New,new@test.local,pw,,,,",
+            "patient,New again,New@test.local,pw,,,,",
+        ), workers=0)
+
+        self.assertEqual((result.created["PATIENT"], result.skipped), (1, 2))
+        self.assertEqual(result.errors, [(5, "new@test.local appears twice in the file")])
+        self.assertEqual(User.objects.filter(email__iexact="known@test.local").count(), 1)
+
+    def test_resumes_from_a_row(self):
+        lines = [f"patient,P{i},p{i}@test.local,pw,,,," for i in range(5)]
+        result = import_accounts(csv_lines(*lines), batch_size=2, workers=0, start_row=4)
+        self.assertEqual(set(User.objects.values_list("email", flat=True)), {"p2@test.local", "p3@test.local",
+                                                                           "p4@test.local"})
+        self.assertEqual(result.last_row, 6)
+
+        # running the whole file again only adds what is missing
+        result = import_accounts(csv_lines(*lines), batch_size=2, workers=0)
+        self.assertEqual((result.created["PATIENT"], result.skipped), (2, 3))
+
+    def test_upload_reports_unreadable_files(self):
+        admin = User.objects.create_superuser(email="admin@test.local", username="admin", password="pw")
+        self.client.force_login(admin)
+        url = reverse("admin_import")
+        for content, message in (
+            ("\n".join([CSV_HEADER, "patient,Zoë,zoe@test.local,pw,,,,"]).encode("latin-1"), "not UTF-8"),
+            (f'{CSV_HEADER}\npatient,"{"x" * 200000}",pat@test.local,pw,,,,\n'.encode(), "Import stopped"),
+        ):
+            with self.subTest(message=message):
+                response = self.client.post(url, {"file": SimpleUploadedFile("accounts.csv", content)}, follow=True)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, message)
+        self.assertFalse(User.objects.filter(email="zoe@test.local").exists())
+
+        # hashed in the web process, without a process pool
+        with mock.patch("core.importer.ProcessPoolExecutor") as pool:
+            response = self.client.post(url, {"file": SimpleUploadedFile(
+                "accounts.csv", f"{CSV_HEADER}\npatient,Pat,pat@test.local,pw,,,,\n".encode("utf-8-sig")
+            )})
+        self.assertEqual(response.context["result"].created["PATIENT"], 1)
+        pool.assert_not_called()
+
+
+# ------------------------
+# Read replicas
+# ------------------------
+# No replica database exists here: the routing decisions are checked
+# directly, and the measured lag is patched.
+@override_settings(READ_REPLICAS=["replica1"], REPLICA_LAG_TOLERANCE=5, REPLICA_LAG_CHECK_INTERVAL=5,
+                   PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class ReplicaRoutingTests(TransactionTestCase):
+
+    def setUp(self):
+        _lag_checks.clear()
+        self.router = ReplicaRouter()
+
+    def read(self, state, model=Appointment):
+        """Where a read of `model` goes inside a @read_replica view."""
+        token = current_reads.set(state)
+        try:
+            with replica_reads():
+                return self.router.db_for_read(model)
+        finally:
+            current_reads.reset(token)
+
+    @mock.patch("core.routers.replica_lag", return_value=0.5)
+    def test_replica_views_read_core_tables_from_a_replica(self, replica_lag):
+        self.assertEqual(self.read(ReadState()), "replica1")
+        self.assertEqual(self.read(ReadState(), Session), "default")
+        # outside the views and outside requests
+        token = current_reads.set(ReadState())
+        self.assertEqual(self.router.db_for_read(Appointment), "default")
+        current_reads.reset(token)
+        self.assertIsNone(self.router.db_for_read(Appointment))
+
+    @mock.patch("core.routers.replica_lag", return_value=0.5)
+    def test_reads_after_a_write_or_inside_a_transaction_use_the_primary(self, replica_lag):
+        state = ReadState()
+        token = current_reads.set(state)
+        self.assertEqual(self.router.db_for_write(Appointment), "default")
+        current_reads.reset(token)
+        self.assertTrue(state.wrote)
+        self.assertEqual(self.read(state), "default")
+
+        self.assertEqual(self.read(ReadState(pinned=True)), "default")
+        with transaction.atomic():
+            self.assertEqual(self.read(ReadState()), "default")
+
+    def test_lagging_or_unreachable_replicas_are_skipped(self):
+        for lag, db in ((30, "default"), (None, "replica1")):  # an unknown lag is trusted
+            _lag_checks.clear()
+            with mock.patch("core.routers.replica_lag", return_value=lag):
+                self.assertEqual(self.read(ReadState()), db)
+
+        _lag_checks.clear()
+        with mock.patch("core.routers.replica_lag", side_effect=OperationalError("gone")), \
+                self.assertLogs("core.routers", "WARNING"):
+            self.assertEqual(self.read(ReadState()), "default")
+
+    @mock.patch("core.routers.replica_lag", return_value=math.inf)
+    def test_writes_pin_the_browser_to_the_primary(self, replica_lag):
+        doctor, patient = make_doctor("doctor"), make_patient("patient")
+        self.client.force_login(patient.user)
+
+        self.assertNotIn(PIN_COOKIE, self.client.get(reverse("patient_dashboard")).cookies)
+
+        date = timezone.localtime() + timedelta(days=2)
+        response = self.client.post(reverse("request_appointment", args=[doctor.id]),
+                                    {"date": date.replace(hour=11, minute=0).strftime("%Y-%m-%dT%H:%M"),
+                                     "reason": "Checkup"})
+        self.assertTrue(Appointment.objects.filter(patient=patient).exists())
+        self.assertEqual(response.cookies[PIN_COOKIE]["max-age"], 10)
+
+
+# ------------------------
+# Sharding
+# ------------------------
+# The routing and the id blocks are checked without shard databases; the
+# rest runs against real ones, e.g.
+#   DB_SHARDS=/tmp/shard1.sqlite3 python manage.py test core
+# With DB_SHARDS set only these two classes run (see load_tests below): the
+# others count queries and read through one database.
+@override_settings(APPOINTMENT_SHARDS=["default", "shard1", "shard2"], SHARD_ID_BLOCK=10)
+class ShardingTests(TestCase):
+
+    def test_a_doctors_appointments_go_to_the_doctors_shard(self):
+        router = ShardRouter()
+        self.assertEqual(router.db_for_write(Appointment, instance=Appointment(doctor_id=4)), "shard1")
+        # doctor.appointment_set.all()
+        self.assertEqual(router.db_for_read(Appointment, instance=DoctorProfile(pk=5)), "shard2")
+        self.assertIsNone(router.db_for_read(Appointment))
+        self.assertIsNone(router.db_for_write(User, instance=User(pk=4)))
+        with override_settings(APPOINTMENT_SHARDS=["default"]):
+            self.assertIsNone(router.db_for_write(Appointment, instance=Appointment(doctor_id=4)))
+
+    @mock.patch.dict("core.sharding._ids", {"next": 0, "end": 0})
+    def test_ids_are_reserved_in_blocks(self):
+        IdSequence.objects.create(name="appointment", next_id=1)
+        self.assertEqual(next_appointment_ids(3), [1, 2, 3])
+        self.assertEqual(next_appointment_ids(8), list(range(4, 12)))  # the rest of the block, then a new one
+        self.assertEqual(IdSequence.objects.get().next_id, 21)
+
+
+@skipUnless(len(settings.APPOINTMENT_SHARDS) > 1, "set DB_SHARDS to run against shard databases")
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class ShardedDatabaseTests(TestCase):
+    databases = {"default", *settings.APPOINTMENT_SHARDS}
+
+    def make_doctor_on(self, alias):
+        for i in range(len(settings.APPOINTMENT_SHARDS)):
+            # copied to the shards when the test's transaction "commits"
+            with self.captureOnCommitCallbacks(execute=True):
+                doctor = make_doctor(f"doctor-{alias}-{i}")
+            if shard_for(doctor.id) == alias:
+                return doctor
+        self.fail(f"no doctor id lands on {alias}")
+
+    def make_patient(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            return make_patient(name)
+
+    def copies(self, model, **lookup):
+        return [model.objects.using(alias).filter(**lookup).first() for alias in settings.APPOINTMENT_SHARDS[1:]]
+
+    def test_users_are_copied_once_committed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError), transaction.atomic():
+                make_patient("rolled-back")
+                raise ValueError
+        self.assertFalse(any(self.copies(User, email="rolled-back@test.local")))
+
+        patient = self.make_patient("patient")
+        user = User.objects.get(pk=patient.user_id)
+        self.assertTrue(all(self.copies(PatientProfile, pk=patient.pk)))
+        # logins do not touch the shards; other changes are copied
+        with self.captureOnCommitCallbacks() as callbacks:
+            user.last_login = timezone.now()
+            user.save(update_fields=["last_login"])
+        self.assertEqual(callbacks, [])
+        with self.captureOnCommitCallbacks(execute=True):
+            user.username = "renamed"
+            user.save()
+        self.assertEqual({copy.username for copy in self.copies(User, pk=user.pk)}, {"renamed"})
+
+    def test_events_wait_for_the_shard_to_commit(self):
+        patient = self.make_patient("patient")
+        alias = settings.APPOINTMENT_SHARDS[1]
+        doctor = self.make_doctor_on(alias)
+        appt = Appointment.objects.create(doctor=doctor, patient=patient, reason="Checkup",
+                                          date=timezone.now() + timedelta(days=3))
+        with mock.patch("core.events.broker.publish") as publish:
+            with self.captureOnCommitCallbacks(execute=True), \
+                    self.captureOnCommitCallbacks(using=alias, execute=True):
+                with self.assertRaises(ValueError), transaction.atomic(using=alias):
+                    approve_appointment(appt)
+                    raise ValueError
+            publish.assert_not_called()
+
+            with self.captureOnCommitCallbacks(using=alias, execute=True):
+                approve_appointment(appt)
+            self.assertEqual({call.args[0][0] for call in publish.call_args_list},
+                             {f"doctor:{doctor.pk}", f"patient:{patient.pk}"})
+
+    def test_appointments_live_on_their_doctors_shard(self):
+        patient = self.make_patient("patient")
+        doctors = [self.make_doctor_on(alias) for alias in settings.APPOINTMENT_SHARDS]
+        for doctor in doctors:
+            make_appointments(doctor, patient, days=2)
+            self.assertEqual(Appointment.objects.using(shard_for(doctor.id)).filter(doctor=doctor).count(), 6)
+            self.assertEqual(doctor.appointment_set.count(), 6)
+            # users and profiles are copied to every shard
+            for alias in settings.APPOINTMENT_SHARDS:
+                self.assertTrue(PatientProfile.objects.using(alias).filter(pk=patient.pk).exists())
+
+        self.client.force_login(patient.user)
+        response = self.client.get(reverse("export_appointments"))
+        self.assertEqual(len(b"".join(response.streaming_content).splitlines()), 1 + 6 * len(doctors))
+
+    def test_rebalance_moves_appointments_to_their_doctors_shard(self):
+        patient = self.make_patient("patient")
+        doctor = self.make_doctor_on(settings.APPOINTMENT_SHARDS[1])
+        with override_settings(APPOINTMENT_SHARDS=["default"]):  # written before the shard was added
+            ids = [appt.id for appt in make_appointments(doctor, patient, days=2)]
+            rebuild_daily_stats()
+
+        call_command("rebalance_shards", stdout=StringIO())
+        self.assertFalse(Appointment.objects.using("default").filter(doctor=doctor).exists())
+        moved = Appointment.objects.using(shard_for(doctor.id)).filter(doctor=doctor)
+        self.assertCountEqual(moved.values_list("id", flat=True), ids)
+        self.assertGreater(IdSequence.objects.get().next_id, max(ids))
+        # the doctor's daily stats follow
+        self.assertFalse(DoctorDailyStats.objects.using("default").filter(doctor=doctor).exists())
+        stats = DoctorDailyStats.objects.using(shard_for(doctor.id)).filter(doctor=doctor)
+        self.assertEqual(sum(sum(row) for row in stats.values_list(*OUTCOMES)), len(ids))
+
+
+# ------------------------
+# Daily stats
+# ------------------------
+@override_settings(CLINIC_OPEN_HOUR=9, CLINIC_CLOSE_HOUR=17, SLOT_MINUTES=30,
+                   PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class DailyStatsTests(TestCase):
+
+    def stored(self, doctor):
+        return DoctorDailyStats.objects.filter(doctor=doctor).aggregate(**{name: Sum(name) for name in OUTCOMES})
+
+    def by_day(self):
+        return sorted(DoctorDailyStats.objects.values_list("doctor_id", "day", *OUTCOMES))
+
+    def test_counts_follow_every_status_change(self):
+        doctor = make_doctor("doctor")
+        patients = [make_patient(f"patient{i}") for i in range(4)]
+        start = timezone.localtime().replace(hour=10, minute=0, second=0, microsecond=0) + timedelta(days=3)
+        clash, apart = start + timedelta(minutes=10), start + timedelta(hours=2)
+        appts = [Appointment.objects.create(doctor=doctor, patient=patient, reason="Checkup", date=date)
+                 for patient, date in zip(patients, (start, clash, apart))]
+        Appointment.objects.create(doctor=doctor, patient=patients[3], reason="Checkup",
+                                   date=timezone.now() - timedelta(days=2))
+        self.assertEqual(self.stored(doctor), dict.fromkeys(OUTCOMES, 0) | {"pending": 4})
+
+        self.client.force_login(doctor.user)
+        self.client.post(reverse("approve_request", args=[appts[0].id]), {"doctor_message": "ok"})
+        self.client.post(reverse("reject_request", args=[appts[2].id]), {"rejection_message": "Away"})
+        expire_overdue_appointments()
+        self.assertEqual(self.stored(doctor), {"pending": 0, "approved": 1, "rejected": 1, "conflicts": 1, "expired": 1})
+
+        # a move to another day, a second save of the same instance, a delete
+        moved = Appointment.objects.create(doctor=doctor, patient=patients[3], reason="Checkup",
+                                           date=start + timedelta(days=1))
+        moved.date += timedelta(days=1)
+        moved.save()
+        Appointment.objects.get(pk=appts[2].id).delete()
+        counted = self.by_day()
+        self.assertEqual(self.stored(doctor), {"pending": 1, "approved": 1, "rejected": 0, "conflicts": 1, "expired": 1})
+
+        rebuild_daily_stats()
+        self.assertEqual([row for row in self.by_day() if any(row[2:])], [row for row in counted if any(row[2:])])
+
+    def test_report_reads_only_the_rollup(self):
+        admin = User.objects.create_superuser(email="admin@test.local", username="admin", password="pw")
+        doctor = make_doctor("doctor", availability=range(5))
+        today = timezone.localdate()
+        DoctorDailyStats.objects.create(doctor=doctor, day=today - timedelta(days=1),
+                                        pending=2, approved=3, rejected=1, conflicts=1)
+        DoctorDailyStats.objects.create(doctor=doctor, day=today + timedelta(days=1), pending=1)
+        start = today - timedelta(days=6)
+
+        self.client.force_login(admin)
+        # session, user, the rollup, the doctors' names
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse("admin_reports"),
+                                       {"start": start.isoformat(), "end": (today + timedelta(days=1)).isoformat()})
+        [row] = response.context["rows"]
+        # pending on a past day counts as expired
+        self.assertEqual((row["requests"], row["pending"], row["expired"]), (8, 1, 2))
+        self.assertEqual(row["approval_rate"], 42.9)
+        working_days = sum(1 for i in range(8) if (start + timedelta(days=i)).weekday() < 5)
+        self.assertEqual(row["capacity"], 16 * working_days)
+        self.assertEqual(response.context["totals"]["causes"][1][1:], (1, 25.0))
+
+
+@override_settings(ADMIN_COUNT_LIMIT=3)
+class DjangoAdminTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(email="admin@test.local", username="admin", password="pw")
+        self.client.force_login(self.admin)
+
+    def test_search_matches_prefixes(self):
+        anna, bob = make_doctor("anna", "Dermatology"), make_doctor("bob")
+        carol = make_patient("carol")
+        appts = {doctor.user.username: make_appointments(doctor, carol, days=2) for doctor in (anna, bob)}
+        url = reverse("admin:core_appointment_changelist")
+
+        def found(term):
+            return {appt.id for appt in self.client.get(url, {"q": term}).context["cl"].result_list}
+
+        self.assertEqual(found("Ann"), {appt.id for appt in appts["anna"]})
+        self.assertEqual(found("anna derm"), {appt.id for appt in appts["anna"]})
+        self.assertEqual(found("carol@"), {appt.id for appts_ in appts.values() for appt in appts_})
+        self.assertEqual(found(str(appts["bob"][0].id)), {appts["bob"][0].id})
+        # prefixes only
+        self.assertEqual(found("nna"), set())
+
+    def test_counts_are_estimated_past_the_limit(self):
+        make_appointments(make_doctor("doctor"), make_patient("patient"), days=2)
+        rows = Appointment.objects.order_by("-date")
+        with mock.patch("core.pagination.estimated_rows", return_value=1000):
+            paginator = EstimatedCountPaginator(rows, 2)
+            self.assertEqual((paginator.count, paginator.count_display), (1000, "about 1000"))
+            # filtered lists are counted, up to the limit
+            paginator = EstimatedCountPaginator(rows.filter(status="PENDING"), 2)
+            self.assertEqual((paginator.count, paginator.count_display), (2, "2"))
+            paginator = EstimatedCountPaginator(rows.filter(date__gt=timezone.now()), 2)
+            self.assertEqual((paginator.count, paginator.count_display), (3, "3"))
+            # and past it are shown as at least the limit
+            paginator = EstimatedCountPaginator(rows.filter(status__in=["PENDING", "APPROVED"]), 2)
+            self.assertEqual((paginator.count, paginator.count_display), (3, "3+"))
+        # small (or never analyzed) tables are counted
+        for estimate in (2, None):
+            with mock.patch("core.pagination.estimated_rows", return_value=estimate):
+                paginator = EstimatedCountPaginator(rows, 2)
+                self.assertEqual((paginator.count, paginator.count_display), (3, "3+"))
+
+    def test_changelist_says_when_counts_are_approximate(self):
+        make_appointments(make_doctor("doctor"), make_patient("patient"), days=2)
+        url = reverse("admin:core_appointment_changelist")
+        with mock.patch("core.pagination.estimated_rows", return_value=1000):
+            self.assertContains(self.client.get(url), "about 1000 appointments")
+        response = self.client.get(url, {"q": "patient@"})
+        self.assertContains(response, "3+ results")
+        self.assertContains(response, "3+ appointments")
+        self.assertContains(response, "only the first 3 can be paged through")
+        response = self.client.get(url, {"status__exact": "PENDING"})
+        self.assertContains(response, "2 appointments")
+        self.assertNotContains(response, "paged through")
+
+    def test_change_form_uses_raw_id_boxes(self):
+        appt = make_appointments(make_doctor("doctor"), make_patient("patient"), days=2)[0]
+        response = self.client.get(reverse("admin:core_appointment_change", args=[appt.id]))
+        self.assertContains(response, "vForeignKeyRawIdAdminField", count=2)
+
+
+# ------------------------
+# Conditional GET
+# ------------------------
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class ConditionalApiTests(TestCase):
+
+    def setUp(self):
+        self.doctor = make_doctor("doctor")
+        self.patient = make_patient("patient")
+        self.appointments = make_appointments(self.doctor, self.patient, days=3)
+        self.client.force_login(self.patient.user)
+
+    def test_unchanged_poll_is_answered_from_the_session_user(self):
+        for name in ("api_dashboard", "api_appointments"):
+            etag = self.client.get(reverse(name))["ETag"]
+            # session and user (with its profile): the appointment table is not read
+            with self.subTest(name=name), self.assertNumQueries(2):
+                response = self.client.get(reverse(name), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+    def test_appointment_writes_change_the_etag(self):
+        url = reverse("api_appointments")
+        for write in (
+            lambda: Appointment.objects.filter(pk=self.appointments[0].pk).update(reason="Follow-up"),
+            lambda: Appointment.objects.create(doctor=self.doctor, patient=self.patient, reason="New",
+                                               date=timezone.now() + timedelta(days=9)),
+            lambda: Appointment.objects.filter(pk=self.appointments[1].pk).delete(),
+        ):
+            etag = self.client.get(url)["ETag"]
+            write()
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_directory_changes_with_doctors(self):
+        url = reverse("api_doctors")
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.doctor.specialization = "Dermatology"
+        self.doctor.save(update_fields=["specialization"])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+# ------------------------
+# Event stream
+# ------------------------
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class EventStreamTests(TestCase):
+
+    def setUp(self):
+        self.doctor = make_doctor("doctor")
+        self.patient = make_patient("patient")
+
+    async def open_stream(self, user):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(user)
+        response = await client.get(reverse("appointment_events"))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = aiter(response.streaming_content)
+        self.assertTrue((await anext(stream)).startswith(b"retry:"))
+        return stream
+
+    async def test_doctor_hears_new_requests_and_patient_hears_decisions(self):
+        doctor_stream = await self.open_stream(self.doctor.user)
+        patient_stream = await self.open_stream(self.patient.user)
+
+        def request_and_approve():
+            with self.captureOnCommitCallbacks(execute=True):
+                appt = Appointment.objects.create(doctor=self.doctor, patient=self.patient, reason="Checkup",
+                                                  date=timezone.now() + timedelta(days=3))
+            with self.captureOnCommitCallbacks(execute=True):
+                Appointment.objects.filter(pk=appt.pk).update(status="APPROVED")
+            return appt
+
+        appt = await sync_to_async(request_and_approve)()
+        for stream, events in ((doctor_stream, [b"created", b"updated"]), (patient_stream, [b"created", b"updated"])):
+            for event in events:
+                chunk = await anext(stream)
+                self.assertTrue(chunk.startswith(b"event: " + event), chunk)
+                self.assertIn(f'"id": {appt.id}'.encode(), chunk)
+            await stream.aclose()
+
+    def test_rolled_back_writes_are_not_published(self):
+        appt = Appointment.objects.create(doctor=self.doctor, patient=self.patient, reason="Checkup",
+                                          date=timezone.now() + timedelta(days=3))
+        with mock.patch("core.events.broker.publish") as publish, self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError), transaction.atomic():
+                approve_appointment(appt)
+                appt.delete()
+                raise ValueError
+        publish.assert_not_called()
+
+    async def test_profile_less_users_are_refused(self):
+        client = AsyncClient()
+        admin = await sync_to_async(User.objects.create_superuser)(email="admin@test.local", username="admin",
+                                                                  password="pw")
+        await sync_to_async(client.force_login)(admin)
+        self.assertEqual((await client.get(reverse("appointment_events"))).status_code, 403)
+
+
+def load_tests(loader, tests, pattern):
+    if len(settings.APPOINTMENT_SHARDS) == 1:
+        return tests
+    suite = TestSuite()
+    for case in (ShardingTests, ShardedDatabaseTests):
+        suite.addTests(loader.loadTestsFromTestCase(case))
+    return suite
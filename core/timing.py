@@ -0,0 +1,190 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger("core.timing")
+
+# the RequestTiming of the request being served, for the template hook
+current_timing = ContextVar("request_timing", default=None)
+
+ROUTES_KEY = "request-timing:routes"
+STATS_PREFIX = "request-timing:route:"
+
+_IN_LIST = re.compile(r"\(\s*%s(?:\s*,\s*%s)*\s*\)")
+_NUMBER = re.compile(r"\b\d+\b")
+
+
+def sql_shape(sql):
+    """The statement with IN lists and inline numbers collapsed, so repeats of one query compare equal."""
+    return _NUMBER.sub("N", _IN_LIST.sub("(...)", sql))
+
+
+class RequestTiming:
+    """
+    What one request spent on SQL and templates. An instance is installed
+    as a connection execute_wrapper and sees every statement the request runs.
+    """
+
+    def __init__(self):
+        self.queries = []  # (sql, ms)
+        self.template_ms = 0.0
+        self.template_depth = 0
+        self.total_ms = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, (time.perf_counter() - start) * 1000))
+
+    @property
+    def db_ms(self):
+        return sum(ms for _, ms in self.queries)
+
+    def slowest(self):
+        return max(self.queries, key=lambda q: q[1], default=(None, 0.0))
+
+    def repeated(self, threshold):
+        """[(shape, count)] of statements run more than `threshold` times: likely N+1 loops."""
+        counts = Counter(sql_shape(sql) for sql, _ in self.queries)
+        return [(shape, n) for shape, n in counts.most_common() if n > threshold]
+
+    def server_timing(self, repeated):
+        parts = [
+            f'db;dur={self.db_ms:.1f};desc="{len(self.queries)} queries"',
+            f"tpl;dur={self.template_ms:.1f}",
+            f"total;dur={self.total_ms:.1f}",
+        ]
+        if repeated:
+            parts.append(f'nplusone;desc="{len(repeated)} repeated queries"')
+        return ", ".join(parts)
+
+    def finish(self, request, response):
+        """Add the Server-Timing header, log the request and fold it into the route stats."""
+        match = request.resolver_match
+        repeated = self.repeated(settings.REQUEST_TIMING_REPEAT_THRESHOLD)
+        slowest_sql, slowest_ms = self.slowest()
+        record = {
+            "view": match.view_name if match else None,
+            "route": match.route if match else None,
+            "method": request.method,
+            "status": response.status_code,
+            "total_ms": round(self.total_ms, 2),
+            "db_ms": round(self.db_ms, 2),
+            "queries": len(self.queries),
+            "template_ms": round(self.template_ms, 2),
+            "slowest_ms": round(slowest_ms, 2),
+            "slowest_sql": slowest_sql,
+            "repeated": [{"sql": shape, "count": n} for shape, n in repeated],
+        }
+
+        response["Server-Timing"] = self.server_timing(repeated)
+        logger.log(logging.WARNING if repeated else logging.INFO, json.dumps(record))
+        if match:
+            record_route(record)
+
+
+def time_templates():
+    """Wrap Django template rendering so the current request's template time is measured."""
+    from django.template.backends.django import Template
+
+    if getattr(Template.render, "timed", False):
+        return
+    render = Template.render
+
+    @wraps(render)
+    def timed_render(self, context=None, request=None):
+        timing = current_timing.get()
+        if timing is None:
+            return render(self, context, request)
+        # render_to_string from inside a template is counted once
+        timing.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            timing.template_depth -= 1
+            if not timing.template_depth:
+                timing.template_ms += (time.perf_counter() - start) * 1000
+
+    timed_render.timed = True
+    Template.render = timed_render
+
+
+# ------------------------
+# Per-route statistics
+# ------------------------
+def record_route(record):
+    """
+    Fold one request into the stats of its view. The stats live in the
+    cache so every worker adds to them when the cache is shared; updates
+    are read-modify-write, so concurrent requests may occasionally drop one.
+    """
+    key = STATS_PREFIX + record["view"]
+    stats = cache.get(key) or {
+        "route": record["route"], "requests": 0, "total_ms": 0.0, "db_ms": 0.0,
+        "template_ms": 0.0, "queries": 0, "max_queries": 0, "nplusone": 0,
+        "slowest_ms": 0.0, "slowest_sql": None, "samples": [],
+    }
+    stats["requests"] += 1
+    stats["total_ms"] += record["total_ms"]
+    stats["db_ms"] += record["db_ms"]
+    stats["template_ms"] += record["template_ms"]
+    stats["queries"] += record["queries"]
+    stats["max_queries"] = max(stats["max_queries"], record["queries"])
+    stats["nplusone"] += bool(record["repeated"])
+    if record["slowest_ms"] > stats["slowest_ms"]:
+        stats["slowest_ms"] = record["slowest_ms"]
+        stats["slowest_sql"] = record["slowest_sql"]
+    # recent durations, for percentiles
+    stats["samples"] = (stats["samples"] + [record["total_ms"]])[-settings.REQUEST_TIMING_SAMPLES:]
+    cache.set(key, stats, None)
+
+    routes = cache.get(ROUTES_KEY) or []
+    if record["view"] not in routes:
+        cache.set(ROUTES_KEY, routes + [record["view"]], None)
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+def route_stats():
+    """{view name: summary} of every route seen since the last reset."""
+    views = cache.get(ROUTES_KEY) or []
+    found = cache.get_many([STATS_PREFIX + view for view in views])
+    summary = {}
+    for view in views:
+        stats = found.get(STATS_PREFIX + view)
+        if not stats:
+            continue
+        n = stats["requests"]
+        summary[view] = {
+            "route": stats["route"],
+            "requests": n,
+            "avg_ms": round(stats["total_ms"] / n, 2),
+            "p50_ms": _percentile(stats["samples"], 50),
+            "p95_ms": _percentile(stats["samples"], 95),
+            "avg_db_ms": round(stats["db_ms"] / n, 2),
+            "avg_template_ms": round(stats["template_ms"] / n, 2),
+            "avg_queries": round(stats["queries"] / n, 1),
+            "max_queries": stats["max_queries"],
+            "nplusone_requests": stats["nplusone"],
+            "slowest_ms": stats["slowest_ms"],
+            "slowest_sql": stats["slowest_sql"],
+        }
+    return summary
+
+
+def reset_route_stats():
+    views = cache.get(ROUTES_KEY) or []
+    cache.delete_many([STATS_PREFIX + view for view in views] + [ROUTES_KEY])
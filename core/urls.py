@@ -1,5 +1,10 @@
+from django.conf import settings
 from django.urls import path
 from . import views
+from .views import async_views
+
+# ASGI mode serves the read-only pages with their async versions
+read = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
     path('', views.home, name='home'),
@@ -10,26 +15,30 @@ urlpatterns = [
     path('logout/', views.logout_view, name='logout'),
     path('post-login/', views.post_login, name='post_login'),
      # Dashboards
-    path('patient/dashboard/', views.patient_dashboard, name='patient_dashboard'),
+    path('patient/dashboard/', read.patient_dashboard, name='patient_dashboard'),
     path('doctor/register/', views.doctor_register, name='doctor_register'),
-    path('doctor/dashboard/', views.doctor_dashboard, name='doctor_dashboard'),
+    path('doctor/dashboard/', read.doctor_dashboard, name='doctor_dashboard'),
     # Patient features
-    path('patient/make-appointment/', views.make_appointment, name='make_appointment'),
-    path('patient/doctor/<int:doctor_id>/', views.doctor_detail, name='doctor_detail'),
+    path('patient/make-appointment/', read.make_appointment, name='make_appointment'),
+    path('patient/doctors/autocomplete/', views.doctor_autocomplete, name='doctor_autocomplete'),
+    path('patient/doctor/<int:doctor_id>/', read.doctor_detail, name='doctor_detail'),
+    path('patient/doctor/<int:doctor_id>/slots/', views.doctor_free_slots, name='doctor_free_slots'),
+    path('patient/slots/', views.free_slots_search, name='free_slots_search'),
      path("doctor/<int:doctor_id>/request/", views.request_appointment, name="request_appointment"),
     path('patient/request/<int:doctor_id>/', views.request_appointment, name='request_appointment'),
-    path('patient/history/', views.patient_history, name='patient_history'),
-    path("patient/history/<str:status>/", views.patient_history_status, name="patient_history_status"),
+    path('patient/history/', read.patient_history, name='patient_history'),
+    path("patient/history/<str:status>/", read.patient_history_status, name="patient_history_status"),
     path("patient/appointment/edit/<int:appointment_id>/", views.edit_appointment, name="edit_appointment"),
     # Patient profile
     path('patient/profile/', views.patient_profile, name='patient_profile'),
     path('patient/profile/edit/', views.patient_profile_edit, name='patient_profile_edit'),
     # Doctor features
     path('doctor/requests/', views.doctor_requests, name='doctor_requests'),
+    path('doctor/requests/batch/', views.batch_update_requests, name='batch_update_requests'),
     path('doctor/requests/<int:appt_id>/approve/', views.approve_request, name='approve_request'),
     path('doctor/requests/<int:appt_id>/reject/', views.reject_request, name='reject_request'),
-    path('doctor/history/', views.doctor_history, name='doctor_history'),
-    path('doctor/history/<str:status>/', views.doctor_history_status, name='doctor_history_status'),
+    path('doctor/history/', read.doctor_history, name='doctor_history'),
+    path('doctor/history/<str:status>/', read.doctor_history_status, name='doctor_history_status'),
     # Doctor profile
     path('doctor/profile/', views.doctor_profile, name='doctor_profile'),
     path('doctor/profile/edit/', views.doctor_profile_edit, name='doctor_profile_edit'),
@@ -37,6 +46,17 @@ urlpatterns = [
     # Admin Routes
     path('admin-login/', views.admin_login, name='admin_login'),
     path('admin-dashboard/', views.admin_dashboard, name='admin_dashboard'),
+    path('admin-import/', views.admin_import, name='admin_import'),
+    path('admin-dashboard/batch/', views.batch_update_doctors, name='batch_update_doctors'),
+    path('admin-reports/', views.admin_reports, name='admin_reports'),
+    # Exports
+    path('export/appointments/', views.export_appointments, name='export_appointments'),
+    # JSON API (conditional GET)
+    path('api/dashboard/', views.api_dashboard, name='api_dashboard'),
+    path('api/appointments/', views.api_appointments, name='api_appointments'),
+    path('api/doctors/', views.api_doctors, name='api_doctors'),
+    # Server-sent events (ASGI)
+    path('events/appointments/', views.appointment_events, name='appointment_events'),
     path('doctor/<int:doctor_id>/<str:action>/', views.update_doctor_status, name='update_doctor_status')
 
 ]
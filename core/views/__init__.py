@@ -2,3 +2,6 @@ from .common_views import *
 from .patient_views import *
 from .doctor_views import *
 from .admin_views import *
+from .export_views import *
+from .api_views import *
+from .event_views import *
@@ -5,41 +5,210 @@ from core.models import User
 
 from django.contrib import messages
 from django.contrib.auth import authenticate, login
-from core.models import User,InactiveDoctor,DoctorProfile
+from core.models import User,InactiveDoctor,DoctorProfile, normalize_search
+from core.importer import import_accounts, IMPORT_COLUMNS
+from core.search import FACETS_KEY
+from core.sharding import mirror_users
+from core.stats import doctor_report
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import DatabaseError, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.http import require_POST
+import codecs
+import csv
+from datetime import date, timedelta
 
 
 def is_admin(user):
     return user.is_superuser
 
+
+def approve_registrations(ids):
+    """
+    Turn the InactiveDoctor rows `ids` into doctors in one transaction:
+    one bulk_create for the users, one for the profiles, one delete.
+    Registrations whose email has been taken meanwhile, in any letter case
+    (like the importer compares them), are left pending, and so are all but
+    the first of several with one address. Returns (approved, skipped).
+    """
+    with transaction.atomic():
+        pending = list(InactiveDoctor.objects.select_for_update().filter(id__in=ids).order_by("id"))
+        taken = set(
+            User.objects.annotate(email_lower=Lower("email"))
+            .filter(email_lower__in=[d.email.lower() for d in pending]).values_list("email_lower", flat=True)
+        )
+        approve = []
+        for d in pending:
+            if d.email.lower() not in taken:
+                taken.add(d.email.lower())
+                approve.append(d)
+        if not approve:
+            return 0, len(pending)
+
+        # the password here is already hashed
+        User.objects.bulk_create([
+            User(email=d.email, role="DOCTOR", username=d.username, password=d.password)
+            for d in approve
+        ])
+        user_ids = dict(User.objects.filter(email__in=[d.email for d in approve]).values_list("email", "id"))
+        DoctorProfile.objects.bulk_create([
+            DoctorProfile(
+                user_id=user_ids[d.email],
+                specialization=d.specialization,
+                availability_mask=d.availability_mask,
+                search_text=normalize_search(f"{d.username} {d.specialization}"),
+            )
+            for d in approve
+        ])
+        InactiveDoctor.objects.filter(id__in=[d.id for d in approve]).delete()
+        mirror_users(user_ids.values())
+
+    # bulk_create sends no post_save
+    cache.delete(FACETS_KEY)
+    return len(approve), len(pending) - len(approve)
+
+
+def reject_registrations(ids):
+    deleted, _ = InactiveDoctor.objects.filter(id__in=ids).delete()
+    return deleted
+
+
 @login_required
 @user_passes_test(is_admin)
 def admin_dashboard(request):
-    pending_doctors = InactiveDoctor.objects.all()
-    return render(request, "auth/admin_dashboard.html", {"pending_doctors": pending_doctors})
+    q = request.GET.get('q', '').strip()
+    pending_doctors = InactiveDoctor.objects.order_by('id')
+    if q:
+        pending_doctors = pending_doctors.filter(
+            Q(username__icontains=q) | Q(email__icontains=q) | Q(specialization__icontains=q)
+        )
+
+    page = Paginator(pending_doctors, settings.PENDING_DOCTORS_PAGE_SIZE).get_page(request.GET.get('page'))
+    query = request.GET.copy()
+    query.pop('page', None)
+
+    return render(request, "auth/admin_dashboard.html", {
+        "pending_doctors": page,
+        "q": q,
+        "page_query": query.urlencode(),
+    })
+
+
+@login_required
+@user_passes_test(is_admin)
+@require_POST
+def batch_update_doctors(request):
+    """Approve or reject every registration ticked on the dashboard, in one request."""
+    ids = [int(i) for i in request.POST.getlist('ids') if i.isdigit()]
+    action = request.POST.get('action')
+
+    if not ids:
+        messages.error(request, "Select at least one doctor.")
+    elif action == "approve":
+        approved, skipped = approve_registrations(ids)
+        messages.success(request, f"{approved} doctor(s) approved.")
+        if skipped:
+            messages.error(request, f"{skipped} registration(s) use an email that is already registered.")
+    elif action == "reject":
+        messages.info(request, f"{reject_registrations(ids)} registration(s) rejected.")
+    else:
+        messages.error(request, "Unknown action.")
+
+    # back to the same search and page
+    return redirect(f"{reverse('admin_dashboard')}?{request.POST.get('page_query', '')}")
 
 
 @login_required
 @user_passes_test(is_admin)
 def update_doctor_status(request, doctor_id, action):
     
-    doctor = get_object_or_404(InactiveDoctor, id=doctor_id)
+    get_object_or_404(InactiveDoctor, id=doctor_id)
 
     if action == "approve":
+        approved, _ = approve_registrations([doctor_id])
+        if not approved:
+            messages.error(request, "This email is already registered.")
+    else:
+        reject_registrations([doctor_id])
+    
+    return redirect('admin_dashboard') 
+
+
+@login_required
+@user_passes_test(is_admin)
+def admin_import(request):
+    """Upload a CSV of doctors and patients (see core.importer)."""
+    result = None
+    if request.method == "POST":
+        upload = request.FILES.get("file")
+        if not upload:
+            messages.error(request, "Choose a CSV file to import.")
+            return redirect("admin_import")
 
-        user = User(
-            email=doctor.email,
-            role="DOCTOR",
-            username=doctor.username
+        try:
+            # no process pool inside a web request; big files go through manage.py import_accounts
+            result = import_accounts(codecs.iterdecode(upload, "utf-8-sig"), workers=0)
+        except UnicodeDecodeError:
+            messages.error(request, "The file is not UTF-8 text; save it as CSV (UTF-8) and upload it again.")
+            return redirect("admin_import")
+        except (csv.Error, DatabaseError) as e:
+            messages.error(
+                request,
+                f"Import stopped: {e}. Upload the file again to continue; rows already imported are skipped.",
+            )
+            return redirect("admin_import")
+        messages.success(
+            request,
+            f"{result.created['DOCTOR']} doctors and {result.created['PATIENT']} patients created, "
+            f"{result.skipped} already registered."
         )
-        # doctor.password here is already hashed
-        user.password = doctor.password  
-        user.save()
+        if result.errors:
+            messages.error(request, f"{len(result.errors)} rows could not be imported.")
 
-        DoctorProfile.objects.create(user=user,specialization=doctor.specialization,availability=doctor.availability)
-    
-    doctor.delete()
-    
-    return redirect('admin_dashboard') 
+    return render(request, "auth/admin_import.html", {
+        "result": result,
+        "errors": result.errors[:200] if result else [],
+        "columns": IMPORT_COLUMNS,
+    })
+
+
+@login_required
+@user_passes_test(is_admin)
+def admin_reports(request):
+    """
+    Utilization, approval rate and rejection causes per doctor over
+    ?start= to ?end= (the last REPORT_DAYS days by default), read from the
+    daily stats rollup only.
+    """
+    today = timezone.localdate()
+    try:
+        end = date.fromisoformat(request.GET.get('end', ''))
+    except ValueError:
+        end = today
+    try:
+        start = date.fromisoformat(request.GET.get('start', ''))
+    except ValueError:
+        start = end - timedelta(days=settings.REPORT_DAYS - 1)
+    if start > end:
+        start, end = end, start
+
+    rows, totals = doctor_report(start, end, today)
+    page = Paginator(rows, settings.REPORT_DOCTORS_PAGE_SIZE).get_page(request.GET.get('page'))
+    query = request.GET.copy()
+    query.pop('page', None)
+
+    return render(request, "auth/admin_reports.html", {
+        "rows": page,
+        "totals": totals,
+        "start": start,
+        "end": end,
+        "page_query": query.urlencode(),
+    })
 
 
 def admin_login(request):
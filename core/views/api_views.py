@@ -0,0 +1,147 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import Count, Max
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from core.counters import dashboard_summary
+from core.decorator import login_required
+from core.archive import wants_archive
+from core.models import Appointment, ArchivedAppointment, DoctorProfile
+from core.pagination import keyset_paginate, encode_cursor
+from core.sharding import doctor_db
+from core.views.export_views import export_row
+from core.views.patient_views import doctor_directory
+
+
+# ------------------------
+# Validators
+# ------------------------
+# Every response carries an ETag and a Last-Modified built from change
+# markers that are read without touching the appointment table: the
+# appointments_changed_at column of the caller's profile (already loaded with
+# the session user) and, for the directory, the newest DoctorProfile.updated_at.
+# An unchanged poll with If-None-Match / If-Modified-Since gets a 304.
+#
+# Pending requests turn into rejected ones when their time passes, without
+# any write. Appointment responses therefore also change at the start of each
+# API_TIME_WINDOW seconds, so a 304 is never served for longer than that
+# after an expiry.
+
+def _window_start():
+    window = settings.API_TIME_WINDOW
+    now = timezone.now().timestamp()
+    return datetime.fromtimestamp(now - now % window, dt_timezone.utc)
+
+
+def appointments_modified(request, *args, **kwargs):
+    if not request.profile:
+        return None
+    return max(request.profile.appointments_changed_at, _window_start())
+
+
+def appointments_etag(request, *args, **kwargs):
+    modified = appointments_modified(request)
+    if modified is None:
+        return None
+    return f"{request.user.role}-{request.profile.pk}-{modified.timestamp()}"
+
+
+def _directory_marker(request):
+    # one aggregate over the doctor table, shared by both validators
+    if not hasattr(request, "directory_marker"):
+        request.directory_marker = DoctorProfile.objects.aggregate(doctors=Count("id"), modified=Max("updated_at"))
+    return request.directory_marker
+
+
+def directory_modified(request, *args, **kwargs):
+    return _directory_marker(request)["modified"]
+
+
+def directory_etag(request, *args, **kwargs):
+    marker = _directory_marker(request)
+    modified = marker["modified"].timestamp() if marker["modified"] else 0
+    return f"doctors-{marker['doctors']}-{modified}"
+
+
+def _no_profile():
+    return JsonResponse({"error": "Only doctors and patients have appointments."}, status=403)
+
+
+# ------------------------
+# Endpoints
+# ------------------------
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=appointments_etag, last_modified_func=appointments_modified)
+def api_dashboard(request):
+    """Status counts and the next approved appointment of the logged-in doctor or patient."""
+    if not request.profile:
+        return _no_profile()
+
+    summary = dashboard_summary(request.user.role.lower(), request.profile.id)
+    return JsonResponse({
+        "counts": {
+            "pending": summary["PENDING"],
+            "approved": summary["APPROVED"],
+            "rejected": summary["REJECTED"],
+        },
+        "upcoming": export_row(summary["upcoming"]) if summary["upcoming"] else None,
+    })
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=appointments_etag, last_modified_func=appointments_modified)
+def api_appointments(request):
+    """
+    One page of the caller's appointment history, newest first.
+    ?status=pending|approved|rejected narrows it; ?after=<next> pages on;
+    ?archived=1 includes the archived appointments.
+    """
+    if not request.profile:
+        return _no_profile()
+
+    status = request.GET.get("status", "").upper()
+    if status and status not in ("PENDING", "APPROVED", "REJECTED"):
+        return JsonResponse({"error": "status must be pending, approved or rejected."}, status=400)
+
+    def scoped(model):
+        appointments = model.objects.filter(**{request.user.role.lower(): request.profile})
+        if request.user.role == "DOCTOR":
+            appointments = appointments.using(doctor_db(request.profile.id))
+        appointments = appointments.select_related("doctor__user", "patient__user")
+        return appointments.with_status(status) if status else appointments
+
+    archive = scoped(ArchivedAppointment) if wants_archive(request) else None
+    page = keyset_paginate(request, scoped(Appointment), archive=archive)
+    return JsonResponse({
+        "results": [export_row(appt) for appt in page],
+        "next": encode_cursor(page.object_list[-1]) if page.has_next else None,
+    })
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=directory_etag, last_modified_func=directory_modified)
+def api_doctors(request):
+    """The doctor directory: ?q=, ?specialization=, ?day=<weekday number>, ?page=."""
+    doctors, _ = doctor_directory(request)
+    page = Paginator(doctors, settings.DOCTORS_PAGE_SIZE).get_page(request.GET.get("page"))
+    return JsonResponse({
+        "results": [
+            {
+                "id": doctor.id,
+                "name": doctor.user.username,
+                "specialization": doctor.specialization,
+                "availability": doctor.availability_days(),
+            }
+            for doctor in page
+        ],
+        "page": page.number,
+        "pages": page.paginator.num_pages,
+    })
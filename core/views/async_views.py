@@ -0,0 +1,151 @@
+"""
+Async versions of the read-only pages, served instead of the sync ones in
+ASGI mode (settings.ASYNC_VIEWS, on by default in medibook/asgi.py).
+
+Every query runs through the async ORM and is finished before rendering,
+so the templates only read what is already loaded. A request waiting on
+the database holds no worker thread, only a coroutine; the writes stay in
+the sync views, with their transactions and row locks.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.shortcuts import render, aget_object_or_404
+from django.utils import timezone
+
+from core.archive import wants_archive
+from core.counters import adashboard_summary
+from core.decorator import login_required
+from core.routers import read_replica
+from core.models import DoctorProfile, Appointment, ArchivedAppointment
+from core.pagination import akeyset_paginate
+from core.search import specialization_facets
+from core.sharding import doctor_db
+from core.views.doctor_views import doctor_appointments_with_status
+from core.views.patient_views import (
+    doctor_directory, make_appointment_context, patient_appointments_with_status, india_tz,
+)
+
+
+# ---------- Doctor Side ----------
+@read_replica
+@login_required(role='DOCTOR')
+async def doctor_dashboard(request):
+    summary = await adashboard_summary('doctor', request.profile.id)
+
+    return render(request, 'doctor/dashboard.html', {
+        'pending': summary['PENDING'],
+        'approved': summary['APPROVED'],
+        'rejected': summary['REJECTED'],
+        'upcoming': summary['upcoming'],
+    })
+
+
+@read_replica
+@login_required(role='DOCTOR')
+async def doctor_history(request):
+    appointments = Appointment.objects.using(doctor_db(request.profile.id)).filter(
+        doctor=request.profile
+    ).select_related('patient__user')
+
+    # each tab pages on its own cursor
+    return render(request, 'doctor/history.html', {
+        'pending': await akeyset_paginate(request, appointments.pending(), param='pending_after', tab='pending'),
+        'approved': await akeyset_paginate(request, appointments.approved(), param='approved_after', tab='approved'),
+        'rejected': await akeyset_paginate(request, appointments.rejected(), param='rejected_after', tab='rejected'),
+        'active_tab': request.GET.get('tab', 'pending'),
+    })
+
+
+@read_replica
+@login_required(role='DOCTOR')
+async def doctor_history_status(request, status=None):
+    status_lower = status.lower() if status else None
+    appointments, title = doctor_appointments_with_status(request.profile, status_lower)
+    archive = None
+    if wants_archive(request):
+        archive, _ = doctor_appointments_with_status(request.profile, status_lower, ArchivedAppointment)
+
+    return render(request, 'doctor/history_status.html', {
+        'appointments': await akeyset_paginate(request, appointments, archive=archive),
+        'title': title,
+        'status_filter': status_lower,
+        'archived': archive is not None,
+    })
+
+
+# ---------- Patient Side ----------
+@read_replica
+@login_required(role='PATIENT')
+async def patient_dashboard(request):
+    by_status = await adashboard_summary('patient', request.profile.id)
+    return render(request, 'patient/dashboard.html', {'by_status': by_status, "upcoming": by_status['upcoming']})
+
+
+@read_replica
+@login_required(role='PATIENT')
+async def patient_history(request):
+    patient = request.profile
+    appointments = Appointment.objects.filter(patient=patient).select_related('doctor__user')
+
+    # each tab pages on its own cursor
+    return render(request, 'patient/history.html', {
+        'approved': await akeyset_paginate(request, appointments.approved(), param='approved_after', tab='approved'),
+        'rejected': await akeyset_paginate(request, appointments.rejected(), param='rejected_after', tab='rejected'),
+        'pending': await akeyset_paginate(request, appointments.pending(), param='pending_after', tab='pending'),
+        'counts': await adashboard_summary('patient', patient.id),
+        'active_tab': request.GET.get('tab', 'approved'),
+    })
+
+
+@read_replica
+@login_required(role='PATIENT')
+async def patient_history_status(request, status):
+    status_upper = status.upper()
+    if status_upper not in ["PENDING", "APPROVED", "REJECTED"]:
+        status_upper = "PENDING"
+
+    appointments, archive = patient_appointments_with_status(request, status_upper)
+
+    return render(request, "patient/patient_history_status.html", {
+        "appointments": await akeyset_paginate(request, appointments, archive=archive),
+        "status": status_upper,
+        "archived": archive is not None,
+    })
+
+
+@read_replica
+@login_required(role='PATIENT')
+async def make_appointment(request):
+    doctors, filters = doctor_directory(request)
+
+    paginator = Paginator(doctors, settings.DOCTORS_PAGE_SIZE)
+    # Paginator counts and slices synchronously: count first, then load the page
+    paginator.count = await doctors.acount()
+    page = paginator.get_page(request.GET.get('page'))
+    page.object_list = [doctor async for doctor in page.object_list]
+
+    specializations = await sync_to_async(specialization_facets)()
+    return render(request, 'patient/make_appointment.html',
+                  make_appointment_context(request, filters, page, specializations))
+
+
+@read_replica
+@login_required(role='PATIENT')
+async def doctor_detail(request, doctor_id):
+    doctor = await aget_object_or_404(DoctorProfile.objects.select_related('user'), pk=doctor_id)
+
+    approved_appointments = [
+        appt async for appt in Appointment.objects.using(doctor_db(doctor.id)).filter(
+            doctor=doctor, status='APPROVED'
+        ).select_related('patient__user').order_by('-date')
+    ]
+
+    now = timezone.now().astimezone(india_tz)
+
+    return render(request, 'patient/doctor_detail.html', {
+        'doctor': doctor,
+        "now": now.strftime("%Y-%m-%dT%H:%M"),
+        'approved_appointments': approved_appointments,
+        "available_days": doctor.availability_days()
+    })
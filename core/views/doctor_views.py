@@ -2,11 +2,21 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth import authenticate, login
 from core.decorator import login_required
+from core.routers import read_replica
 from django.utils import timezone
-from core.models import User,DoctorProfile, Appointment,InactiveDoctor
-from .common_views import update_outdated_appointments
+from core.models import User,DoctorProfile, PatientProfile, Appointment,InactiveDoctor, ArchivedAppointment, CONFLICT_MESSAGE, CONFLICT_WINDOW
+from core.archive import wants_archive
+from core.counters import dashboard_summary
+from core.pagination import keyset_paginate
+from core.sharding import across_shards, doctor_db
+import heapq
+from bisect import bisect_left, insort
 from datetime import timedelta
+from functools import reduce
+from operator import itemgetter, or_
+from django.db import transaction
 from django.db.models import Q
+from django.views.decorators.http import require_POST
 
 
 
@@ -56,89 +66,227 @@ def doctor_login(request):
 
 
 # ---------- Doctor Side ----------
-@login_required
+@read_replica
+@login_required(role='DOCTOR')
 def doctor_dashboard(request):
-    if request.user.role != 'DOCTOR':
-        return redirect('patient_dashboard')
-    
-    doc = DoctorProfile.objects.get(user=request.user)
+    doc = request.profile
 
-    update_outdated_appointments()
-    pending = Appointment.objects.filter(doctor=doc, status='PENDING').count()
-    approved = Appointment.objects.filter(doctor=doc, status='APPROVED').count()
-    rejected = Appointment.objects.filter(doctor=doc, status='REJECTED').count()
-    
-    upcoming = Appointment.objects.filter(doctor=doc, status='APPROVED', date__gte=timezone.now()).order_by('date').first()
+    summary = dashboard_summary('doctor', doc.id)
 
     return render(request, 'doctor/dashboard.html', {
-        'pending': pending,
-        'approved': approved,
-        'rejected': rejected,
-        'upcoming': upcoming,
+        'pending': summary['PENDING'],
+        'approved': summary['APPROVED'],
+        'rejected': summary['REJECTED'],
+        'upcoming': summary['upcoming'],
     })
 
 
-@login_required
+@login_required(role='DOCTOR')
 def doctor_requests(request):
-    if request.user.role != 'DOCTOR':
-        return redirect('patient_dashboard')
-    
-    doc = DoctorProfile.objects.get(user=request.user)
+    doc = request.profile
 
-    update_outdated_appointments()
 
-    pending = Appointment.objects.filter(doctor=doc, status='PENDING').select_related('patient__user').order_by('-date')
+    pending = Appointment.objects.using(doctor_db(doc.id)).filter(doctor=doc).pending().select_related('patient__user').order_by('-date')
     return render(request, 'doctor/requests.html', {'pending': pending})
 
 
 
 def reject_conflicting_appointments(approved_appt):
-    pending_appointments = Appointment.objects.filter(
+    """
+    Reject every PENDING request overlapping `approved_appt` in one UPDATE
+    (one per shard: the patient's requests to other doctors); returns how many.
+    """
+    overlapping = Appointment.objects.filter(
         status="PENDING",
-        date__gte=approved_appt.date - timedelta(minutes=30),
-        date__lte=approved_appt.date + timedelta(minutes=30),
+        date__gte=approved_appt.date - CONFLICT_WINDOW,
+        date__lte=approved_appt.date + CONFLICT_WINDOW,
     ).filter(
         Q(doctor_id=approved_appt.doctor_id) | Q(patient_id=approved_appt.patient_id)
+    ).exclude(pk=approved_appt.pk)
+    return sum(
+        shard.update(status="REJECTED", rejection_message=CONFLICT_MESSAGE)
+        for shard in across_shards(overlapping)
     )
 
-    for pending in pending_appointments:
-        pending.status = "REJECTED"
-        pending.rejection_message = (
-            "Rejected due to conflict with another approved appointment."
+
+def approve_appointment(appt, message=""):
+    """
+    Approve `appt` and reject the requests it conflicts with, atomically.
+
+    Returns (status, rejected_count): status is "APPROVED", "CONFLICT" when an
+    overlapping appointment was approved first (appt is then rejected), or
+    None when appt is no longer pending.
+    """
+    db = doctor_db(appt.doctor_id)
+    appointments = Appointment.objects.using(db)
+    with transaction.atomic(using=db):
+        # Lock the doctor and the patient first, always in that order, so two
+        # approvals touching either of them run one after the other
+        # (PostgreSQL/MySQL; SQLite already serializes write transactions).
+        DoctorProfile.objects.using(db).select_for_update().filter(pk=appt.doctor_id).exists()
+        PatientProfile.objects.using(db).select_for_update().filter(pk=appt.patient_id).exists()
+
+        appt = appointments.select_for_update().pending().filter(pk=appt.pk).first()
+        if appt is None:
+            return None, 0
+
+        clash = Appointment.objects.approved().filter(
+            Q(doctor_id=appt.doctor_id) | Q(patient_id=appt.patient_id),
+            date__range=(appt.date - CONFLICT_WINDOW, appt.date + CONFLICT_WINDOW),
+        ).exclude(pk=appt.pk)
+
+        if any(shard.exists() for shard in across_shards(clash)):
+            appointments.update_loaded([appt],
+                status="REJECTED", rejection_message=CONFLICT_MESSAGE, doctor_message=""
+            )
+            return "CONFLICT", 0
+
+        appointments.update_loaded([appt],
+            status="APPROVED", doctor_message=message, rejection_message=""
+        )
+        return "APPROVED", reject_conflicting_appointments(appt)
+
+
+def _near(dates, date):
+    """True when sorted `dates` has one within CONFLICT_WINDOW of `date`."""
+    i = bisect_left(dates, date - CONFLICT_WINDOW)
+    return i < len(dates) and dates[i] <= date + CONFLICT_WINDOW
+
+
+def approve_appointments(doctor, ids, message=""):
+    """
+    Approve the doctor's pending requests `ids` together, atomically.
+
+    Requests are taken earliest first; one that overlaps an existing
+    approval, or one approved earlier in the same batch, of the doctor or
+    of its patient is rejected as a conflict instead. The other pending
+    requests overlapping the new approvals are then rejected as well,
+    like a single approval does. Every step is one set-based query.
+
+    Returns (approved, conflicts, rejected_count).
+    """
+    db = doctor_db(doctor.pk)
+    appointments = Appointment.objects.using(db)
+    with transaction.atomic(using=db):
+        # same lock order as approve_appointment: doctor, then patients
+        DoctorProfile.objects.using(db).select_for_update().filter(pk=doctor.pk).exists()
+        selected = list(
+            appointments.pending().filter(doctor=doctor, pk__in=ids).order_by('date', 'id')
+        )
+        if not selected:
+            return [], [], 0
+        patient_ids = {a.patient_id for a in selected}
+        list(PatientProfile.objects.using(db).select_for_update().filter(pk__in=patient_ids).order_by('pk').values_list('pk'))
+        selected = list(
+            appointments.select_for_update().pending().filter(pk__in=[a.pk for a in selected]).order_by('date', 'id')
         )
 
-        pending.save()
+        # every approval that could clash with the batch, in one query (per shard)
+        doctor_taken, patient_taken = [], {}
+        existing = Appointment.objects.approved().filter(
+            Q(doctor=doctor) | Q(patient_id__in=patient_ids),
+            date__range=(selected[0].date - CONFLICT_WINDOW, selected[-1].date + CONFLICT_WINDOW),
+        ).order_by('date').values_list('doctor_id', 'patient_id', 'date')
+        for doctor_id, patient_id, date in heapq.merge(*across_shards(existing), key=itemgetter(2)):
+            if doctor_id == doctor.pk:
+                doctor_taken.append(date)
+            if patient_id in patient_ids:
+                patient_taken.setdefault(patient_id, []).append(date)
+
+        approved, conflicts = [], []
+        for appt in selected:
+            taken = patient_taken.setdefault(appt.patient_id, [])
+            if _near(doctor_taken, appt.date) or _near(taken, appt.date):
+                conflicts.append(appt)
+                continue
+            approved.append(appt)
+            insort(doctor_taken, appt.date)
+            insort(taken, appt.date)
+
+        if conflicts:
+            appointments.update_loaded(conflicts,
+                status="REJECTED", rejection_message=CONFLICT_MESSAGE, doctor_message=""
+            )
+        rejected = 0
+        if approved:
+            appointments.update_loaded(approved,
+                status="APPROVED", doctor_message=message, rejection_message=""
+            )
+            overlapping = reduce(or_, (
+                Q(date__gte=a.date - CONFLICT_WINDOW, date__lte=a.date + CONFLICT_WINDOW)
+                & (Q(doctor_id=a.doctor_id) | Q(patient_id=a.patient_id))
+                for a in approved
+            ))
+            rejected = sum(
+                shard.update(status="REJECTED", rejection_message=CONFLICT_MESSAGE)
+                for shard in across_shards(Appointment.objects.filter(overlapping, status="PENDING"))
+            )
+        return approved, conflicts, rejected
+
+
+@login_required(role='DOCTOR')
+@require_POST
+def batch_update_requests(request):
+    """Approve or reject every request ticked on the requests page in one POST."""
+    ids = [int(i) for i in request.POST.getlist('ids') if i.isdigit()]
+    action = request.POST.get('action')
+
+    if not ids:
+        messages.error(request, 'Select at least one request.')
+
+    elif action == 'approve':
+        msg = request.POST.get('doctor_message', '').strip()
+        approved, conflicts, rejected = approve_appointments(request.profile, ids, msg)
+        messages.success(request, f'{len(approved)} appointment(s) approved.')
+        if conflicts:
+            messages.error(request, f'{len(conflicts)} selected request(s) overlapped another approval and were rejected.')
+        if rejected:
+            messages.info(request, f'{rejected} conflicting request(s) were auto-rejected.')
+
+    elif action == 'reject':
+        reason = request.POST.get('rejection_message', '').strip()
+        if not reason:
+            messages.error(request, 'Please provide a rejection reason.')
+        else:
+            count = Appointment.objects.using(doctor_db(request.profile.id)).pending().filter(
+                doctor=request.profile, pk__in=ids,
+            ).update(
+                status='REJECTED', rejection_message=reason, doctor_message='',
+            )
+            messages.info(request, f'{count} appointment(s) rejected.')
+
+    else:
+        messages.error(request, 'Unknown action.')
 
-@login_required
+    return redirect('doctor_requests')
+
+
+@login_required(role='DOCTOR')
 def approve_request(request, appt_id):
-    if request.user.role != 'DOCTOR':
-        return redirect('patient_dashboard')
-    
-    update_outdated_appointments()
 
-    appt = get_object_or_404(Appointment, pk=appt_id, doctor__user=request.user, status='PENDING')
+    appt = get_object_or_404(Appointment.objects.using(doctor_db(request.profile.id)).pending(),
+                             pk=appt_id, doctor=request.profile)
     
     if request.method == 'POST':
         msg = request.POST.get('doctor_message', '').strip()
-        appt.status = 'APPROVED'
-        appt.doctor_message = msg
-        appt.rejection_message = ''
-        
-        appt.save()
-        
-        messages.success(request, 'Appointment approved.')
-        reject_conflicting_appointments(appt)
+        status, rejected = approve_appointment(appt, msg)
+
+        if status == "APPROVED":
+            messages.success(request, 'Appointment approved.')
+            if rejected:
+                messages.info(request, f'{rejected} conflicting request(s) were auto-rejected.')
+        elif status == "CONFLICT":
+            messages.error(request, 'Another appointment was approved for this time, so this request was rejected.')
+        else:
+            messages.error(request, 'This request is no longer pending.')
     
     return redirect('doctor_requests')
 
 
-@login_required
+@login_required(role='DOCTOR')
 def reject_request(request, appt_id):
-    if request.user.role != 'DOCTOR':
-        return redirect('patient_dashboard')
-    
-    update_outdated_appointments()
-    appt = get_object_or_404(Appointment, pk=appt_id, doctor__user=request.user, status='PENDING')
+    appt = get_object_or_404(Appointment.objects.using(doctor_db(request.profile.id)).pending(),
+                             pk=appt_id, doctor=request.profile)
    
     if request.method == 'POST':
         reason = request.POST.get('rejection_message', '').strip()
@@ -157,76 +305,68 @@ def reject_request(request, appt_id):
     return redirect('doctor_requests')
 
 
-@login_required
+@read_replica
+@login_required(role='DOCTOR')
 def doctor_history(request):
-    if request.user.role != 'DOCTOR':
-        return redirect('patient_dashboard')
-    
-    doc = DoctorProfile.objects.get(user=request.user)
+    doc = request.profile
 
-    update_outdated_appointments()
     
-    pending = Appointment.objects.filter(doctor=doc, status='PENDING').select_related('patient__user').order_by('-date')
-    approved = Appointment.objects.filter(doctor=doc, status='APPROVED').select_related('patient__user').order_by('-date')
-    rejected = Appointment.objects.filter(doctor=doc, status='REJECTED').select_related('patient__user').order_by('-date')
+    appointments = Appointment.objects.using(doctor_db(doc.id)).filter(doctor=doc).select_related('patient__user')
+
+    # each tab pages on its own cursor
+    pending = keyset_paginate(request, appointments.pending(), param='pending_after', tab='pending')
+    approved = keyset_paginate(request, appointments.approved(), param='approved_after', tab='approved')
+    rejected = keyset_paginate(request, appointments.rejected(), param='rejected_after', tab='rejected')
     
     return render(request, 'doctor/history.html', {
         'pending': pending,
         'approved': approved,
         'rejected': rejected,
+        'active_tab': request.GET.get('tab', 'pending'),
     })
 
 
-@login_required
-def doctor_history_status(request, status=None):
-    if request.user.role != 'DOCTOR':
-        return redirect('patient_dashboard')
-    
-    doc = DoctorProfile.objects.get(user=request.user)
+def doctor_appointments_with_status(doc, status_lower, model=Appointment):
+    """(appointments, page title) for one tab of the doctor's history; model=ArchivedAppointment for the archive."""
+    appointments = model.objects.using(doctor_db(doc.id)).filter(doctor=doc).select_related('patient__user')
+    if status_lower == 'pending':
+        return appointments.pending(), "Pending Appointments"
+    elif status_lower == 'approved':
+        return appointments.approved(), "Approved Appointments"
+    elif status_lower == 'rejected':
+        return appointments.rejected(), "Rejected Appointments"
+    return appointments, "All Appointments"
 
-    update_outdated_appointments()
+
+@read_replica
+@login_required(role='DOCTOR')
+def doctor_history_status(request, status=None):
+    doc = request.profile
 
     status_lower = status.lower() if status else None
+    appointments, title = doctor_appointments_with_status(doc, status_lower)
+    archive = None
+    if wants_archive(request):
+        archive, _ = doctor_appointments_with_status(doc, status_lower, ArchivedAppointment)
+    appointments = keyset_paginate(request, appointments, archive=archive)
 
-    if status_lower == 'pending':
-        appointments = Appointment.objects.filter(doctor=doc, status='PENDING').select_related('patient__user').order_by('-date')
-        title = "Pending Appointments"
-   
-    elif status_lower == 'approved':
-        appointments = Appointment.objects.filter(doctor=doc, status='APPROVED').select_related('patient__user').order_by('-date')
-        title = "Approved Appointments"
-   
-    elif status_lower == 'rejected':
-        appointments = Appointment.objects.filter(doctor=doc, status='REJECTED').select_related('patient__user').order_by('-date')
-        title = "Rejected Appointments"
-    
-    else:
-        appointments = Appointment.objects.filter(doctor=doc).select_related('patient__user').order_by('-date')
-        title = "All Appointments"
-     
     return render(request, 'doctor/history_status.html', {
         'appointments': appointments,
         'title': title,
         'status_filter': status_lower,
-       
+        'archived': archive is not None,
     })
 
 
-@login_required
+@login_required(role='DOCTOR')
 def doctor_profile(request):
-    if request.user.role != 'DOCTOR':
-        return redirect('patient_dashboard')
-   
-    profile = DoctorProfile.objects.get(user=request.user)
+    profile = request.profile
     return render(request, 'doctor/profile.html', {'profile': profile})
 
 
-@login_required
+@login_required(role='DOCTOR')
 def doctor_profile_edit(request):
-    if request.user.role != 'DOCTOR':
-        return redirect('patient_dashboard')
-   
-    profile = DoctorProfile.objects.get(user=request.user)
+    profile = request.profile
     
     if request.method == 'POST':
         request.user.username = request.POST.get('name', request.user.username)
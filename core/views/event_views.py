@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.http import StreamingHttpResponse, HttpResponseForbidden
+
+from core.decorator import login_required
+from core.events import broker, channel_name, format_event
+from core.middleware import get_profile
+
+
+async def event_stream(subscription):
+    try:
+        yield f"retry: {settings.SSE_RETRY_MS}\n\n"
+        while True:
+            event = await subscription.next_event(settings.SSE_HEARTBEAT)
+            # a comment line keeps proxies from closing an idle stream
+            yield ": ping\n\n" if event is None else format_event(event)
+    finally:
+        # the client went away: ASGI cancels the stream
+        broker.unsubscribe(subscription)
+
+
+@login_required
+async def appointment_events(request):
+    """
+    Server-sent events about the caller's appointments: a doctor hears about
+    every new, updated, deleted or expired request, a patient about status
+    changes. "changed" means something changed that the stream cannot
+    describe (a write by another process): refetch.
+
+    Needs an ASGI server; under WSGI the stream would hold a worker forever.
+    """
+    user = await request.auser()
+    profile = get_profile(user)  # arrived with the user, no query
+    if not profile:
+        return HttpResponseForbidden("Only doctors and patients have appointments.")
+
+    subscription = broker.subscribe(channel_name(user.role, profile.pk), profile.appointments_changed_at)
+    response = StreamingHttpResponse(event_stream(subscription), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # no proxy buffering (nginx)
+    return response
@@ -0,0 +1,121 @@
+import csv
+import heapq
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router
+from django.http import StreamingHttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from core.decorator import login_required
+from core.routers import read_replica
+from core.archive import wants_archive
+from core.models import Appointment, ArchivedAppointment
+from core.sharding import across_shards, is_sharded
+from core.slots import day_start
+
+EXPORT_FIELDS = [
+    "id", "date", "status", "doctor", "specialization", "patient", "patient_email",
+    "reason", "doctor_message", "rejection_message",
+]
+
+
+class Echo:
+    """File-like object whose write() hands the line back, for csv.writer over a stream."""
+
+    def write(self, value):
+        return value
+
+
+def export_row(appt):
+    return {
+        "id": appt.id,
+        "date": timezone.localtime(appt.date).isoformat(),
+        "status": appt.current_status,
+        "doctor": appt.doctor.user.username,
+        "specialization": appt.doctor.specialization,
+        "patient": appt.patient.user.username,
+        "patient_email": appt.patient.user.email,
+        "reason": appt.reason,
+        "doctor_message": appt.doctor_message,
+        "rejection_message": appt.current_rejection_message,
+    }
+
+
+def stream_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow([row[field] for field in EXPORT_FIELDS])
+
+
+def stream_json(rows):
+    yield "["
+    for i, row in enumerate(rows):
+        yield ("," if i else "") + "\n" + json.dumps(row)
+    yield "\n]\n"
+
+
+@read_replica
+@login_required
+def export_appointments(request):
+    """
+    Appointment history as CSV (default) or JSON (?format=json), streamed.
+
+    Doctors get their own appointments, patients theirs, admins everyone's
+    (optionally ?doctor=<id> / ?patient=<id>). Filter with ?status= and
+    ?from= / ?to= (YYYY-MM-DD, inclusive, clinic time); ?archived=1 adds the
+    archived appointments. Rows are read with .iterator() and written as
+    they arrive, so memory stays flat.
+    """
+    filters = {}
+    if request.user.is_superuser:
+        if request.GET.get("doctor", "").isdigit():
+            filters["doctor_id"] = request.GET["doctor"]
+        if request.GET.get("patient", "").isdigit():
+            filters["patient_id"] = request.GET["patient"]
+    elif request.user.role == "DOCTOR" and request.profile:
+        filters["doctor"] = request.profile
+    elif request.user.role == "PATIENT" and request.profile:
+        filters["patient"] = request.profile
+    else:
+        return HttpResponseForbidden("No appointment history to export.")
+
+    status = request.GET.get("status", "").upper()
+    if status and status not in ("PENDING", "APPROVED", "REJECTED"):
+        return HttpResponseBadRequest("status must be pending, approved or rejected.")
+
+    for param, lookup, shift in (("from", "date__gte", 0), ("to", "date__lt", 1)):
+        value = request.GET.get(param)
+        if value:
+            day = parse_date(value)
+            if day is None:
+                return HttpResponseBadRequest(f"{param} must be a date (YYYY-MM-DD).")
+            filters[lookup] = day_start(day + timedelta(days=shift))
+
+    # the rows are read after the view returns: pick the database now
+    # (with sharding on, every shard is read and merged)
+    db = router.db_for_read(Appointment)
+
+    # the archive holds older rows with their own ids: merge both in date order
+    models = [Appointment, ArchivedAppointment] if wants_archive(request) else [Appointment]
+    sources = []
+    for model in models:
+        appointments = model.objects.select_related("doctor__user", "patient__user").filter(**filters)
+        if status:
+            appointments = appointments.with_status(status)
+        appointments = appointments.order_by("date", "id")
+        shards = across_shards(appointments) if is_sharded() else [appointments.using(db)]
+        sources += [shard.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE) for shard in shards]
+    rows = (export_row(appt) for appt in heapq.merge(*sources, key=lambda appt: (appt.date, appt.id)))
+
+    if request.GET.get("format") == "json":
+        response = StreamingHttpResponse(stream_json(rows), content_type="application/json")
+        extension = "json"
+    else:
+        response = StreamingHttpResponse(stream_csv(rows), content_type="text/csv")
+        extension = "csv"
+    response["Content-Disposition"] = f'attachment; filename="appointments.{extension}"'
+    return response
@@ -1,14 +1,23 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth import authenticate, login
-from core.decorator import login_required
+from core.decorator import login_required, map_availability_days
+from core.routers import read_replica
 from django.utils import timezone
-from core.models import User, PatientProfile, DoctorProfile, Appointment
-from django.db.models import Q, Count
+from core.models import User, PatientProfile, DoctorProfile, Appointment, ArchivedAppointment
+from core.archive import wants_archive
+from core.counters import dashboard_summary
+from core.pagination import keyset_paginate
+from core.slots import next_free_slots
+from core.search import specialization_facets
+from core.sharding import doctor_db, first_across_shards
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.http import Http404, JsonResponse
+from django.db.models import Q, Count, F
 from django.utils.timezone import now
 from django.utils.dateparse import parse_datetime
 from datetime import datetime, timedelta
-from .common_views import update_outdated_appointments
 import pytz
 
 india_tz = pytz.timezone('Asia/Kolkata')
@@ -59,58 +68,72 @@ def patient_login(request):
 
 
 # ---------- Patient Side ----------
-@login_required
+@read_replica
+@login_required(role='PATIENT')
 def patient_dashboard(request):
-    if request.user.role != 'PATIENT':
-        return redirect('doctor_dashboard')
-    
-    update_outdated_appointments()
-    
-    profile = PatientProfile.objects.get(user=request.user)
-    counts = Appointment.objects.filter(patient=profile).values('status').annotate(c=Count('id'))
-    by_status = {row['status']: row['c'] for row in counts}
+    profile = request.profile
+    by_status = dashboard_summary('patient', profile.id)
 
-    upcoming = Appointment.objects.filter(
-        patient=profile,
+    return render(request, 'patient/dashboard.html', {'by_status': by_status,"upcoming": by_status['upcoming']})
 
-        status="APPROVED",
-        date__gte=now()
-    ).order_by("date").first()
-    
-    return render(request, 'patient/dashboard.html', {'by_status': by_status,"upcoming": upcoming})
-
-
-@login_required
-def make_appointment(request):
-    if request.user.role != 'PATIENT':
-        return redirect('doctor_dashboard')
-        
 
+def doctor_directory(request):
+    """Doctors matching ?q=, ?specialization= and ?day=, plus the filter values."""
     q = request.GET.get('q', '').strip()
-    doctors = DoctorProfile.objects.select_related('user').all()
+    specialization = request.GET.get('specialization', '').strip()
+    doctors = DoctorProfile.objects.select_related('user').order_by('search_text', 'id')
     
     if q:
-        doctors = doctors.filter(
-            Q(user__username__icontains=q) | Q(specialization__icontains=q)
-        )
-    
+        doctors = doctors.search(q)
+    if specialization:
+        doctors = doctors.filter(specialization=specialization)
+    day = request.GET.get('day', '')
+    if day.isdigit() and int(day) < 7:
+        doctors = doctors.available_on(int(day))
+    return doctors, {'q': q, 'specialization': specialization, 'day': day}
+
+
+def make_appointment_context(request, filters, page, specializations):
+    query = request.GET.copy()
+    query.pop('page', None)
     now=timezone.localtime(timezone.now())
-    
-    return render(request, 'patient/make_appointment.html', {
-        'q': q,
-        'doctors': doctors,
+    return {
+        **filters,
+        'specializations': specializations,
+        'weekdays': list(enumerate(map_availability_days(range(7)))),
+        'doctors': page,
+        'page_query': query.urlencode(),
         'now': now.strftime("%Y-%m-%dT%H:%M"),
-        
-    })
+    }
 
-@login_required
-def doctor_detail(request, doctor_id):
-    if request.user.role != 'PATIENT':
-        return redirect('doctor_dashboard')
 
+@read_replica
+@login_required(role='PATIENT')
+def make_appointment(request):
+    doctors, filters = doctor_directory(request)
+    page = Paginator(doctors, settings.DOCTORS_PAGE_SIZE).get_page(request.GET.get('page'))
+    return render(request, 'patient/make_appointment.html',
+                  make_appointment_context(request, filters, page, specialization_facets()))
+
+
+@login_required(role='PATIENT')
+def doctor_autocomplete(request):
+    """Up to 10 {id, name, specialization} matches for the search box."""
+    q = request.GET.get('q', '').strip()
+    if len(q) < 2:
+        return JsonResponse({'results': []})
+
+    results = DoctorProfile.objects.search(q).order_by('search_text').values(
+        'id', 'specialization', name=F('user__username')
+    )[:10]
+    return JsonResponse({'results': list(results)})
+
+@read_replica
+@login_required(role='PATIENT')
+def doctor_detail(request, doctor_id):
     doctor = get_object_or_404(DoctorProfile.objects.select_related('user'), pk=doctor_id)
 
-    approved_appointments = Appointment.objects.filter(
+    approved_appointments = Appointment.objects.using(doctor_db(doctor.id)).filter(
         doctor=doctor, status='APPROVED'
     ).select_related('patient__user').order_by('-date')
 
@@ -125,16 +148,10 @@ def doctor_detail(request, doctor_id):
     })
 
 
-@login_required
+@login_required(role='PATIENT')
 def request_appointment(request, doctor_id):
-
-    if request.user.role != 'PATIENT':
-        return redirect('doctor_dashboard')
-
     doctor = get_object_or_404(DoctorProfile.objects.select_related('user'), pk=doctor_id)
-
-   
-    patient_profile, created = PatientProfile.objects.get_or_create(user=request.user)
+    patient_profile = request.profile or PatientProfile.objects.create(user=request.user)
 
     now = timezone.now().astimezone(india_tz)
 
@@ -155,19 +172,16 @@ def request_appointment(request, doctor_id):
 
           # --- Check if doctor is available on this day ---
         if not doctor.is_available_on(date):
-            next_available = None
-            
-            for i in range(1, 8):  # next 7 days
-                check_date = date + timedelta(days=i)
-                
-                if doctor.is_available_on(check_date):
-                    next_available = check_date.strftime("%A, %d %b %Y")
-                    break
+            next_slot = next_free_slots([doctor], count=1)
+            if next_slot:
+                next_available = timezone.localtime(next_slot[0][0]).strftime("%A, %d %b %Y %I:%M %p")
+            else:
+                next_available = "not within the next few weeks"
            
             messages.error(
                 request,
                 f"Doctor is not available on {date.strftime('%A')}. "
-                f"Next available day is {next_available}."
+                f"Next free slot is {next_available}."
             )
             
             return redirect("doctor_detail", doctor_id=doctor.id)
@@ -209,72 +223,102 @@ def request_appointment(request, doctor_id):
         "now": now
     })
 
-@login_required
-def patient_history(request):
-    if request.user.role != 'PATIENT':
-        return redirect('doctor_dashboard')
+def _slots_response(request, doctors):
+    try:
+        count = min(max(int(request.GET.get('n', 5)), 1), 50)
+        days = max(int(request.GET.get('days', 0)), 0) or None
+    except ValueError:
+        return JsonResponse({'error': 'n and days must be integers.'}, status=400)
+
+    slots = next_free_slots(doctors, count=count, days=days)
+    return JsonResponse({'slots': [
+        {
+            'doctor_id': doctor.id,
+            'doctor_name': doctor.user.username,
+            'specialization': doctor.specialization,
+            'start': timezone.localtime(slot).isoformat(),
+        }
+        for slot, doctor in slots
+    ]})
+
+
+@login_required(role='PATIENT')
+def doctor_free_slots(request, doctor_id):
+    """Next free slots of one doctor: ?n=<how many>&days=<horizon>."""
+    doctor = get_object_or_404(DoctorProfile.objects.select_related('user'), pk=doctor_id)
+    return _slots_response(request, [doctor])
 
-    patient = PatientProfile.objects.get(user=request.user)
-    
-    update_outdated_appointments()
 
-    approved = Appointment.objects.filter(
-        patient=patient, status='APPROVED'
-    ).select_related('doctor__user').order_by('-date')
+@login_required(role='PATIENT')
+def free_slots_search(request):
+    """Earliest free slots with any doctor of ?specialization=... (at most SLOT_SEARCH_MAX_DOCTORS of them)."""
+    specialization = request.GET.get('specialization', '').strip()
+    if not specialization:
+        return JsonResponse({'error': 'specialization is required.'}, status=400)
+
+    doctors = DoctorProfile.objects.select_related('user').filter(
+        specialization__iexact=specialization, availability_mask__gt=0
+    ).order_by('id')[:settings.SLOT_SEARCH_MAX_DOCTORS]
+    return _slots_response(request, doctors)
+
 
-    rejected = Appointment.objects.filter(
-        patient=patient, status='REJECTED'
-    ).select_related('doctor__user').order_by('-date')
+@read_replica
+@login_required(role='PATIENT')
+def patient_history(request):
+    patient = request.profile
+    
 
-    pending = Appointment.objects.filter(
-        patient=patient, status='PENDING'
-    ).select_related('doctor__user').order_by('-date')
+    appointments = Appointment.objects.filter(patient=patient).select_related('doctor__user')
+
+    # each tab pages on its own cursor
+    approved = keyset_paginate(request, appointments.approved(), param='approved_after', tab='approved')
+    rejected = keyset_paginate(request, appointments.rejected(), param='rejected_after', tab='rejected')
+    pending = keyset_paginate(request, appointments.pending(), param='pending_after', tab='pending')
 
     return render(request, 'patient/history.html', {
         'approved': approved,
         'rejected': rejected,
         'pending': pending,
+        'counts': dashboard_summary('patient', patient.id),
+        'active_tab': request.GET.get('tab', 'approved'),
     })
 
 
-@login_required
+@read_replica
+@login_required(role='PATIENT')
 def patient_history_status(request, status):
-    patient = request.user.patient_profile
-
-    update_outdated_appointments()
-
     """Show only appointments of a specific status for the logged-in patient."""
     status_upper = status.upper() 
     # Ensure valid status
     if status_upper not in ["PENDING", "APPROVED", "REJECTED"]:
         status_upper = "PENDING"
 
-    appointments = Appointment.objects.filter(
-        patient=request.user.patient_profile,
-        status=status_upper
-    ).select_related('doctor__user').order_by("-date")
+    appointments, archive = patient_appointments_with_status(request, status_upper)
+    appointments = keyset_paginate(request, appointments, archive=archive)
 
     return render(request, "patient/patient_history_status.html", {
         "appointments": appointments,
         "status": status_upper,
+        "archived": archive is not None,
     })
 
 
-@login_required
+def patient_appointments_with_status(request, status_upper):
+    """The patient's appointments of one status, and the archived ones when asked for (else None)."""
+    def of(model):
+        return model.objects.filter(patient=request.profile).with_status(status_upper).select_related('doctor__user')
+    return of(Appointment), of(ArchivedAppointment) if wants_archive(request) else None
+
+
+@login_required(role='PATIENT')
 def patient_profile(request):
-   
-    if request.user.role != 'PATIENT':
-        return redirect('doctor_dashboard')
-    
-    profile = PatientProfile.objects.get(user=request.user)
+    profile = request.profile
     return render(request, 'patient/profile.html', {'profile': profile})
 
 
-@login_required
+@login_required(role='PATIENT')
 def patient_profile_edit(request):
-    if request.user.role != 'PATIENT':
-        return redirect('doctor_dashboard')
-    profile = PatientProfile.objects.get(user=request.user)
+    profile = request.profile
     
     if request.method == 'POST':
         request.user.username = request.POST.get('name', request.user.username)
@@ -301,14 +345,16 @@ def patient_profile_edit(request):
 @login_required
 def edit_appointment(request, appointment_id):
 
-    update_outdated_appointments()
-    appointment = get_object_or_404(Appointment, id=appointment_id)
+    # the patient's appointment could be on any doctor's shard
+    appointment = first_across_shards(Appointment.objects.select_related('doctor__user').filter(id=appointment_id))
+    if appointment is None:
+        raise Http404("No appointment matches the given query.")
     
-    if request.user.role != 'PATIENT' or appointment.patient.user != request.user:
+    if request.user.role != 'PATIENT' or appointment.patient_id != request.profile.id:
         messages.error(request, "You are not allowed to edit this appointment.")
         return redirect('patient_history')
     
-    if appointment.status != "PENDING":
+    if appointment.current_status != "PENDING":
         messages.error(request, "You cannot edit this appointment as it is already processed.")
         return redirect('patient_history')
 
@@ -330,18 +376,20 @@ def edit_appointment(request, appointment_id):
             messages.error(request, "Please select a future date and time.")
             return redirect('edit_appointment', appointment_id=appointment.id)
 
-        conflict_exists = Appointment.objects.filter(
-            patient=appointment.patient,
-            doctor=appointment.doctor,
-            date__date=new_date.date(),
-            status__in=["PENDING", "APPROVED"]
-        ).exclude(id=appointment.id).exists()
+        appointment.date = new_date
+        conflict = appointment.has_conflict()
 
-        if conflict_exists:
-            messages.error(request, "You already have an appointment with this doctor on the same day.")
+        if conflict:
+            if conflict["type"] == "PATIENT_CONFLICT":
+                messages.error(request, "You already have an appointment with this doctor on the same day.")
+            else:
+                messages.error(
+                    request,
+                    f"Dr. {conflict['doctor_name']} already has an appointment at this time. "
+                    f"Please choose another slot."
+                )
             return redirect('edit_appointment', appointment_id=appointment.id)
         
-        appointment.date = new_date
         appointment.reason = reason
         appointment.save()
         messages.success(request, "Your appointment request has been updated!")
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "medibook.settings")
+# read-only pages use their async views under ASGI (ASYNC_VIEWS=0 to opt out)
+os.environ.setdefault("ASYNC_VIEWS", "1")
 
 application = get_asgi_application()
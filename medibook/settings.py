@@ -26,12 +26,22 @@ INSTALLED_APPS = [
 ]
 AUTH_USER_MODEL = 'core.User' 
 
+# ProfileBackend loads the user with its doctor/patient profile in one query;
+# ModelBackend stays listed so sessions created before it keep working
+AUTHENTICATION_BACKENDS = [
+    'core.backends.ProfileBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 MIDDLEWARE = [
+    "core.middleware.RequestTimingMiddleware",
+    "core.middleware.ReplicaMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "core.middleware.ProfileMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -68,9 +78,150 @@ DATABASES = {
     }
 }
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # take the write lock at BEGIN so concurrent write transactions (e.g. two
+    # approvals) queue up instead of failing with "database is locked"
+    DATABASES['default']['OPTIONS'] = {'transaction_mode': 'IMMEDIATE'}
+
+# Read replicas: DB_REPLICAS is a comma-separated list of hosts (with SQLite,
+# database files) holding copies of the default database, added as
+# replica1, replica2, ... The dashboards, histories, doctor directory and
+# exports read from them; see core/routers.py.
+READ_REPLICAS = []
+for i, location in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), 1):
+    key = 'NAME' if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3' else 'HOST'
+    DATABASES[f'replica{i}'] = {**DATABASES['default'], key: location.strip(), 'TEST': {'MIRROR': 'default'}}
+    READ_REPLICAS.append(f'replica{i}')
+
+# Sharding: DB_SHARDS lists more databases (hosts, or SQLite files) that share
+# the appointments with the default one, added as shard1, shard2, ... A
+# doctor's appointments live on APPOINTMENT_SHARDS[doctor id % number of
+# shards]. Migrate each one (`manage.py migrate --database shard1`) and run
+# `manage.py rebalance_shards` after changing the list; see core/sharding.py.
+APPOINTMENT_SHARDS = ['default']
+for i, location in enumerate(filter(None, os.environ.get('DB_SHARDS', '').split(',')), 1):
+    key = 'NAME' if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3' else 'HOST'
+    DATABASES[f'shard{i}'] = {**DATABASES['default'], key: location.strip()}
+    APPOINTMENT_SHARDS.append(f'shard{i}')
+# Databases taken off DB_SHARDS whose appointments rebalance_shards still has
+# to move away, added as retired1, retired2, ...
+RETIRED_SHARDS = []
+for i, location in enumerate(filter(None, os.environ.get('DB_RETIRED_SHARDS', '').split(',')), 1):
+    key = 'NAME' if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3' else 'HOST'
+    DATABASES[f'retired{i}'] = {**DATABASES['default'], key: location.strip()}
+    RETIRED_SHARDS.append(f'retired{i}')
+# appointment ids are reserved from the default database this many at a time
+SHARD_ID_BLOCK = 100
+
+DATABASE_ROUTERS = ['core.routers.ShardRouter', 'core.routers.ReplicaRouter']
+
+# A replica more than REPLICA_LAG_TOLERANCE seconds behind the primary is
+# skipped; each process checks the lag every REPLICA_LAG_CHECK_INTERVAL
+# seconds. A browser that wrote reads from the primary for the sum of both.
+REPLICA_LAG_TOLERANCE = int(os.environ.get('REPLICA_LAG_TOLERANCE', 5))
+REPLICA_LAG_CHECK_INTERVAL = 5
+
+
+
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+# Cache per-doctor / per-patient dashboard counters. Only turn this on with a
+# cache shared by every worker (e.g. Redis), otherwise invalidations are per process.
+DASHBOARD_COUNTER_CACHE = os.environ.get('DASHBOARD_COUNTER_CACHE') == '1'
+DASHBOARD_COUNTER_CACHE_TIMEOUT = 300
+
+# Bookable slots: clinic hours (local time) and slot length.
+CLINIC_OPEN_HOUR = int(os.environ.get('CLINIC_OPEN_HOUR', 9))
+CLINIC_CLOSE_HOUR = int(os.environ.get('CLINIC_CLOSE_HOUR', 17))
+SLOT_MINUTES = 30
+# Cache the per-doctor day schedules behind conflict checks (core.slots) for
+# SLOT_INDEX_TIMEOUT seconds. Like DASHBOARD_COUNTER_CACHE, only turn this on
+# with a cache shared by every worker and the expiry worker: a process-local
+# copy would go on accepting bookings that clash with another worker's writes.
+DAY_SCHEDULE_CACHE = os.environ.get('DAY_SCHEDULE_CACHE') == '1'
+SLOT_INDEX_TIMEOUT = 600
+# how far ahead the free-slot search looks by default, and at most
+SLOT_SEARCH_DAYS = 14
+SLOT_SEARCH_MAX_DAYS = 60
+# a specialization search looks at this many of its doctors (lowest ids first)
+SLOT_SEARCH_MAX_DOCTORS = int(os.environ.get('SLOT_SEARCH_MAX_DOCTORS', 50))
+
+# rows per page on the appointment history pages
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', 20))
+
+# manage.py archive_appointments moves appointments dated more than
+# ARCHIVE_AFTER_DAYS ago (rejected and expired ones: ARCHIVE_REJECTED_AFTER_DAYS)
+# to the archive table; history pages and exports read it with ?archived=1
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 180))
+ARCHIVE_REJECTED_AFTER_DAYS = int(os.environ.get('ARCHIVE_REJECTED_AFTER_DAYS', 30))
+
+# rows fetched per round trip by the streaming appointment export
+EXPORT_CHUNK_SIZE = 2000
+
+# bulk account import: rows per transaction, and processes hashing passwords
+# for `manage.py import_accounts` (0 or 1 hashes in the importing process).
+# The admin upload always hashes in the web process.
+IMPORT_BATCH_SIZE = 500
+IMPORT_HASH_WORKERS = int(os.environ.get('IMPORT_HASH_WORKERS', os.cpu_count() or 1))
+
+# The JSON API answers unchanged polls with 304. Appointment responses also
+# change every API_TIME_WINDOW seconds, since pending requests expire without
+# a write; this bounds how long a 304 can hide an expiry.
+API_TIME_WINDOW = int(os.environ.get('API_TIME_WINDOW', 60))
 
+# Serve dashboards, histories, make_appointment and doctor_detail with their
+# async views (core/views/async_views.py). medibook/asgi.py turns this on.
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS') == '1'
 
+# Server-sent appointment events (/events/appointments/, ASGI only). Writes
+# from other processes and expiries are picked up every SSE_POLL_INTERVAL
+# seconds; idle streams get a keep-alive comment every SSE_HEARTBEAT seconds.
+SSE_POLL_INTERVAL = int(os.environ.get('SSE_POLL_INTERVAL', 5))
+SSE_HEARTBEAT = 15
+SSE_RETRY_MS = 5000
+# events buffered for a slow client before it is told to refetch instead
+SSE_QUEUE_SIZE = 100
 
+# doctor directory on the "make appointment" page
+DOCTORS_PAGE_SIZE = 20
+
+# pending doctor registrations on the admin dashboard
+PENDING_DOCTORS_PAGE_SIZE = 50
+# admin reports (core.stats): doctors per page, and the days shown by default
+REPORT_DOCTORS_PAGE_SIZE = 50
+REPORT_DAYS = 30
+DOCTOR_FACETS_TIMEOUT = 3600
+# Django admin changelists (core.pagination.EstimatedCountPaginator): tables
+# past this many rows show the planner's row estimate instead of running
+# COUNT(*), and filtered lists stop counting here (shown as "10000+", with
+# only the first rows reachable).
+ADMIN_COUNT_LIMIT = int(os.environ.get('ADMIN_COUNT_LIMIT', 10000))
+
+# Per-request SQL/template timing (Server-Timing header, "core.timing" log,
+# `manage.py request_timing`). Off unless REQUEST_TIMING=1. A request running
+# one statement shape more than REQUEST_TIMING_REPEAT_THRESHOLD times is
+# flagged as a likely N+1. Route stats are kept in the cache, so use a shared
+# cache backend to see every worker's requests from the command.
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING') == '1'
+REQUEST_TIMING_REPEAT_THRESHOLD = int(os.environ.get('REQUEST_TIMING_REPEAT_THRESHOLD', 5))
+REQUEST_TIMING_SAMPLES = 500
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "core.timing": {"handlers": ["console"], "level": "INFO", "propagate": False},
+    },
+}
 
 
 AUTH_PASSWORD_VALIDATORS = [